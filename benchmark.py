@@ -0,0 +1,463 @@
+import dataclasses
+import os
+import subprocess
+import sys
+import time
+
+import click
+import numpy as np
+import torch
+
+import codecraft
+from codecraft import ObsConfig
+from gym_codecraft.envs.codecraft_vec_env import CodeCraftVecEnv, DEFAULT_OBS_CONFIG, MapPool, Objective, \
+    map_mp, map_mp_batch, map_standard, map_standard_batch
+from gym_codecraft.envs.subproc_vec_env import SubprocCodeCraftVecEnv
+from gae import gae_returns
+from mock_server import MockCodeCraftServer
+from rollout import RolloutBuffer
+
+
+NOOP = (False, 0, [], False, False, False)
+# Observations of the size used by the standard objective
+STANDARD_OBS_CONFIG = ObsConfig(allies=15, drones=30, minerals=5, tiles=5, global_drones=15,
+                                feat_map_size=True, feat_abstime=True, feat_is_visible=True)
+
+
+@click.group()
+def benchmark():
+    pass
+
+
+@benchmark.command()
+@click.option('--num_envs', default=64)
+@click.option('--steps', default=500)
+@click.option('--game_length', default=10 * 60 * 60)
+def client(num_envs, steps, game_length):
+    """Compares env steps/s of the pooled CodeCraftClient with the module level functions."""
+    obs_config = DEFAULT_OBS_CONFIG
+    pooled = codecraft.CodeCraftClient()
+
+    def run(name, create_game, act_batch, observe_batch_raw):
+        games = [(create_game(game_length), 0) for _ in range(num_envs)]
+        actions = [(game_id, player_id, [NOOP] * obs_config.allies) for game_id, player_id in games]
+        start = time.time()
+        for _ in range(steps):
+            act_batch(actions)
+            observe_batch_raw(games)
+        elapsed = time.time() - start
+        print(f'{name:>8}: {steps / elapsed:8.1f} steps/s  {steps * num_envs / elapsed:10.1f} env steps/s')
+
+    run('module',
+        codecraft.create_game,
+        codecraft.act_batch,
+        lambda games: codecraft.observe_batch_raw(obs_config,
+                                                  games,
+                                                  allies=obs_config.allies,
+                                                  drones=obs_config.drones,
+                                                  minerals=obs_config.minerals,
+                                                  tiles=obs_config.tiles,
+                                                  global_drones=obs_config.global_drones,
+                                                  relative_positions=obs_config.relative_positions,
+                                                  v2=True,
+                                                  extra_build_actions=[]))
+    run('client',
+        pooled.create_game,
+        pooled.act_batch,
+        lambda games: pooled.observe_batch_raw(obs_config, games, extra_build_actions=[]))
+    pooled.close()
+
+
+@benchmark.command()
+@click.option('--num_envs', default=128)
+@click.option('--create_latency', default=0.002, help='Seconds the mock server spends creating each game')
+@click.option('--repeats', default=5)
+def create_games(num_envs, create_latency, repeats):
+    """Compares creating games one by one with bulk creation and the concurrent fallback on a mock server."""
+    env = CodeCraftVecEnv(num_envs, num_envs // 4, Objective.STANDARD, 0, randomize=True, hardness=10)
+    games = [args for _, _, args in env._initial_games()]
+
+    def run(name, batch_start_game, create):
+        server = MockCodeCraftServer(port=0, batch_start_game=batch_start_game, create_latency=create_latency).start()
+        client = codecraft.CodeCraftClient(server.endpoint)
+        create(client)
+        start = time.time()
+        for _ in range(repeats):
+            create(client)
+        elapsed = (time.time() - start) / repeats
+        print(f'{name:>10}: {1000 * elapsed:8.1f}ms per reset of {len(games)} games')
+        client.close()
+        server.stop()
+
+    run('sequential', True, lambda client: [client.create_game(**game) for game in games])
+    run('bulk', True, lambda client: client.create_games(games))
+    run('fallback', False, lambda client: client.create_games(games))
+
+
+@benchmark.command()
+@click.option('--num_envs', default=128)
+@click.option('--drones', default=15)
+@click.option('--steps', default=200)
+def act(num_envs, drones, steps):
+    """Compares binary and JSON encoded actions on a mock server."""
+    obs_config = ObsConfig(allies=drones, drones=drones, minerals=10, tiles=0, global_drones=drones)
+    naction = CodeCraftVecEnv(1, 0, Objective.STANDARD, 0, obs_config=obs_config).base_naction
+    actions = np.random.randint(0, naction, size=(steps, num_envs, drones))
+
+    def run(name, binary_actions):
+        server = MockCodeCraftServer(port=0, binary_actions=binary_actions).start()
+        client = codecraft.CodeCraftClient(server.endpoint)
+        env = CodeCraftVecEnv(num_envs, 0, Objective.STANDARD, 0, obs_config=obs_config, client=client)
+        env.reset()
+        env.step_async(actions[0])
+        start = time.time()
+        for step_actions in actions:
+            env.step_async(step_actions)
+        elapsed = time.time() - start
+        print(f'{name:>6}: {1000 * elapsed / steps:8.2f}ms per step_async')
+        client.close()
+        server.stop()
+
+    run('binary', True)
+    run('json', False)
+
+
+@benchmark.command(name='env')
+@click.option('--num_envs', default=64)
+@click.option('--num_self_play', default=16)
+@click.option('--steps', default=500)
+@click.option('--objective', default='ARENA_TINY_2V2')
+@click.option('--episode_length', default=200, help='Length of episodes on the mock server')
+@click.option('--endpoint', default=None, help='Use a running server instead of an in-process mock server')
+def vec_env(num_envs, num_self_play, steps, objective, episode_length, endpoint):
+    """Measures steps/s of CodeCraftVecEnv and the latency of each type of request."""
+    server = None
+    if endpoint is None:
+        server = MockCodeCraftServer(port=0, episode_length=episode_length).start()
+        endpoint = server.endpoint
+    client = codecraft.CodeCraftClient(endpoint)
+    env = CodeCraftVecEnv(num_envs, num_self_play, Objective(objective), 0, client=client)
+    naction = env.base_naction + env.obs_config.extra_actions()
+
+    _, action_masks, _ = env.reset()
+    metrics = codecraft.request_metrics
+    metrics.enabled = True
+    metrics.reset()
+    episodes = 0
+    start = time.time()
+    for _ in range(steps):
+        actions = np.random.randint(0, naction, size=(num_envs, env.obs_config.allies))
+        _, _, _, infos, action_masks, _ = env.step(actions, action_masks=action_masks)
+        episodes += len(infos)
+    elapsed = time.time() - start
+
+    print(f'{steps / elapsed:.1f} steps/s  {steps * num_envs / elapsed:.1f} env steps/s  {episodes} episodes')
+    print(f'{"request":>18}  {"count":>6}  {"p50":>8}  {"p90":>8}  {"p99":>8}  {"received":>10}')
+    for name, histogram in sorted(metrics.latencies.items()):
+        p50, p90, p99 = [1000 * histogram.percentile(q) for q in [50, 90, 99]]
+        received = metrics.bytes_received[name] / histogram.count / 1e3
+        print(f'{name:>18}  {histogram.count:6}  {p50:6.2f}ms  {p90:6.2f}ms  {p99:6.2f}ms  {received:8.1f}KB')
+    env.close()
+    if server is not None:
+        server.stop()
+
+
+@benchmark.command()
+@click.option('--num_envs', default=64)
+@click.option('--steps', default=500)
+@click.option('--episode_length', default=50)
+@click.option('--create_latency', default=0.01, help='Seconds the mock server spends creating each game')
+@click.option('--pool_size', default=4)
+def game_pool(num_envs, steps, episode_length, create_latency, pool_size):
+    """Compares step latency with replacement games created on episode end and taken from a game pool."""
+    def run(name, game_pool_size):
+        server = MockCodeCraftServer(port=0, create_latency=create_latency).start()
+        client = codecraft.CodeCraftClient(server.endpoint)
+        env = CodeCraftVecEnv(num_envs, num_envs // 4, Objective.ARENA_TINY_2V2, 0, client=client,
+                              game_pool_size=game_pool_size)
+        # Staggers the lengths of the initial games so that episodes end at different steps
+        env.game_length = episode_length
+        _, action_masks, _ = env.reset()
+        actions = np.full((num_envs, env.obs_config.allies), 4)
+        latencies = []
+        for _ in range(steps):
+            start = time.time()
+            _, _, _, _, action_masks, _ = env.step(actions, action_masks=action_masks)
+            latencies.append(time.time() - start)
+        p50, p99, max = 1000 * np.percentile(latencies, [50, 99, 100])
+        print(f'{name:>8}: {steps / sum(latencies):7.1f} steps/s  p50 {p50:6.2f}ms  p99 {p99:6.2f}ms  max {max:6.2f}ms')
+        if env.game_pool is not None:
+            env.game_pool.close()
+        client.close()
+        server.stop()
+
+    run('no pool', 0)
+    run('pool', pool_size)
+
+
+@benchmark.command()
+@click.option('--count', default=5000)
+@click.option('--batch_size', default=64)
+@click.option('--hardness', default=10.0)
+@click.option('--per_step', default=4, help='Maps taken from the pool per simulated env step')
+def maps(count, batch_size, hardness, per_step):
+    """Compares maps/s of the map generators, their batched variants and a background map pool."""
+    np.random.seed(0)
+    for name, generate, generate_batch in [('standard', map_standard, map_standard_batch),
+                                           ('mp', map_mp, map_mp_batch)]:
+        start = time.time()
+        for _ in range(count):
+            generate(True, hardness, False)
+        print(f'{name + " inline":>16}: {count / (time.time() - start):9.1f} maps/s')
+
+        start = time.time()
+        for _ in range(count // batch_size):
+            generate_batch(batch_size, True, hardness, False)
+        print(f'{name + " batched":>16}: {count // batch_size * batch_size / (time.time() - start):9.1f} maps/s')
+
+        # Time spent by the caller with the pool refilled while the env waits on the server between steps
+        pool = MapPool(generate_batch, batch_size)
+        elapsed = 0.0
+        for _ in range(count // per_step):
+            start = time.time()
+            for _ in range(per_step):
+                pool.take(True, hardness, False)
+            elapsed += time.time() - start
+            time.sleep(0.001)
+        pool.close()
+        print(f'{name + " pool":>16}: {count // per_step * per_step / elapsed:9.1f} maps/s')
+
+
+@benchmark.command()
+@click.option('--sizes', default='32x64,128x128,128x512,256x1024', help='Comma separated seq_rostepsxnum_envs')
+@click.option('--repeats', default=5)
+def gae(sizes, repeats):
+    """Compares the per element GAE loop that main.train used with the vectorized gae_returns."""
+    def loop_returns(rewards, values, dones, final_values, gamma, lamb):
+        seq_rosteps, num_envs = rewards.shape
+        rewards, values, dones = rewards.reshape(-1), values.reshape(-1), dones.reshape(-1)
+        returns = np.zeros(len(rewards), dtype=np.float32)
+        last_gae = np.zeros(num_envs)
+        for t in reversed(range(seq_rosteps)):
+            for i in range(num_envs):
+                ti = t * num_envs + i
+                nextnonterminal = 1.0 - dones[ti]
+                next_value = final_values[i] if t == seq_rosteps - 1 else values[ti + num_envs]
+                td_error = rewards[ti] + gamma * next_value * nextnonterminal - values[ti]
+                last_gae[i] = td_error + gamma * lamb * last_gae[i] * nextnonterminal
+                returns[ti] = last_gae[i] + values[ti]
+        return returns
+
+    rng = np.random.RandomState(0)
+    for size in sizes.split(','):
+        seq_rosteps, num_envs = [int(n) for n in size.split('x')]
+        rewards = rng.normal(size=(seq_rosteps, num_envs)).astype(np.float32)
+        values = rng.normal(size=(seq_rosteps, num_envs)).astype(np.float32)
+        dones = (rng.uniform(size=(seq_rosteps, num_envs)) < 0.01).astype(np.float64)
+        final_values = rng.normal(size=num_envs).astype(np.float32)
+        tensors = [torch.tensor(array) for array in [rewards, values, dones, final_values]]
+        timings = []
+        for compute in [lambda: loop_returns(rewards, values, dones, final_values, 0.99, 0.95),
+                        lambda: gae_returns(rewards, values, dones, final_values, 0.99, 0.95),
+                        lambda: gae_returns(*tensors, 0.99, 0.95)]:
+            start = time.time()
+            for _ in range(repeats):
+                compute()
+            timings.append(1000 * (time.time() - start) / repeats)
+        loop, vectorized, torch_vectorized = timings
+        print(f'{seq_rosteps:>4}x{num_envs:<5}  loop {loop:8.2f}ms  numpy {vectorized:6.2f}ms ({loop / vectorized:5.0f}x)'
+              f'  torch {torch_vectorized:6.2f}ms ({loop / torch_vectorized:5.0f}x)')
+
+
+@benchmark.command()
+@click.option('--storage', type=click.Choice(['lists', 'buffer']), default='buffer')
+@click.option('--num_envs', default=64)
+@click.option('--seq_rosteps', default=256)
+@click.option('--agents', default=15)
+@click.option('--rollouts', default=3)
+def rollout(storage, num_envs, seq_rosteps, agents, rollouts):
+    """Stores rollouts of random samples in lists like main.train used to, or in a RolloutBuffer.
+
+    Peak RSS is per process, so compare the two storages in separate runs."""
+    import resource
+    obs_config = STANDARD_OBS_CONFIG
+    naction = Objective.ALLIED_WEALTH.naction() + obs_config.extra_actions()
+    obs = np.random.rand(num_envs, obs_config.stride()).astype(np.float32)
+    privileged_obs = np.zeros([num_envs, 1])
+    action_masks = np.ones([num_envs, obs_config.allies, naction], dtype=np.float32)
+    actions = np.random.randint(naction, size=[num_envs, agents])
+    logprobs = np.random.rand(num_envs, agents).astype(np.float32)
+    values = np.random.rand(num_envs).astype(np.float32)
+    probs = np.random.rand(num_envs, agents, naction).astype(np.float32)
+    rews = np.random.rand(num_envs).astype(np.float32)
+    dones = np.zeros(num_envs)
+    buffer = RolloutBuffer(seq_rosteps, num_envs, obs_config, agents, naction) if storage == 'buffer' else None
+
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for _ in range(rollouts):
+        if storage == 'buffer':
+            for step in range(seq_rosteps):
+                buffer.add(step, None, obs, privileged_obs, action_masks, actions, logprobs, values, probs)
+                buffer.add_rewards(step, None, rews, dones)
+            samples = [buffer.flat(name) for name in
+                       ['obs', 'privileged_obs', 'action_masks', 'actions', 'logprobs', 'values', 'probs',
+                        'rewards', 'dones']]
+        else:
+            lists = [[] for _ in range(9)]
+            for step in range(seq_rosteps):
+                for samples, array in zip(lists, [obs.copy(), privileged_obs, action_masks.copy(), actions, logprobs,
+                                                  values, probs, rews, dones]):
+                    samples.extend(array)
+            samples = [np.array(samples) for samples in lists]
+            samples[2] = samples[2][:, :agents, :]
+        del samples
+    elapsed = time.time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'{storage}: {1000 * elapsed / rollouts:.1f}ms per rollout, '
+          f'peak RSS {rss / 1024:.0f}MiB (+{(rss - rss_start) / 1024:.0f}MiB during rollouts)')
+
+
+@benchmark.command()
+@click.option('--num_envs', default=128)
+@click.option('--steps', default=500)
+@click.option('--port', default=9017)
+@click.option('--socket_path', default='/tmp/codecraft-benchmark.sock')
+def transport(num_envs, steps, port, socket_path):
+    """
+    Compares step latency and client CPU time of TCP loopback and a Unix domain socket.
+
+    The mock server runs in a separate process so that only the CPU time of the client is measured.
+    """
+    run_mock_server_process('tcp', f'http://127.0.0.1:{port}', ['--port', str(port)],
+                            STANDARD_OBS_CONFIG, num_envs, steps)
+    run_mock_server_process('unix', f'{codecraft.UNIX_SOCKET_PREFIX}{socket_path}', ['--socket-path', socket_path],
+                            STANDARD_OBS_CONFIG, num_envs, steps)
+
+
+@benchmark.command()
+@click.option('--num_envs', default=128)
+@click.option('--steps', default=500)
+@click.option('--port', default=9017)
+def encoding(num_envs, steps, port):
+    """Compares bytes received, step latency and client CPU time of the observation encodings."""
+    for obs_encoding in codecraft.OBS_ENCODINGS:
+        obs_config = dataclasses.replace(STANDARD_OBS_CONFIG, encoding=obs_encoding)
+        run_mock_server_process(obs_encoding, f'http://127.0.0.1:{port}', ['--port', str(port)],
+                                obs_config, num_envs, steps)
+
+
+@benchmark.command()
+@click.option('--num_envs', default=128)
+@click.option('--steps', default=300)
+@click.option('--num_workers', default='2,4')
+@click.option('--port', default=9017)
+def workers(num_envs, steps, num_workers, port):
+    """Compares steps/s of CodeCraftVecEnv with SubprocCodeCraftVecEnv on a mock server in a separate process."""
+    mock_server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_server.py')
+    server = subprocess.Popen([sys.executable, mock_server, '--port', str(port), '--episode-length', '200'])
+    endpoints = [f'http://127.0.0.1:{port}']
+    try:
+        codecraft.CodeCraftClient(endpoints[0], retry_delay=0.1).create_games([])
+        run_env_steps('single', CodeCraftVecEnv(num_envs, num_envs // 4, Objective.STANDARD, 0,
+                                                obs_config=STANDARD_OBS_CONFIG, endpoints=endpoints), steps)
+        for n in map(int, num_workers.split(',')):
+            run_env_steps(f'{n} workers', SubprocCodeCraftVecEnv(n, num_envs, num_envs // 4, Objective.STANDARD, 0,
+                                                                 obs_config=STANDARD_OBS_CONFIG, endpoints=endpoints),
+                          steps)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@benchmark.command()
+@click.option('--num_envs', default=128)
+@click.option('--steps', default=300)
+@click.option('--opponents', default='1,2,4')
+@click.option('--port', default=9017)
+def partitions(num_envs, steps, opponents, port):
+    """
+    Compares eval steps/s with a request per partition and a single round trip for all partitions, as the
+    number of opponent policies with their own observation config grows.
+    """
+    mock_server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_server.py')
+    server = subprocess.Popen([sys.executable, mock_server, '--port', str(port), '--episode-length', '200'])
+    client = codecraft.CodeCraftClient(f'http://127.0.0.1:{port}', retry_delay=0.1)
+    try:
+        for n in map(int, opponents.split(',')):
+            env = CodeCraftVecEnv(num_envs, num_envs // 2, Objective.ARENA_TINY_2V2, 0, stagger=False, client=client)
+            odds = list(range(1, num_envs, 2))
+            partitions = [(list(range(0, num_envs, 2)), env.obs_config)]
+            for i in range(n):
+                obs_config = dataclasses.replace(env.obs_config, allies=env.obs_config.allies + i)
+                partitions.append((odds[i * len(odds) // n:(i + 1) * len(odds) // n], obs_config))
+            env.reset(partitions)
+            actions = [(envs, obs_config, np.full((len(envs), obs_config.allies), 4))
+                       for envs, obs_config in partitions]
+
+            def separate():
+                for envs, _, partition_actions in actions:
+                    env.step_async(partition_actions, envs)
+                for envs, obs_config, _ in actions:
+                    env.observe(envs, obs_config)
+
+            for name, step in [('separate', separate), ('single', lambda: env.step_partitioned(actions))]:
+                start = time.time()
+                for _ in range(steps):
+                    step()
+                elapsed = time.time() - start
+                print(f'{n} opponents {name:>8}: {steps / elapsed:7.1f} steps/s')
+    finally:
+        client.close()
+        server.terminate()
+        server.wait()
+
+
+def run_env_steps(name, env, steps):
+    _, action_masks, _ = env.reset()
+    actions = np.full((env.num_envs, env.obs_config.allies), 4)
+    start = time.time()
+    for _ in range(steps):
+        _, _, _, _, action_masks, _ = env.step(actions, action_masks=action_masks)
+    elapsed = time.time() - start
+    print(f'{name:>10}: {steps / elapsed:7.1f} steps/s  {steps * env.num_envs / elapsed:9.1f} env steps/s')
+    env.close()
+
+
+def run_mock_server_process(name, endpoint, server_args, obs_config, num_envs, steps):
+    mock_server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_server.py')
+    server = subprocess.Popen([sys.executable, mock_server, '--episode-length', str(10 * steps)] + server_args)
+    client = codecraft.CodeCraftClient(endpoint, retry_delay=0.1)
+    received = []
+    request = client._request
+
+    def counting_request(*args, **kwargs):
+        response = request(*args, **kwargs)
+        received.append(int(response.headers.get('Content-Length', 0)))
+        return response
+    client._request = counting_request
+
+    try:
+        env = CodeCraftVecEnv(num_envs, 0, Objective.STANDARD, 0, obs_config=obs_config, client=client)
+        _, action_masks, _ = env.reset()
+        actions = np.full((num_envs, obs_config.allies), 4)
+        latencies = []
+        received.clear()
+        cpu_start = time.process_time()
+        for _ in range(steps):
+            start = time.time()
+            env.step(actions, action_masks=action_masks)
+            latencies.append(time.time() - start)
+        cpu = time.process_time() - cpu_start
+        p50, p90, p99 = 1000 * np.percentile(latencies, [50, 90, 99])
+        print(f'{name:>7}: {steps / sum(latencies):7.1f} steps/s  '
+              f'p50 {p50:6.2f}ms  p90 {p90:6.2f}ms  p99 {p99:6.2f}ms  '
+              f'cpu {1000 * cpu / steps:6.2f}ms/step  {sum(received) / steps / 1e6:.3f}MB/step')
+    finally:
+        client.close()
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,15 +1,32 @@
+import asyncio
+import functools
 import requests
+import requests.adapters
 import logging
+import math
+import socket
+import threading
 import time
 
 import orjson
 import numpy as np
+import urllib3
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 
 RETRIES = 100
+DEFAULT_ENDPOINT = 'http://localhost:9000'
+# Prefix of endpoints that are Unix domain sockets, e.g. unix:///tmp/codecraft.sock
+UNIX_SOCKET_PREFIX = 'unix://'
+OBS_ENCODINGS = ('float32', 'float16', 'int8')
+# Response header with the encoding of batch observations, servers that don't send it only support float32
+OBS_ENCODING_HEADER = 'X-Obs-Encoding'
+# Response header of partitioned batch observations with the length in bytes of each partition
+PARTITION_LENGTHS_HEADER = 'X-Partition-Lengths'
 
 
 @dataclass
@@ -31,6 +48,11 @@ class ObsConfig:
     harvest_action: bool = False
     lock_build_action: bool = False
     feat_dist_to_wall: bool = False
+    # Wire format of observations, one of OBS_ENCODINGS
+    encoding: str = 'float32'
+
+    def __post_init__(self):
+        assert self.encoding in OBS_ENCODINGS, f'Unknown observation encoding {self.encoding}'
 
     def global_features(self):
         gf = 2
@@ -101,6 +123,92 @@ class ObsConfig:
         else:
             return 0
 
+    def layout(self, naction: Optional[int] = None) -> 'ObsLayout':
+        """Returns the `ObsLayout` of observations with this config, which is only built once for each `naction`."""
+        if not hasattr(self, '_layouts'):
+            # Not set in __post_init__ because configs unpickled from old checkpoints would lack it
+            self._layouts = {}
+        if naction not in self._layouts:
+            self._layouts[naction] = ObsLayout(self, naction)
+        return self._layouts[naction]
+
+
+class ObsBatch(NamedTuple):
+    obs: Any
+    nonobs: Any
+    action_masks: Any
+
+
+class ObsLayout:
+    """
+    Positions and shapes of the parts of observations with an `ObsConfig`.
+
+    A batch observation is one flat buffer with the `stride` observation features of each game, followed by the
+    `nonobs_features` of each game and, if `naction` is known, the action masks of each game. `split` returns views
+    of these parts. Each observation consists of the sections `globals`, `allies`, `enemies`, `minerals`, `tiles` and
+    `privileged_enemies`, and `drones` spans both allies and enemies. `items` returns views of the items of a section
+    in a batch of observations. All views work for NumPy arrays and torch tensors alike and do not copy.
+    """
+
+    def __init__(self, obs_config: ObsConfig, naction: Optional[int] = None):
+        self.naction = naction
+        self.allies = obs_config.allies
+        self.stride = obs_config.stride()
+        self.nonobs_features = obs_config.nonobs_features()
+        self.mask_stride = obs_config.allies * naction if naction is not None else 0
+        # Maps the name of each section to its `(start, end, count, width)`, where `count` is `None` for `globals`
+        self.sections: Dict[str, Tuple[int, int, Optional[int], int]] = {}
+        offset = 0
+        for name, count, width in [('globals', None, obs_config.global_features()),
+                                   ('allies', obs_config.allies, obs_config.dstride()),
+                                   ('enemies', obs_config.enemies(), obs_config.dstride()),
+                                   ('minerals', obs_config.minerals, obs_config.mstride()),
+                                   ('tiles', obs_config.tiles, obs_config.tstride()),
+                                   ('privileged_enemies', obs_config.enemies(), obs_config.dstride())]:
+            end = offset + (width if count is None else count * width)
+            self.sections[name] = (offset, end, count, width)
+            offset = end
+        assert offset == self.stride
+        self.sections['drones'] = (self.start('allies'), self.end('enemies'), obs_config.drones, obs_config.dstride())
+
+    def start(self, section: str) -> int:
+        return self.sections[section][0]
+
+    def end(self, section: str) -> int:
+        return self.sections[section][1]
+
+    def count(self, section: str) -> int:
+        return self.sections[section][2]
+
+    def width(self, section: str) -> int:
+        return self.sections[section][3]
+
+    def items(self, obs, section: str):
+        """Returns a `[batch, count, width]` view of the items of `section` of a `[batch, stride]` array of observations."""
+        start, end, count, width = self.sections[section]
+        if count is None:
+            return obs[:, start:end]
+        return obs[:, start:end].reshape(obs.shape[0], count, width)
+
+    def size(self, num_games: int) -> int:
+        """Number of floats of a batch observation of `num_games` games."""
+        return num_games * (self.stride + self.nonobs_features + self.mask_stride)
+
+    def split(self, buffer, num_games: int) -> ObsBatch:
+        """
+        Returns views of the `[num_games, stride]` observations, `[num_games, nonobs_features]` nonobs features and
+        `[num_games, allies, naction]` action masks (`None` if `naction` is unknown) in a batch observation.
+        """
+        end_obs = num_games * self.stride
+        end_nonobs = end_obs + num_games * self.nonobs_features
+        action_masks = None
+        if self.naction is not None:
+            action_masks = buffer[end_nonobs:end_nonobs + num_games * self.mask_stride] \
+                .reshape(num_games, self.allies, self.naction)
+        return ObsBatch(obs=buffer[:end_obs].reshape(num_games, self.stride),
+                        nonobs=buffer[end_obs:end_nonobs].reshape(num_games, self.nonobs_features),
+                        action_masks=action_masks)
+
 
 @dataclass
 class Rules:
@@ -126,26 +234,17 @@ def create_game(game_length: int = None,
         custom_map = ''
     try:
         if game_length:
-            response = requests.post(f'http://localhost:9000/start-game'
-                                     f'?maxTicks={game_length}'
-                                     f'&actionDelay={action_delay}'
-                                     f'&scriptedOpponent={scripted_opponent}'
-                                     f'&mothershipDamageMultiplier={rules.mothership_damage_multiplier}'
-                                     f'&costModifierSize1={rules.cost_modifier_size[0]}'
-                                     f'&costModifierSize2={rules.cost_modifier_size[1]}'
-                                     f'&costModifierSize3={rules.cost_modifier_size[2]}'
-                                     f'&costModifierSize4={rules.cost_modifier_size[3]}'
-                                     f'&costModifierConstructor={rules.cost_modifier_constructor}'
-                                     f'&costModifierStorage={rules.cost_modifier_storage}'
-                                     f'&costModifierShields={rules.cost_modifier_shields}'
-                                     f'&costModifierMissiles={rules.cost_modifier_missiles}'
-                                     f'&costModifierEngines={rules.cost_modifier_engines}'
-                                     f'&allowHarvesting={scalabool(allowHarvesting)}'
-                                     f'&forceHarvesting={scalabool(forceHarvesting)}'
-                                     f'&randomizeIdle={scalabool(randomizeIdle)}' ,
+            response = requests.post(start_game_url(DEFAULT_ENDPOINT,
+                                                    game_length,
+                                                    action_delay,
+                                                    scripted_opponent,
+                                                    rules,
+                                                    allowHarvesting,
+                                                    forceHarvesting,
+                                                    randomizeIdle),
                                      json=custom_map).json()
         else:
-            response = requests.post(f'http://localhost:9000/start-game?actionDelay={action_delay}').json()
+            response = requests.post(f'{DEFAULT_ENDPOINT}/start-game?actionDelay={action_delay}').json()
         return int(response['id'])
     except requests.exceptions.ConnectionError:
         logging.info(f"Connection error on create_game, retrying")
@@ -153,11 +252,86 @@ def create_game(game_length: int = None,
         return create_game(game_length, action_delay, self_play)
 
 
+def start_game_url(endpoint: str,
+                   game_length: int,
+                   action_delay: int,
+                   scripted_opponent: str,
+                   rules: Rules,
+                   allow_harvesting: bool,
+                   force_harvesting: bool,
+                   randomize_idle: bool) -> str:
+    params = start_game_params(game_length, action_delay, scripted_opponent, rules,
+                               allow_harvesting, force_harvesting, randomize_idle)
+    return f'{endpoint}/start-game?' + '&'.join(
+        f'{key}={scalabool(value) if isinstance(value, bool) else value}' for key, value in params.items())
+
+
+def start_game_params(game_length: int,
+                      action_delay: int,
+                      scripted_opponent: str,
+                      rules: Rules,
+                      allow_harvesting: bool,
+                      force_harvesting: bool,
+                      randomize_idle: bool) -> dict:
+    return {
+        'maxTicks': game_length,
+        'actionDelay': action_delay,
+        'scriptedOpponent': scripted_opponent,
+        'mothershipDamageMultiplier': rules.mothership_damage_multiplier,
+        'costModifierSize1': rules.cost_modifier_size[0],
+        'costModifierSize2': rules.cost_modifier_size[1],
+        'costModifierSize3': rules.cost_modifier_size[2],
+        'costModifierSize4': rules.cost_modifier_size[3],
+        'costModifierConstructor': rules.cost_modifier_constructor,
+        'costModifierStorage': rules.cost_modifier_storage,
+        'costModifierShields': rules.cost_modifier_shields,
+        'costModifierMissiles': rules.cost_modifier_missiles,
+        'costModifierEngines': rules.cost_modifier_engines,
+        'allowHarvesting': allow_harvesting,
+        'forceHarvesting': force_harvesting,
+        'randomizeIdle': randomize_idle,
+    }
+
+
+def batch_start_game_payload(games: List[dict]) -> bytes:
+    """
+    Serializes a list of `create_game` keyword arguments into the body of a `/batch-start-game` request.
+
+    Every game is described by the same settings `/start-game` takes as query parameters, plus the custom map.
+    """
+    return orjson.dumps([_start_game_spec(**game) for game in games], default=_numpy_scalar)
+
+
+def _numpy_scalar(value):
+    # Maps and rules are generated with numpy and contain numpy scalars that orjson can't serialize by itself
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError
+
+
+def _start_game_spec(game_length: int,
+                     action_delay: int = 0,
+                     self_play: bool = False,
+                     custom_map=None,
+                     scripted_opponent: str = 'none',
+                     rules=Rules(),
+                     allowHarvesting: bool = True,
+                     forceHarvesting: bool = True,
+                     randomizeIdle: bool = True) -> dict:
+    spec = start_game_params(game_length, action_delay, scripted_opponent, rules,
+                             allowHarvesting, forceHarvesting, randomizeIdle)
+    spec['map'] = custom_map
+    if not game_length:
+        # Match create_game, which starts an unbounded game without maxTicks.
+        del spec['maxTicks']
+    return spec
+
+
 def act(game_id: int, action):
     retries = 100
     while retries > 0:
         try:
-            requests.post(f'http://localhost:9000/act?gameID={game_id}&playerID=0', json=action).raise_for_status()
+            requests.post(f'{DEFAULT_ENDPOINT}/act?gameID={game_id}&playerID=0', json=action).raise_for_status()
             return
         except requests.exceptions.ConnectionError:
             # For some reason, a small percentage of requests fails with
@@ -169,27 +343,14 @@ def act(game_id: int, action):
 
 
 def act_batch(actions):
-    payload = {}
-    for game_id, player_id, player_actions in actions:
-        player_actions_json = []
-        for move, turn, buildSpec, harvest, lockBuildAction, unlockBuildAction in player_actions:
-            player_actions_json.append({
-                "buildDrone": buildSpec,
-                "move": move,
-                "harvest": harvest,
-                "transfer": False,
-                "turn": turn,
-                "lockBuildAction": lockBuildAction,
-                "unlockBuildAction": unlockBuildAction
-            })
-        payload[f'{game_id}.{player_id}'] = player_actions_json
+    payload = act_batch_payload(actions)
 
     retries = 100
     while retries > 0:
         try:
             requests.post(
-                f'http://localhost:9000/batch-act',
-                data=orjson.dumps(payload),
+                f'{DEFAULT_ENDPOINT}/batch-act',
+                data=payload,
                 headers={'Content-Type': 'application/json'},
             ).raise_for_status()
             return
@@ -202,9 +363,64 @@ def act_batch(actions):
             time.sleep(1)
 
 
+def act_batch_payload(actions) -> bytes:
+    payload = {}
+    for game_id, player_id, player_actions in actions:
+        player_actions_json = []
+        for move, turn, buildSpec, harvest, lockBuildAction, unlockBuildAction in player_actions:
+            player_actions_json.append({
+                "buildDrone": buildSpec,
+                "move": move,
+                "harvest": harvest,
+                "transfer": False,
+                "turn": turn,
+                "lockBuildAction": lockBuildAction,
+                "unlockBuildAction": unlockBuildAction
+            })
+        payload[f'{game_id}.{player_id}'] = player_actions_json
+    return orjson.dumps(payload)
+
+
+# Flags of the packed action format
+HARVEST = 1
+LOCK_BUILD_ACTION = 2
+UNLOCK_BUILD_ACTION = 4
+
+
+def act_batch_binary_payload(game_ids: List[Tuple[int, int]], actions: np.ndarray) -> bytes:
+    """
+    Encodes packed actions for `/batch-act-binary`.
+
+    The layout is little-endian: the number of games as int32, an int32 (game id, player id) pair for each game,
+    and finally the int8 actions of shape (games, drones, 4). Each action is (move, turn, build, flags), where
+    `build` is an index into the build table of the request or -1 for no build.
+    """
+    return np.array([len(game_ids)], dtype='<i4').tobytes() + \
+        np.array(game_ids, dtype='<i4').tobytes() + \
+        np.ascontiguousarray(actions, dtype=np.int8).tobytes()
+
+
+def unpack_actions(game_ids: List[Tuple[int, int]], actions: np.ndarray, build_table: List[List[int]]):
+    """
+    Converts packed actions into the format of `act_batch`.
+    """
+    result = []
+    for (game_id, player_id), player_actions in zip(game_ids, actions.tolist()):
+        result.append((game_id, player_id, [
+            (move == 1,
+             turn,
+             [build_table[build]] if build >= 0 else [],
+             flags & HARVEST != 0,
+             flags & LOCK_BUILD_ACTION != 0,
+             flags & UNLOCK_BUILD_ACTION != 0)
+            for move, turn, build, flags in player_actions
+        ]))
+    return result
+
+
 def observe(game_id: int, player_id: int = 0):
     try:
-        return requests.get(f'http://localhost:9000/observation?gameID={game_id}&playerID={player_id}').json()
+        return requests.get(f'{DEFAULT_ENDPOINT}/observation?gameID={game_id}&playerID={player_id}').json()
     except requests.exceptions.ConnectionError:
         logging.info(f"Connection error on observe({game_id}.{player_id}), retrying")
         time.sleep(1)
@@ -215,7 +431,7 @@ def observe_batch(game_ids):
     retries = RETRIES
     while retries > 0:
         try:
-            return requests.get(f'http://localhost:9000/batch-observation', json=[game_ids, []]).json()
+            return requests.get(f'{DEFAULT_ENDPOINT}/batch-observation', json=[game_ids, []]).json()
         except requests.exceptions.ConnectionError:
             retries -= 1
             logging.info(f"Connection error on observe_batch(), retrying")
@@ -243,8 +459,40 @@ def observe_batch_raw(obs_config: ObsConfig,
                       rule_msdm: bool = False,
                       rule_costs: bool = False) -> object:
     retries = RETRIES
-    ebcstr = ''
-    url = f'http://localhost:9000/batch-observation?' \
+    url = batch_observation_url(DEFAULT_ENDPOINT, obs_config, allies, drones, minerals, global_drones, tiles,
+                                relative_positions, v2, map_size, last_seen, is_visible, abstime,
+                                rule_msdm, rule_costs)
+    while retries > 0:
+        json = [game_ids, extra_build_actions]
+        try:
+            response = requests.get(url,
+                                    json=json,
+                                    stream=True)
+            response.raise_for_status()
+            response_bytes = response.content
+            return np.frombuffer(response_bytes, dtype=np.float32)
+        except requests.exceptions.ConnectionError as e:
+            retries -= 1
+            logging.info(f"Connection error on {url} with json={json}, retrying: {e}")
+            time.sleep(10)
+
+
+def batch_observation_url(endpoint: str,
+                          obs_config: ObsConfig,
+                          allies: int,
+                          drones: int,
+                          minerals: int,
+                          global_drones: int,
+                          tiles: int,
+                          relative_positions: bool,
+                          v2: bool,
+                          map_size: bool = False,
+                          last_seen: bool = False,
+                          is_visible: bool = False,
+                          abstime: bool = False,
+                          rule_msdm: bool = False,
+                          rule_costs: bool = False) -> str:
+    return f'{endpoint}/batch-observation?' \
         f'json=false&' \
         f'allies={allies}&' \
         f'drones={drones}&' \
@@ -262,20 +510,906 @@ def observe_batch_raw(obs_config: ObsConfig,
         f'ruleMsdm={scalabool(rule_msdm)}&' \
         f'ruleCosts={scalabool(rule_costs)}&' \
         f'lockBuildAction={scalabool(obs_config.lock_build_action)}&' \
-        f'distanceToWall={scalabool(obs_config.feat_dist_to_wall)}' + ebcstr
-    while retries > 0:
-        json = [game_ids, extra_build_actions]
+        f'distanceToWall={scalabool(obs_config.feat_dist_to_wall)}'
+
+
+def client_observation_url(endpoint: str, obs_config: ObsConfig) -> str:
+    url = batch_observation_url(endpoint,
+                                obs_config,
+                                allies=obs_config.allies,
+                                drones=obs_config.drones,
+                                minerals=obs_config.minerals,
+                                tiles=obs_config.tiles,
+                                global_drones=obs_config.global_drones,
+                                relative_positions=obs_config.relative_positions,
+                                v2=True,
+                                map_size=obs_config.feat_map_size,
+                                last_seen=obs_config.feat_last_seen,
+                                is_visible=obs_config.feat_is_visible,
+                                abstime=obs_config.feat_abstime,
+                                rule_msdm=obs_config.feat_rule_msdm,
+                                rule_costs=obs_config.feat_rule_costs)
+    if obs_config.encoding != 'float32':
+        url += f'&encoding={obs_config.encoding}'
+    return url
+
+
+def observation_query(obs_config: ObsConfig) -> str:
+    """Returns the query parameters of the batch observation request for `obs_config`."""
+    return client_observation_url('', obs_config).split('?', 1)[1]
+
+
+def decode_observations(body: np.ndarray,
+                        encoding: str,
+                        obs_config: ObsConfig,
+                        num_games: int,
+                        out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Decodes the bytes of a batch observation in `encoding` into float32, writing them to `out` if given.
+
+    float16 responses contain all values as float16. int8 responses start with a float32 scale for each of the
+    `obs_config.stride()` observation features, followed by the int8 observations, the float32 nonobs features
+    and the int8 action masks. All values are little-endian.
+    """
+    if encoding == 'float32' or encoding == 'float16':
+        values = np.frombuffer(body, dtype='<f4' if encoding == 'float32' else '<f2')
+        result = np.empty(len(values), dtype=np.float32) if out is None else out[:len(values)]
+        np.copyto(result, values)
+        return result
+    elif encoding == 'int8':
+        stride = obs_config.stride()
+        nobs = num_games * stride
+        nnonobs = num_games * obs_config.nonobs_features()
+        scales = np.frombuffer(body, dtype='<f4', count=stride)
+        offset = 4 * stride
+        obs = np.frombuffer(body, dtype=np.int8, count=nobs, offset=offset)
+        offset += nobs
+        nonobs = np.frombuffer(body, dtype='<f4', count=nnonobs, offset=offset)
+        offset += 4 * nnonobs
+        action_masks = np.frombuffer(body, dtype=np.int8, offset=offset)
+        size = nobs + nnonobs + len(action_masks)
+        result = np.empty(size, dtype=np.float32) if out is None else out[:size]
+        np.multiply(obs.reshape(num_games, stride), scales, out=result[:nobs].reshape(num_games, stride))
+        result[nobs:nobs + nnonobs] = nonobs
+        result[nobs + nnonobs:] = action_masks
+        return result
+    else:
+        raise ValueError(f'Unknown observation encoding {encoding}')
+
+
+def split_endpoint(endpoint: str) -> Tuple[str, Optional[str]]:
+    """
+    Returns the base url for requests to `endpoint` and the path of its Unix domain socket, if it is one.
+    """
+    if endpoint.startswith(UNIX_SOCKET_PREFIX):
+        return 'http://localhost', endpoint[len(UNIX_SOCKET_PREFIX):]
+    return endpoint.rstrip('/'), None
+
+
+class UnixHTTPConnection(urllib3.connection.HTTPConnection):
+    def __init__(self, *args, socket_path: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+
+class UnixHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = UnixHTTPConnection
+
+
+class UnixSocketAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter that sends all requests of a session over the Unix domain socket at `socket_path`.
+    """
+
+    def __init__(self, socket_path: str, pool_maxsize: int):
+        super().__init__(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.pool = UnixHTTPConnectionPool('localhost', maxsize=pool_maxsize, socket_path=socket_path)
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self.pool
+
+    def close(self):
+        super().close()
+        self.pool.close()
+
+
+def readinto_array(response: requests.Response, out: np.ndarray) -> np.ndarray:
+    """
+    Reads the body of a streamed `response` into the contiguous array `out` and returns the filled prefix.
+    """
+    buffer = memoryview(out).cast('B')
+    raw = response.raw
+    # Reading from the underlying http.client response lets the socket write straight into `buffer`,
+    # urllib3's readinto would read into a new bytes object first.
+    fp = raw if response.headers.get('Content-Encoding') else getattr(raw, '_fp', raw)
+    nbytes = 0
+    while nbytes < len(buffer):
+        n = fp.readinto(buffer[nbytes:])
+        if not n:
+            break
+        nbytes += n
+    if nbytes == len(buffer) and fp.read(1):
+        response.close()
+        raise ValueError(f'Response from {response.url} does not fit into buffer of {len(buffer)} bytes')
+    raw.release_conn()
+    return out[:nbytes // out.itemsize]
+
+
+class Histogram:
+    """
+    Histogram of durations in seconds with logarithmically spaced buckets between 10us and 1000s.
+    """
+
+    MIN = 1e-5
+    BUCKETS_PER_DECADE = 16
+    DECADES = 8
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS_PER_DECADE * self.DECADES)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        index = int(math.log10(value / self.MIN) * self.BUCKETS_PER_DECADE) if value > self.MIN else 0
+        self.counts[min(index, len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: 'Histogram'):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, q: float) -> float:
+        """
+        Returns an upper bound for the `q`th percentile that is at most 15% larger than its true value.
+        """
+        target = q / 100 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target and cumulative > 0:
+                return self.MIN * 10 ** ((index + 1) / self.BUCKETS_PER_DECADE)
+        return 0.0
+
+
+class RequestMetrics:
+    """
+    Registry of the latency, payload size and retries of requests to the CodeCraft server, keyed by client method.
+
+    Nothing is recorded unless `enabled` is set. Metrics recorded in other processes are sent over as the result of
+    `collect` and added with `merge`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self._clear()
+
+    def collect(self) -> Tuple[dict, dict, dict, dict]:
+        """Returns the latencies, bytes sent, bytes received and retries recorded since the last reset and resets."""
+        with self.lock:
+            records = dict(self.latencies), dict(self.bytes_sent), dict(self.bytes_received), dict(self.retries)
+            self._clear()
+        return records
+
+    def merge(self, records: Tuple[dict, dict, dict, dict]):
+        """Adds metrics returned by `collect`."""
+        latencies, bytes_sent, bytes_received, retries = records
+        with self.lock:
+            for name, histogram in latencies.items():
+                self.latencies[name].merge(histogram)
+            for name, sent in bytes_sent.items():
+                self.bytes_sent[name] += sent
+            for name, received in bytes_received.items():
+                self.bytes_received[name] += received
+            for name, count in retries.items():
+                self.retries[name] += count
+
+    def _clear(self):
+        self.latencies = defaultdict(Histogram)
+        self.bytes_sent = defaultdict(int)
+        self.bytes_received = defaultdict(int)
+        self.retries = defaultdict(int)
+
+    def record_latency(self, name: str, seconds: float):
+        with self.lock:
+            self.latencies[name].add(seconds)
+
+    def record_bytes(self, name: str, sent: int, received: int):
+        with self.lock:
+            self.bytes_sent[name] += sent
+            self.bytes_received[name] += received
+
+    def record_retry(self, name: str):
+        with self.lock:
+            self.retries[name] += 1
+
+    def summary(self, percentiles=(50, 95, 99)) -> Dict[str, float]:
+        """
+        Returns metrics for each method, e.g. `requests/observe_batch_raw_p99_ms`, recorded since the last `reset`.
+        """
+        summary = {}
+        with self.lock:
+            for name, histogram in self.latencies.items():
+                summary[f'requests/{name}_calls'] = histogram.count
+                summary[f'requests/{name}_total_s'] = histogram.total
+                for q in percentiles:
+                    summary[f'requests/{name}_p{q}_ms'] = 1000 * histogram.percentile(q)
+            for name in set(self.bytes_sent.keys()) | set(self.bytes_received.keys()):
+                summary[f'requests/{name}_sent_mb'] = self.bytes_sent[name] / 1e6
+                summary[f'requests/{name}_received_mb'] = self.bytes_received[name] / 1e6
+            for name, retries in self.retries.items():
+                summary[f'requests/{name}_retries'] = retries
+        return summary
+
+
+# Metrics of all clients in this process
+request_metrics = RequestMetrics()
+
+
+def instrumented(method):
+    """
+    Records the duration of calls to a (possibly async) client method in `request_metrics`.
+    """
+    name = method.__name__
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            if not request_metrics.enabled:
+                return await method(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                request_metrics.record_latency(name, time.perf_counter() - start)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not request_metrics.enabled:
+            return method(*args, **kwargs)
+        start = time.perf_counter()
         try:
-            response = requests.get(url,
-                                    json=json,
-                                    stream=True)
-            response.raise_for_status()
-            response_bytes = response.content
-            return np.frombuffer(response_bytes, dtype=np.float32)
-        except requests.exceptions.ConnectionError as e:
-            retries -= 1
-            logging.info(f"Connection error on {url} with json={json}, retrying: {e}")
-            time.sleep(10)
+            return method(*args, **kwargs)
+        finally:
+            request_metrics.record_latency(name, time.perf_counter() - start)
+    return wrapper
+
+
+def _payload_size(data) -> int:
+    return len(data) if isinstance(data, (bytes, bytearray, str)) else 0
+
+
+class CodeCraftClient:
+    """
+    Client for a CodeCraft server that reuses connections across requests.
+
+    All requests go through a single `requests.Session` that keeps a pool of up to `pool_size` keep-alive
+    connections open, so stepping the environment does not open and tear down a TCP connection per call.
+    Running out of ephemeral ports because of that churn is what caused the sporadic
+    "connection error (errno 98, address already in use)" failures that the module level functions retry on.
+
+    Requests that fail to connect are retried up to `retries` times. Read timeouts are not retried since
+    actions are not idempotent.
+
+    Endpoints that are not implemented by all server versions are probed on first use; if the server responds
+    with 404, the client remembers this and falls back to the older API from then on.
+
+    For a server on the same machine, `endpoint` can also be a Unix domain socket such as
+    `unix:///tmp/codecraft.sock`, which avoids the overhead of the TCP loopback stack.
+    """
+
+    def __init__(self,
+                 endpoint: str = DEFAULT_ENDPOINT,
+                 pool_size: int = 8,
+                 connect_timeout: float = 5.0,
+                 read_timeout: Optional[float] = 120.0,
+                 retries: int = RETRIES,
+                 retry_delay: float = 1.0):
+        self.endpoint, self.socket_path = split_endpoint(endpoint)
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.unsupported = set()
+        self.build_tables = {}
+        self.session = requests.Session()
+        if self.socket_path is not None:
+            adapter = UnixSocketAdapter(self.socket_path, pool_maxsize=pool_size)
+        else:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self._executor = None
+        self._scratch = np.empty(0, dtype=np.uint8)
+
+    @instrumented
+    def create_game(self,
+                    game_length: int = None,
+                    action_delay: int = 0,
+                    self_play: bool = False,
+                    custom_map=None,
+                    scripted_opponent: str = 'none',
+                    rules=Rules(),
+                    allowHarvesting: bool = True,
+                    forceHarvesting: bool = True,
+                    randomizeIdle: bool = True) -> int:
+        if game_length:
+            url = start_game_url(self.endpoint, game_length, action_delay, scripted_opponent, rules,
+                                 allowHarvesting, forceHarvesting, randomizeIdle)
+            response = self._request('POST', url, 'create_game', json=custom_map or '')
+        else:
+            response = self._request('POST', f'{self.endpoint}/start-game?actionDelay={action_delay}', 'create_game')
+        return int(response.json()['id'])
+
+    @instrumented
+    def create_games(self, games: List[dict]) -> List[int]:
+        """
+        Creates a game for each element of `games`, which are keyword arguments of `create_game`.
+
+        All games are sent in a single `/batch-start-game` request. If the server does not implement it,
+        the games are created with concurrent `/start-game` requests instead.
+        """
+        if len(games) == 0:
+            return []
+        response = self._request_if_supported('POST', '/batch-start-game', 'create_games',
+                                              data=batch_start_game_payload(games),
+                                              headers={'Content-Type': 'application/json'})
+        if response is not None:
+            return [int(game_id) for game_id in response.json()]
+        return list(self.executor().map(lambda game: self.create_game(**game), games))
+
+    @instrumented
+    def abandon_games(self, game_ids: List[int]) -> bool:
+        """
+        Ends `game_ids` without playing them to completion in a single `/batch-abandon-game` request.
+
+        Returns `False` if the server does not support abandoning games.
+        """
+        if len(game_ids) == 0:
+            return True
+        response = self._request_if_supported('POST', '/batch-abandon-game', 'abandon_games', json=game_ids)
+        return response is not None
+
+    @instrumented
+    def act_batch(self, actions):
+        self._request('POST', f'{self.endpoint}/batch-act', 'act_batch',
+                      data=act_batch_payload(actions),
+                      headers={'Content-Type': 'application/json'})
+
+    @instrumented
+    def act_batch_packed(self, game_ids: List[Tuple[int, int]], actions: np.ndarray, build_table: List[List[int]]):
+        """
+        Performs the packed `actions` (see `act_batch_binary_payload`) for `game_ids`.
+
+        `build_table` is registered with the server on first use. Servers without binary actions are sent JSON.
+        """
+        table_id = self._build_table_id(build_table)
+        if table_id is not None:
+            response = self._request_if_supported('POST', '/batch-act-binary', 'act_batch_packed',
+                                                  query=f'?buildTable={table_id}&drones={actions.shape[1]}',
+                                                  data=act_batch_binary_payload(game_ids, actions),
+                                                  headers={'Content-Type': 'application/octet-stream'})
+            if response is not None:
+                return
+        self.act_batch(unpack_actions(game_ids, actions, build_table))
+
+    @instrumented
+    def observe(self, game_id: int, player_id: int = 0):
+        url = f'{self.endpoint}/observation?gameID={game_id}&playerID={player_id}'
+        return self._request('GET', url, 'observe').json()
+
+    @instrumented
+    def observe_batch(self, game_ids):
+        return self._request('GET', f'{self.endpoint}/batch-observation', 'observe_batch',
+                             json=[game_ids, []]).json()
+
+    @instrumented
+    def observe_batch_raw(self,
+                          obs_config: ObsConfig,
+                          game_ids: List[Tuple[int, int]],
+                          extra_build_actions: List[List[int]],
+                          out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns the flat float32 observations of `game_ids`.
+
+        If `out` is given, the response body is read directly from the socket into this preallocated float32
+        array and a view of the filled prefix is returned, so that no intermediate copies are made.
+        Otherwise the result is a new read-only array.
+
+        Observations sent in a reduced precision `obs_config.encoding` are decoded into float32.
+        """
+        url = client_observation_url(self.endpoint, obs_config)
+        response = self._request('GET', url, 'observe_batch_raw', json=[game_ids, extra_build_actions], stream=True)
+        encoding = response.headers.get(OBS_ENCODING_HEADER, 'float32')
+        if encoding != 'float32':
+            return decode_observations(self._read_body(response), encoding, obs_config, len(game_ids), out)
+        elif out is None:
+            return np.frombuffer(response.content, dtype=np.float32)
+        else:
+            return readinto_array(response, out)
+
+    @instrumented
+    def observe_batch_raw_partitioned(self,
+                                      partitions: List[Tuple[ObsConfig, List[Tuple[int, int]]]],
+                                      extra_build_actions: List[List[int]],
+                                      out: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        """
+        Returns the flat float32 observations of each `(obs_config, game_ids)` partition with a single request.
+
+        The observations of the partitions are consecutive views into `out` if it is given. Servers without
+        /batch-observation-multi are sent one request per partition.
+        """
+        response = self._request_if_supported('POST', '/batch-observation-multi', 'observe_batch_raw_partitioned',
+                                              json={'partitions': [[observation_query(obs_config), game_ids]
+                                                                   for obs_config, game_ids in partitions],
+                                                    'buildActions': extra_build_actions},
+                                              stream=True)
+        results = []
+        offset = 0
+        if response is None:
+            for obs_config, game_ids in partitions:
+                results.append(self.observe_batch_raw(obs_config, game_ids, extra_build_actions,
+                                                      None if out is None else out[offset:]))
+                offset += len(results[-1])
+            return results
+
+        lengths = [int(length) for length in response.headers[PARTITION_LENGTHS_HEADER].split(',')]
+        encodings = response.headers[OBS_ENCODING_HEADER].split(',')
+        if out is not None and all(encoding == 'float32' for encoding in encodings):
+            return np.split(readinto_array(response, out), np.cumsum([length // 4 for length in lengths])[:-1])
+        body = self._read_body(response)
+        for (obs_config, game_ids), length, encoding in zip(partitions, lengths, encodings):
+            target = None if out is None else out[sum(len(obs) for obs in results):]
+            results.append(decode_observations(body[offset:offset + length], encoding, obs_config, len(game_ids), target))
+            offset += length
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.session.close()
+
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        return self._executor
+
+    def _read_body(self, response: requests.Response) -> np.ndarray:
+        # Encoded observations are read into a scratch buffer that is reused between requests
+        length = response.headers.get('Content-Length')
+        if length is None or response.headers.get('Content-Encoding'):
+            return np.frombuffer(response.content, dtype=np.uint8)
+        if len(self._scratch) < int(length):
+            self._scratch = np.empty(int(length), dtype=np.uint8)
+        return readinto_array(response, self._scratch[:int(length)])
+
+    def _build_table_id(self, build_table: List[List[int]]) -> Optional[int]:
+        key = tuple(tuple(build) for build in build_table)
+        if key not in self.build_tables:
+            response = self._request_if_supported('POST', '/build-table', 'register_build_table',
+                                                  data=orjson.dumps(build_table),
+                                                  headers={'Content-Type': 'application/json'})
+            if response is None:
+                return None
+            self.build_tables[key] = int(response.json()['id'])
+        return self.build_tables[key]
+
+    def _request_if_supported(self, method: str, path: str, name: str, query: str = '',
+                              **kwargs) -> Optional[requests.Response]:
+        """
+        Like `_request`, but returns `None` instead of failing if the server does not implement `path`.
+        """
+        if path in self.unsupported:
+            return None
+        try:
+            return self._request(method, f'{self.endpoint}{path}{query}', name, **kwargs)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            logging.info(f"{self.endpoint} does not support {path}, falling back to older API")
+            self.unsupported.add(path)
+            return None
+
+    def _request(self, method: str, url: str, name: str, **kwargs) -> requests.Response:
+        retries = self.retries
+        while True:
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                response.raise_for_status()
+                if request_metrics.enabled:
+                    # The body of streamed responses has not been read yet
+                    received = response.headers.get('Content-Length')
+                    if received is None and not kwargs.get('stream'):
+                        received = len(response.content)
+                    request_metrics.record_bytes(name, _payload_size(response.request.body), int(received or 0))
+                return response
+            except requests.exceptions.ConnectionError as e:
+                retries -= 1
+                if retries <= 0:
+                    raise
+                logging.info(f"Connection error on {name}(), retrying: {e}")
+                if request_metrics.enabled:
+                    request_metrics.record_retry(name)
+                time.sleep(self.retry_delay)
+
+
+class ShardedCodeCraftClient:
+    """
+    Client that spreads games over several CodeCraft servers.
+
+    New games are assigned to servers round-robin and stay on the server that created them. The game ids returned
+    by this client encode the server as `local_id * len(endpoints) + shard`. Batched requests are split by server,
+    sent to all servers concurrently and the results are merged back into the order of the request.
+
+    Keyword arguments are passed on to the `CodeCraftClient` of each server.
+    """
+
+    def __init__(self, endpoints: List[str], **kwargs):
+        assert len(endpoints) > 0
+        self.clients = [CodeCraftClient(endpoint, **kwargs) for endpoint in endpoints]
+        self.next_shard = 0
+        self._executor = None
+
+    def create_game(self, *args, **kwargs) -> int:
+        shard = self._next_shards(1)[0]
+        return self._global_id(shard, self.clients[shard].create_game(*args, **kwargs))
+
+    def create_games(self, games: List[dict]) -> List[int]:
+        shards = self._next_shards(len(games))
+        indices = [[i for i, s in enumerate(shards) if s == shard] for shard in range(len(self.clients))]
+        calls = [(shard, [games[i] for i in shard_indices])
+                 for shard, shard_indices in enumerate(indices) if len(shard_indices) > 0]
+        results = self._map(lambda shard, shard_games: self.clients[shard].create_games(shard_games), calls)
+        game_ids = [0] * len(games)
+        for (shard, _), local_ids in zip(calls, results):
+            for i, local_id in zip(indices[shard], local_ids):
+                game_ids[i] = self._global_id(shard, local_id)
+        return game_ids
+
+    def abandon_games(self, game_ids: List[int]) -> bool:
+        calls = [(shard, [local_ids[i] for i in indices]) for shard, indices, local_ids in self._split(game_ids)]
+        return all(self._map(lambda shard, shard_game_ids: self.clients[shard].abandon_games(shard_game_ids), calls))
+
+    def act_batch(self, actions):
+        calls = [(shard, [(local_ids[i], actions[i][1], actions[i][2]) for i in indices])
+                 for shard, indices, local_ids in self._split([game_id for game_id, _, _ in actions])]
+        self._map(lambda shard, shard_actions: self.clients[shard].act_batch(shard_actions), calls)
+
+    def act_batch_packed(self, game_ids: List[Tuple[int, int]], actions: np.ndarray, build_table: List[List[int]]):
+        calls = [(shard, [(local_ids[i], game_ids[i][1]) for i in indices], actions[indices])
+                 for shard, indices, local_ids in self._split([game_id for game_id, _ in game_ids])]
+        self._map(lambda shard, shard_game_ids, shard_actions:
+                  self.clients[shard].act_batch_packed(shard_game_ids, shard_actions, build_table),
+                  calls)
+
+    def observe(self, game_id: int, player_id: int = 0):
+        shard, local_id = self._local_id(game_id)
+        return self.clients[shard].observe(local_id, player_id)
+
+    def observe_batch(self, game_ids):
+        splits = self._split([game_id for game_id, _ in game_ids])
+        results = self._map(lambda shard, shard_game_ids: self.clients[shard].observe_batch(shard_game_ids),
+                            [(shard, [(local_ids[i], game_ids[i][1]) for i in indices])
+                             for shard, indices, local_ids in splits])
+        observations = [None] * len(game_ids)
+        for (_, indices, _), shard_observations in zip(splits, results):
+            for i, observation in zip(indices, shard_observations):
+                observations[i] = observation
+        return observations
+
+    def observe_batch_raw(self,
+                          obs_config: ObsConfig,
+                          game_ids: List[Tuple[int, int]],
+                          extra_build_actions: List[List[int]],
+                          out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Like `CodeCraftClient.observe_batch_raw`.
+
+        If all games are on the same server, the response is read directly into `out`.
+        Otherwise the observations, global features and action masks of each server are copied into `out`.
+        """
+        splits = self._split([game_id for game_id, _ in game_ids])
+        calls = [(shard, [(local_ids[i], game_ids[i][1]) for i in indices]) for shard, indices, local_ids in splits]
+        if len(calls) == 1:
+            shard, shard_game_ids = calls[0]
+            return self.clients[shard].observe_batch_raw(obs_config, shard_game_ids, extra_build_actions, out)
+        results = self._map(lambda shard, shard_game_ids:
+                            self.clients[shard].observe_batch_raw(obs_config, shard_game_ids, extra_build_actions),
+                            calls)
+        return self._merge(obs_config, len(game_ids), [(indices, obs) for (_, indices, _), obs in zip(splits, results)],
+                           out)
+
+    def observe_batch_raw_partitioned(self,
+                                      partitions: List[Tuple[ObsConfig, List[Tuple[int, int]]]],
+                                      extra_build_actions: List[List[int]],
+                                      out: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        """
+        Like `CodeCraftClient.observe_batch_raw_partitioned`, with a single request to each server.
+        """
+        splits = [{shard: (indices, local_ids) for shard, indices, local_ids in self._split([gid for gid, _ in game_ids])}
+                  for _, game_ids in partitions]
+        calls = [(shard, [(obs_config, [(split[shard][1][i], game_ids[i][1]) for i in split[shard][0]]
+                                        if shard in split else [])
+                          for (obs_config, game_ids), split in zip(partitions, splits)])
+                 for shard in sorted(set().union(*splits))]
+        if len(calls) == 1:
+            shard, shard_partitions = calls[0]
+            return self.clients[shard].observe_batch_raw_partitioned(shard_partitions, extra_build_actions, out)
+        results = self._map(lambda shard, shard_partitions:
+                            self.clients[shard].observe_batch_raw_partitioned(shard_partitions, extra_build_actions),
+                            calls)
+        merged = []
+        offset = 0
+        for partition, ((obs_config, game_ids), split) in enumerate(zip(partitions, splits)):
+            shard_results = [(split[shard][0], obs[partition]) for (shard, _), obs in zip(calls, results) if shard in split]
+            merged.append(self._merge(obs_config, len(game_ids), shard_results, None if out is None else out[offset:]))
+            offset += len(merged[-1])
+        return merged
+
+    def _merge(self, obs_config: ObsConfig, num_games: int, shard_results: List[Tuple[List[int], np.ndarray]],
+               out: Optional[np.ndarray]) -> np.ndarray:
+        """
+        Merges the observations of each server with the `indices` of its games into the order of the request.
+        """
+        if num_games == 0:
+            return np.empty(0, dtype=np.float32)
+        # Each response consists of the observations, the nonobs features and the action masks of all its games
+        sections = [obs_config.stride(), obs_config.nonobs_features()]
+        sections.append(len(shard_results[0][1]) // len(shard_results[0][0]) - sum(sections))
+        size = num_games * sum(sections)
+        out = np.empty(size, dtype=np.float32) if out is None else out[:size]
+        for indices, obs in shard_results:
+            offset = 0
+            shard_offset = 0
+            for section in sections:
+                out[offset:offset + num_games * section].reshape(num_games, section)[indices] = \
+                    obs[shard_offset:shard_offset + len(indices) * section].reshape(len(indices), section)
+                offset += num_games * section
+                shard_offset += len(indices) * section
+        return out
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for client in self.clients:
+            client.close()
+
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.clients))
+        return self._executor
+
+    def _next_shards(self, count: int) -> List[int]:
+        shards = [(self.next_shard + i) % len(self.clients) for i in range(count)]
+        self.next_shard = (self.next_shard + count) % len(self.clients)
+        return shards
+
+    def _global_id(self, shard: int, local_id: int) -> int:
+        return local_id * len(self.clients) + shard
+
+    def _local_id(self, game_id: int) -> Tuple[int, int]:
+        return game_id % len(self.clients), game_id // len(self.clients)
+
+    def _split(self, game_ids: List[int]) -> List[Tuple[int, List[int], dict]]:
+        """
+        Groups `game_ids` by server, returning the shard, indices into `game_ids` and a map from indices to local ids.
+        """
+        indices = defaultdict(list)
+        local_ids = defaultdict(dict)
+        for i, game_id in enumerate(game_ids):
+            shard, local_id = self._local_id(game_id)
+            indices[shard].append(i)
+            local_ids[shard][i] = local_id
+        return [(shard, indices[shard], local_ids[shard]) for shard in sorted(indices.keys())]
+
+    def _map(self, fn, calls: List[tuple]) -> list:
+        if len(calls) == 1:
+            return [fn(*calls[0])]
+        return list(self.executor().map(lambda call: fn(*call), calls))
+
+
+def connect(endpoints: Optional[List[str]] = None, **kwargs):
+    """
+    Returns a client for the servers at `endpoints`, which spreads games across the servers if there are several.
+    """
+    if endpoints is not None and len(endpoints) > 1:
+        return ShardedCodeCraftClient(endpoints, **kwargs)
+    return CodeCraftClient(endpoints[0] if endpoints else DEFAULT_ENDPOINT, **kwargs)
+
+
+class AsyncCodeCraftClient:
+    """
+    asyncio version of `CodeCraftClient` built on aiohttp.
+
+    Requests issued concurrently from different coroutines are multiplexed over a pool of up to `pool_size`
+    keep-alive connections, which allows e.g. the batch-act for one set of games, the batch-observation
+    for another and the creation of new games to all be in flight at the same time.
+    """
+
+    def __init__(self,
+                 endpoint: str = DEFAULT_ENDPOINT,
+                 pool_size: int = 8,
+                 connect_timeout: float = 5.0,
+                 read_timeout: Optional[float] = 120.0,
+                 retries: int = RETRIES,
+                 retry_delay: float = 1.0):
+        self.endpoint, self.socket_path = split_endpoint(endpoint)
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.unsupported = set()
+        self.build_tables = {}
+        self._session = None
+
+    @instrumented
+    async def create_game(self,
+                          game_length: int = None,
+                          action_delay: int = 0,
+                          self_play: bool = False,
+                          custom_map=None,
+                          scripted_opponent: str = 'none',
+                          rules=Rules(),
+                          allowHarvesting: bool = True,
+                          forceHarvesting: bool = True,
+                          randomizeIdle: bool = True) -> int:
+        if game_length:
+            url = start_game_url(self.endpoint, game_length, action_delay, scripted_opponent, rules,
+                                 allowHarvesting, forceHarvesting, randomizeIdle)
+            response = await self._request('POST', url, 'create_game', json=custom_map or '')
+        else:
+            response = await self._request('POST', f'{self.endpoint}/start-game?actionDelay={action_delay}', 'create_game')
+        return int(orjson.loads(response)['id'])
+
+    @instrumented
+    async def create_games(self, games: List[dict]) -> List[int]:
+        if len(games) == 0:
+            return []
+        response = await self._request_if_supported('POST', '/batch-start-game', 'create_games',
+                                                    data=batch_start_game_payload(games),
+                                                    headers={'Content-Type': 'application/json'})
+        if response is not None:
+            return [int(game_id) for game_id in orjson.loads(response)]
+        return list(await asyncio.gather(*[self.create_game(**game) for game in games]))
+
+    @instrumented
+    async def abandon_games(self, game_ids: List[int]) -> bool:
+        if len(game_ids) == 0:
+            return True
+        response = await self._request_if_supported('POST', '/batch-abandon-game', 'abandon_games', json=game_ids)
+        return response is not None
+
+    @instrumented
+    async def act_batch(self, actions):
+        await self._request('POST', f'{self.endpoint}/batch-act', 'act_batch',
+                            data=act_batch_payload(actions),
+                            headers={'Content-Type': 'application/json'})
+
+    @instrumented
+    async def act_batch_packed(self,
+                               game_ids: List[Tuple[int, int]],
+                               actions: np.ndarray,
+                               build_table: List[List[int]]):
+        table_id = await self._build_table_id(build_table)
+        if table_id is not None:
+            response = await self._request_if_supported('POST', '/batch-act-binary', 'act_batch_packed',
+                                                        query=f'?buildTable={table_id}&drones={actions.shape[1]}',
+                                                        data=act_batch_binary_payload(game_ids, actions),
+                                                        headers={'Content-Type': 'application/octet-stream'})
+            if response is not None:
+                return
+        await self.act_batch(unpack_actions(game_ids, actions, build_table))
+
+    @instrumented
+    async def observe(self, game_id: int, player_id: int = 0):
+        url = f'{self.endpoint}/observation?gameID={game_id}&playerID={player_id}'
+        return orjson.loads(await self._request('GET', url, 'observe'))
+
+    @instrumented
+    async def observe_batch(self, game_ids):
+        return orjson.loads(await self._request('GET', f'{self.endpoint}/batch-observation', 'observe_batch',
+                                                json=[game_ids, []]))
+
+    @instrumented
+    async def observe_batch_raw(self,
+                                obs_config: ObsConfig,
+                                game_ids: List[Tuple[int, int]],
+                                extra_build_actions: List[List[int]]) -> np.ndarray:
+        url = client_observation_url(self.endpoint, obs_config)
+        headers = requests.structures.CaseInsensitiveDict()
+        response = await self._request('GET', url, 'observe_batch_raw', json=[game_ids, extra_build_actions],
+                                       response_headers=headers)
+        encoding = headers.get(OBS_ENCODING_HEADER, 'float32')
+        if encoding != 'float32':
+            return decode_observations(np.frombuffer(response, dtype=np.uint8), encoding, obs_config, len(game_ids))
+        return np.frombuffer(response, dtype=np.float32)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def session(self):
+        # aiohttp sessions have to be created from within a running event loop
+        if self._session is None:
+            import aiohttp
+            if self.socket_path is not None:
+                connector = aiohttp.UnixConnector(self.socket_path, limit=self.pool_size)
+            else:
+                connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            )
+        return self._session
+
+    async def _build_table_id(self, build_table: List[List[int]]) -> Optional[int]:
+        key = tuple(tuple(build) for build in build_table)
+        if key not in self.build_tables:
+            response = await self._request_if_supported('POST', '/build-table', 'register_build_table',
+                                                        data=orjson.dumps(build_table),
+                                                        headers={'Content-Type': 'application/json'})
+            if response is None:
+                return None
+            self.build_tables[key] = int(orjson.loads(response)['id'])
+        return self.build_tables[key]
+
+    async def _request_if_supported(self, method: str, path: str, name: str, query: str = '',
+                                    **kwargs) -> Optional[bytes]:
+        import aiohttp
+        if path in self.unsupported:
+            return None
+        try:
+            return await self._request(method, f'{self.endpoint}{path}{query}', name, **kwargs)
+        except aiohttp.ClientResponseError as e:
+            if e.status != 404:
+                raise
+            logging.info(f"{self.endpoint} does not support {path}, falling back to older API")
+            self.unsupported.add(path)
+            return None
+
+    async def _request(self, method: str, url: str, name: str, response_headers: Optional[dict] = None,
+                       **kwargs) -> bytes:
+        import aiohttp
+        retries = self.retries
+        while True:
+            try:
+                async with self.session().request(method, url, **kwargs) as response:
+                    response.raise_for_status()
+                    if response_headers is not None:
+                        response_headers.update(response.headers)
+                    body = await response.read()
+                    if request_metrics.enabled:
+                        request_metrics.record_bytes(name, _payload_size(kwargs.get('data')), len(body))
+                    return body
+            except aiohttp.ServerTimeoutError:
+                raise
+            except aiohttp.ClientConnectionError as e:
+                retries -= 1
+                if retries <= 0:
+                    raise
+                logging.info(f"Connection error on {name}(), retrying: {e}")
+                if request_metrics.enabled:
+                    request_metrics.record_retry(name)
+                await asyncio.sleep(self.retry_delay)
 
 
 def one_hot_to_action(action):
@@ -0,0 +1,33 @@
+import numpy as np
+import torch
+
+
+def gae_returns(rewards, values, dones, final_values, gamma: float, lamb: float):
+    """
+    Computes the GAE(lambda) returns of a rollout with a reverse scan over its steps that is vectorized across envs.
+
+    `rewards`, `values` and `dones` are `[seq_rosteps, num_envs]` NumPy arrays or torch tensors, where `dones[t]`
+    marks the envs whose episode ended with `rewards[t]`, and `final_values` are the `[num_envs]` values of the
+    observations that follow the last step. The advantages are `returns - values`.
+
+    NumPy inputs are accumulated in float64 and the returns are float32, torch tensors stay in their dtype and device.
+    """
+    if isinstance(values, torch.Tensor):
+        nonterminal = 1.0 - dones.to(values.dtype)
+        next_values = torch.cat([values[1:], final_values.view(1, -1).to(values.dtype)])
+        returns = torch.empty_like(values)
+        last_gae = torch.zeros_like(values[0])
+    else:
+        rewards, values, dones, final_values = \
+            [np.asarray(array, dtype=np.float64) for array in [rewards, values, dones, final_values]]
+        nonterminal = 1.0 - dones
+        next_values = np.concatenate([values[1:], final_values[None, :]])
+        returns = np.empty(values.shape, dtype=np.float32)
+        last_gae = np.zeros_like(values[0])
+
+    td_errors = rewards + gamma * next_values * nonterminal - values
+    discounts = gamma * lamb * nonterminal
+    for t in reversed(range(len(td_errors))):
+        last_gae = td_errors[t] + discounts[t] * last_gae
+        returns[t] = last_gae + values[t]
+    return returns
@@ -1,2 +1,4 @@
 from gym_codecraft.envs.codecraft_vec_env import CodeCraftVecEnv
+from gym_codecraft.envs.codecraft_vec_env import AsyncCodeCraftVecEnv
 from gym_codecraft.envs.codecraft_vec_env import Objective
+from gym_codecraft.envs.subproc_vec_env import SubprocCodeCraftVecEnv
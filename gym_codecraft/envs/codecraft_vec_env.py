@@ -1,8 +1,12 @@
-from collections import defaultdict
+import asyncio
+from collections import defaultdict, deque
+import logging
 import math
+import threading
+import time
 
 from enum import Enum
-from typing import List, Union, Optional, Tuple
+from typing import Callable, Dict, Hashable, List, Union, Optional, Tuple
 import numpy as np
 
 import codecraft
@@ -29,22 +33,22 @@ def drone_dict(x, y,
     }
 
 
-def random_drone():
+def random_drone(rng=np.random):
     modules = ['storageModules', 'constructors', 'missileBatteries', 'shieldGenerators', 'missileBatteries']
-    drone = drone_dict(np.random.randint(-450, 450), np.random.randint(-450, 450))
-    for _ in range(0, np.random.randint(2, 5)):
-        module = modules[np.random.randint(0, len(modules))]
+    drone = drone_dict(rng.randint(-450, 450), rng.randint(-450, 450))
+    for _ in range(0, rng.randint(2, 5)):
+        module = modules[rng.randint(0, len(modules))]
         drone[module] += 1
     return drone
 
 
-def random_rules(rnd_msdm: float, rnd_cost: float, targets: Rules) -> Rules:
+def random_rules(rnd_msdm: float, rnd_cost: float, targets: Rules, rng=np.random) -> Rules:
     if targets is not None:
         def rnd(target):
             if target > 1:
-                return 2 ** np.random.uniform(0.0, np.log2(target))
+                return 2 ** rng.uniform(0.0, np.log2(target))
             else:
-                return 2 ** np.random.uniform(np.log2(target), 0.0)
+                return 2 ** rng.uniform(np.log2(target), 0.0)
         return Rules(
             mothership_damage_multiplier=rnd(rnd_msdm),
             cost_modifier_size=list(map(rnd, targets.cost_modifier_size)),
@@ -56,71 +60,71 @@ def random_rules(rnd_msdm: float, rnd_cost: float, targets: Rules) -> Rules:
         )
     else:
         return Rules(
-            mothership_damage_multiplier=2 ** np.random.uniform(0.0, np.log2(rnd_msdm)),
+            mothership_damage_multiplier=2 ** rng.uniform(0.0, np.log2(rnd_msdm)),
         )
 
 
-def map_arena_tiny(randomize: bool, hardness: int, require_default_mothership: bool):
+def map_arena_tiny(randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random):
     storage_modules = 1
     constructors = 1
     missiles_batteries = 1
     if randomize:
-        storage_modules = np.random.randint(1, 3)
-        constructors = np.random.randint(1, 3)
-        missiles_batteries = np.random.randint(1, 3)
+        storage_modules = rng.randint(1, 3)
+        constructors = rng.randint(1, 3)
+        missiles_batteries = rng.randint(1, 3)
     return {
         'mapWidth': 1000,
         'mapHeight': 1000,
         'minerals': [],
         'player1Drones': [
-            drone_dict(np.random.randint(-450, 450),
-                       np.random.randint(-450, 450),
+            drone_dict(rng.randint(-450, 450),
+                       rng.randint(-450, 450),
                        storage_modules=storage_modules,
                        constructors=constructors)
         ],
         'player2Drones': [
-            drone_dict(np.random.randint(-450, 450),
-                       np.random.randint(-450, 450),
+            drone_dict(rng.randint(-450, 450),
+                       rng.randint(-450, 450),
                        missile_batteries=missiles_batteries,
                        shield_generators=4 - missiles_batteries)
         ],
     }
 
 
-def map_arena_tiny_2v2(randomize: bool, hardness: int, require_default_mothership: bool):
+def map_arena_tiny_2v2(randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random):
     s1 = 1
     s2 = 1
     if randomize:
-        s1 = np.random.randint(0, 2)
-        s2 = np.random.randint(0, 2)
+        s1 = rng.randint(0, 2)
+        s2 = rng.randint(0, 2)
     return {
         'mapWidth': 1000,
         'mapHeight': 1000,
         'minerals': [],
         'player1Drones': [
-            drone_dict(np.random.randint(-450, 450),
-                       np.random.randint(-450, 450),
+            drone_dict(rng.randint(-450, 450),
+                       rng.randint(-450, 450),
                        missile_batteries=1-s1,
                        shield_generators=s1),
-            drone_dict(np.random.randint(-450, 450),
-                       np.random.randint(-450, 450),
+            drone_dict(rng.randint(-450, 450),
+                       rng.randint(-450, 450),
                        missile_batteries=1),
         ],
         'player2Drones': [
-            drone_dict(np.random.randint(-450, 450),
-                       np.random.randint(-450, 450),
+            drone_dict(rng.randint(-450, 450),
+                       rng.randint(-450, 450),
                        missile_batteries=1-s2,
                        shield_generators=s2),
-            drone_dict(np.random.randint(-450, 450),
-                       np.random.randint(-450, 450),
+            drone_dict(rng.randint(-450, 450),
+                       rng.randint(-450, 450),
                        missile_batteries=1),
         ],
     }
 
 
-def map_arena_medium(randomize: bool, hardness: int, require_default_mothership: bool):
+def map_arena_medium(randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random):
     if randomize:
-        hardness = np.random.randint(0, hardness+1)
+        hardness = rng.randint(0, hardness+1)
     if hardness == 0:
         map_width = 1500
         map_height = 1500
@@ -130,7 +134,7 @@ def map_arena_medium(randomize: bool, hardness: int, require_default_mothership:
         map_height = 2000
         mineral_count = 8
 
-    angle = 2 * np.pi * np.random.rand()
+    angle = 2 * np.pi * rng.rand()
     spawn_x = (map_width // 2 - 100) * np.sin(angle)
     spawn_y = (map_height // 2 - 100) * np.cos(angle)
     return {
@@ -152,7 +156,7 @@ def map_arena_medium(randomize: bool, hardness: int, require_default_mothership:
     }
 
 
-def map_arena_medium_large_ms(randomize: bool, hardness: int, require_default_mothership: bool):
+def map_arena_medium_large_ms(randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random):
     ms = dict(constructors=3,
               storage_modules=3,
               missile_batteries=3,
@@ -160,11 +164,11 @@ def map_arena_medium_large_ms(randomize: bool, hardness: int, require_default_mo
               resources=10)
     ms2 = ms.copy()
     if randomize:
-        imbalance = np.random.randint(-10, 11)
+        imbalance = rng.randint(-10, 11)
         ms['resources'] += imbalance
         ms2['resources'] -= imbalance
     if randomize:
-        hardness = np.random.randint(0, hardness+1)
+        hardness = rng.randint(0, hardness+1)
     if hardness == 0:
         map_width = 1500
         map_height = 1500
@@ -174,7 +178,7 @@ def map_arena_medium_large_ms(randomize: bool, hardness: int, require_default_mo
         map_height = 2000
         mineral_count = 8
 
-    angle = 2 * np.pi * np.random.rand()
+    angle = 2 * np.pi * rng.rand()
     spawn_x = (map_width // 2 - 100) * np.sin(angle)
     spawn_y = (map_height // 2 - 100) * np.cos(angle)
     return {
@@ -186,9 +190,9 @@ def map_arena_medium_large_ms(randomize: bool, hardness: int, require_default_mo
     }
 
 
-def map_arena(randomize: bool, hardness: int, require_default_mothership: bool):
+def map_arena(randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random):
     if randomize:
-        hardness = np.random.randint(0, hardness+1)
+        hardness = rng.randint(0, hardness+1)
     if hardness == 0:
         map_width = 1500
         map_height = 1500
@@ -206,7 +210,7 @@ def map_arena(randomize: bool, hardness: int, require_default_mothership: bool):
         map_height = 2500
         mineral_count = 6
 
-    angle = 2 * np.pi * np.random.rand()
+    angle = 2 * np.pi * rng.rand()
     spawn_x = (map_width // 2 - 100) * np.sin(angle)
     spawn_y = (map_height // 2 - 100) * np.cos(angle)
     return {
@@ -230,49 +234,61 @@ def map_arena(randomize: bool, hardness: int, require_default_mothership: bool):
     }
 
 
-def standard_starting_drones(map_height, map_width, randomize):
+def standard_starting_drones(map_height, map_width, randomize, rng=np.random):
     drones = []
-    starting_resources = np.random.randint(0, 8) if randomize else 7
+    starting_resources = rng.randint(0, 8) if randomize else 7
     already_1s1c = False
-    if randomize and np.random.uniform(0, 1) < 0.3:
+    if randomize and rng.uniform(0, 1) < 0.3:
         for _ in range(2):
             if already_1s1c:
-                mstype = np.random.randint(0, 3)
+                mstype = rng.randint(0, 3)
             else:
-                mstype = np.random.randint(0, 4)
-            if mstype == 0:
-                drones.append(dict(
-                    constructors=2,
-                    storage_modules=2,
-                    resources=2 * starting_resources
-                ))
-            elif mstype == 1:
-                drones.append(dict(
-                    constructors=1,
-                    storage_modules=2,
-                    engines=1,
-                    resources=2 * starting_resources
-                ))
-            elif mstype == 2:
-                drones.append(dict(
-                    constructors=1,
-                    storage_modules=2,
-                    missile_batteries=1,
-                    resources=2 * starting_resources
-                ))
-            elif mstype == 3:
-                drones.append(dict(constructors=1, storage_modules=1, resources=starting_resources))
+                mstype = rng.randint(0, 4)
+            drones.append(mothership(mstype, starting_resources))
+            if mstype == 3:
                 already_1s1c = True
     else:
-        drones.append(
-            dict(constructors=3,
-                 storage_modules=3,
-                 missile_batteries=3,
-                 shield_generators=1,
-                 resources=10)
-        )
+        drones.append(DEFAULT_MOTHERSHIP)
+
+    angle = 2 * np.pi * rng.rand()
+    return spawn_drones(drones, map_height, map_width, angle)
+
+
+def standard_starting_drones_batch(map_heights, map_widths, randomize, rng=np.random):
+    """Vectorized `standard_starting_drones` for a batch of maps, draws all random numbers up front."""
+    n = len(map_heights)
+    starting_resources = rng.randint(0, 8, n) if randomize else np.full(n, 7)
+    varied = rng.uniform(0, 1, n) < 0.3 if randomize else np.zeros(n, dtype=bool)
+    first = rng.randint(0, 4, n)
+    # Only one of the two motherships can be of type 3
+    second = np.where(first == 3, rng.randint(0, 3, n), rng.randint(0, 4, n))
+    angles = 2 * np.pi * rng.rand(n)
+    players = []
+    for i in range(n):
+        if varied[i]:
+            drones = [mothership(first[i], starting_resources[i]), mothership(second[i], starting_resources[i])]
+        else:
+            drones = [DEFAULT_MOTHERSHIP]
+        players.append(spawn_drones(drones, map_heights[i], map_widths[i], angles[i]))
+    return players
+
+
+DEFAULT_MOTHERSHIP = dict(constructors=3, storage_modules=3, missile_batteries=3, shield_generators=1, resources=10)
+
 
-    angle = 2 * np.pi * np.random.rand()
+def mothership(mstype, starting_resources) -> dict:
+    starting_resources = int(starting_resources)
+    if mstype == 0:
+        return dict(constructors=2, storage_modules=2, resources=2 * starting_resources)
+    elif mstype == 1:
+        return dict(constructors=1, storage_modules=2, engines=1, resources=2 * starting_resources)
+    elif mstype == 2:
+        return dict(constructors=1, storage_modules=2, missile_batteries=1, resources=2 * starting_resources)
+    else:
+        return dict(constructors=1, storage_modules=1, resources=starting_resources)
+
+
+def spawn_drones(drones, map_height, map_width, angle):
     spawn_x = (map_width // 2 - 100) * np.sin(angle)
     spawn_y = (map_height // 2 - 100) * np.cos(angle)
     dcount = len(drones)
@@ -285,9 +301,9 @@ def standard_starting_drones(map_height, map_width, randomize):
     return player1, player2
 
 
-def map_smol_standard(randomize: bool, hardness: int, require_default_mothership: bool):
+def map_smol_standard(randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random):
     if randomize:
-        hardness = np.random.randint(0, hardness+1)
+        hardness = rng.randint(0, hardness+1)
     if hardness == 0:
         map_width = 2000
         map_height = 2000
@@ -297,7 +313,8 @@ def map_smol_standard(randomize: bool, hardness: int, require_default_mothership
         map_height = 2500
         mineral_count = 13
 
-    player1, player2 = standard_starting_drones(map_height, map_width, randomize and not require_default_mothership)
+    player1, player2 = standard_starting_drones(map_height, map_width, randomize and not require_default_mothership,
+                                                rng=rng)
     return {
         'mapWidth': map_width,
         'mapHeight': map_height,
@@ -307,74 +324,31 @@ def map_smol_standard(randomize: bool, hardness: int, require_default_mothership
     }
 
 
-def map_standard(randomize: bool, hardness: Union[int, float], require_default_mothership: bool):
+def map_standard(randomize: bool, hardness: Union[int, float], require_default_mothership: bool, rng=np.random):
     # special case conditions for eval that was previously used to get comparable results
     is_eval = isinstance(hardness, int) and hardness <= 5
     if randomize:
         if is_eval:
-            hardness = np.random.randint(0, hardness+1)
+            hardness = rng.randint(0, hardness+1)
         else:
-            area = math.sqrt(np.random.uniform(1, (3 + hardness) ** 2))
+            area = math.sqrt(rng.uniform(1, (3 + hardness) ** 2))
     minerals = None
 
     if randomize and not is_eval:
-        eligible = [(x, y)
-                    for y in range(1, 20)
-                    for x in range(y, y * 2 + 1)
-                    if x * y <= area <= x * y * 2]
-        x, y = eligible[np.random.randint(0, len(eligible))]
-        map_width = 500 * x
-        map_height = 500 * y
+        eligible = np.flatnonzero((STANDARD_MAP_AREAS <= area) & (area <= 2 * STANDARD_MAP_AREAS))
+        x, y = STANDARD_MAP_SIZES[eligible[rng.randint(0, len(eligible))]]
+        map_width = 500 * int(x)
+        map_height = 500 * int(y)
         mineral_count = int(3 * math.sqrt(area))
     else:
         assert(isinstance(hardness, int))
-        if hardness == 0:
-            # AREA: 4. density: 1/2
-            map_width = 1000
-            map_height = 1000
-            mineral_count = 2
-        elif hardness == 1:
-            # AREA: 12, density: 1/4
-            map_width = 2000
-            map_height = 1500
-            mineral_count = 3
-        elif hardness == 2:
-            # AREA: 24, density: 1/4
-            map_width = 3000
-            map_height = 2000
-            mineral_count = 6
-        elif hardness == 3:
-            # AREA: 40, density: 1/5
-            map_width = 4000
-            map_height = 2500
-            mineral_count = 8
-        elif hardness == 4:
-            # AREA: 60, density: 1/6
-            map_width = 5000
-            map_height = 3000
-            mineral_count = 10
-        else:
-            # AREA: 96
-            # Resources: 2 + 2 + ~3 + ~3 + 3 + 3 + 5 + 7 + 10 = 50
-            # Density: ~1/2 (but much sparser?)
-            # Actually resource generation code is complicated and nonlinear, smaller minerals are overweighted no idea what actual densities are.
-            map_width = 6000
-            map_height = 4000
-            minerals = [
-                (10, 10),
-                (10, 10),
-                (7, 20),
-                (7, 20),
-                (5, 30),
-                (5, 30),
-                (5, 50),
-                (5, 70),
-                (5, 100),
-            ]
+        map_width, map_height, minerals = STANDARD_EVAL_MAPS[min(hardness, 5)]
+        minerals = list(minerals)
     if minerals is None:
         minerals = mineral_count * [(1, 50)]
 
-    player1, player2 = standard_starting_drones(map_height, map_width, randomize and not require_default_mothership)
+    player1, player2 = standard_starting_drones(map_height, map_width, randomize and not require_default_mothership,
+                                                rng=rng)
     return {
         'mapWidth': map_width,
         'mapHeight': map_height,
@@ -384,33 +358,102 @@ def map_standard(randomize: bool, hardness: Union[int, float], require_default_m
     }
 
 
-def map_mp(randomize: bool, hardness: int, require_default_mothership: bool):
-    map_width = np.random.randint(2, 7) * 500
-    map_height = np.random.randint(2, 7) * 500
+# Width and height in units of 500 of all sizes of randomized standard maps, in the order they are chosen from
+STANDARD_MAP_SIZES = np.array([(x, y) for y in range(1, 20) for x in range(y, y * 2 + 1)])
+STANDARD_MAP_AREAS = STANDARD_MAP_SIZES[:, 0] * STANDARD_MAP_SIZES[:, 1]
+# Width, height and minerals of the standard maps used for eval, indexed by hardness
+STANDARD_EVAL_MAPS = [
+    # AREA: 4. density: 1/2
+    (1000, 1000, 2 * [(1, 50)]),
+    # AREA: 12, density: 1/4
+    (2000, 1500, 3 * [(1, 50)]),
+    # AREA: 24, density: 1/4
+    (3000, 2000, 6 * [(1, 50)]),
+    # AREA: 40, density: 1/5
+    (4000, 2500, 8 * [(1, 50)]),
+    # AREA: 60, density: 1/6
+    (5000, 3000, 10 * [(1, 50)]),
+    # AREA: 96
+    # Resources: 2 + 2 + ~3 + ~3 + 3 + 3 + 5 + 7 + 10 = 50
+    # Density: ~1/2 (but much sparser?)
+    # Actually resource generation code is complicated and nonlinear, smaller minerals are overweighted no idea what actual densities are.
+    (6000, 4000, [
+        (10, 10),
+        (10, 10),
+        (7, 20),
+        (7, 20),
+        (5, 30),
+        (5, 30),
+        (5, 50),
+        (5, 70),
+        (5, 100),
+    ]),
+]
+
+
+def map_standard_batch(n: int,
+                       randomize: bool,
+                       hardness: Union[int, float],
+                       require_default_mothership: bool,
+                       rng=np.random) -> List[dict]:
+    """Generates `n` maps distributed like `map_standard`, drawing the random numbers of all maps at once."""
+    is_eval = isinstance(hardness, int) and hardness <= 5
+    if randomize and not is_eval:
+        area = np.sqrt(rng.uniform(1, (3 + hardness) ** 2, n))
+        eligible = (STANDARD_MAP_AREAS <= area[:, None]) & (area[:, None] <= 2 * STANDARD_MAP_AREAS)
+        counts = eligible.sum(axis=1)
+        assert counts.all(), 'no standard map size is eligible for hardness {}'.format(hardness)
+        # Index of a uniformly chosen eligible size of each map
+        choice = np.minimum((rng.rand(n) * counts).astype(np.int64), counts - 1)
+        sizes = STANDARD_MAP_SIZES[np.argmax(np.cumsum(eligible, axis=1) > choice[:, None], axis=1)]
+        map_widths = (500 * sizes[:, 0]).tolist()
+        map_heights = (500 * sizes[:, 1]).tolist()
+        minerals = [mineral_count * [(1, 50)] for mineral_count in (3 * np.sqrt(area)).astype(np.int64).tolist()]
+    else:
+        assert(isinstance(hardness, int))
+        hardnesses = rng.randint(0, hardness + 1, n) if randomize else np.full(n, hardness)
+        eval_maps = [STANDARD_EVAL_MAPS[h] for h in np.minimum(hardnesses, 5)]
+        map_widths = [map_width for map_width, _, _ in eval_maps]
+        map_heights = [map_height for _, map_height, _ in eval_maps]
+        minerals = [list(minerals) for _, _, minerals in eval_maps]
+
+    players = standard_starting_drones_batch(map_heights, map_widths, randomize and not require_default_mothership, rng)
+    return [{
+        'mapWidth': map_width,
+        'mapHeight': map_height,
+        'minerals': map_minerals,
+        'player1Drones': player1,
+        'player2Drones': player2,
+    } for map_width, map_height, map_minerals, (player1, player2) in zip(map_widths, map_heights, minerals, players)]
+
+
+def map_mp(randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random):
+    map_width = rng.randint(2, 7) * 500
+    map_height = rng.randint(2, 7) * 500
     player1_drones = []
     player2_drones = []
 
     def randpos():
-        return np.random.randint(-map_width//3, map_width//3), np.random.randint(-map_height//3, map_height//3)
-    scenario = np.random.randint(0, 4)
+        return rng.randint(-map_width//3, map_width//3), rng.randint(-map_height//3, map_height//3)
+    scenario = rng.randint(0, 4)
     if scenario == 0:
-        drone_count = np.random.randint(2, 11)
+        drone_count = rng.randint(2, 11)
         for _ in range(drone_count):
             x1, y1 = randpos()
             player1_drones.append(drone_dict(x1, y1, missile_batteries=1))
             x2, y2 = randpos()
             player2_drones.append(drone_dict(x2, y2, missile_batteries=1))
     elif scenario == 1:
-        p1_drone_count = np.random.randint(0, 3)
-        p2_drone_count = np.random.randint(5, 11)
+        p1_drone_count = rng.randint(0, 3)
+        p2_drone_count = rng.randint(5, 11)
         xm, ym = randpos()
         player1_drones.append(drone_dict(xm, ym, constructors=3, missile_batteries=3, storage_modules=3, shield_generators=1))
-        if np.random.randint(0, 3) == 0:
-            engines = np.random.randint(0, 2)
+        if rng.randint(0, 3) == 0:
+            engines = rng.randint(0, 2)
             x, y = randpos()
             player2_drones.append(drone_dict(x, y, missile_batteries=2, shield_generators=2-engines, engines=engines))
             p2_drone_count -= 4
-        nearby_count = np.random.randint(0, p2_drone_count+1)
+        nearby_count = rng.randint(0, p2_drone_count+1)
         for i in range(p1_drone_count):
             x, y = randpos()
             player1_drones.append(drone_dict(x, y, missile_batteries=1))
@@ -418,15 +461,15 @@ def map_mp(randomize: bool, hardness: int, require_default_mothership: bool):
             if i < nearby_count:
                 x, y = randpos()
             else:
-                x = int(np.clip(xm + np.random.randint(-350, 350), -map_width//2, map_width//2))
-                y = int(np.clip(ym + np.random.randint(-350, 350), -map_height//2, map_height//2))
+                x = int(np.clip(xm + rng.randint(-350, 350), -map_width//2, map_width//2))
+                y = int(np.clip(ym + rng.randint(-350, 350), -map_height//2, map_height//2))
             player2_drones.append(drone_dict(x, y, missile_batteries=1))
     elif scenario == 2:
-        p1_drone_count = np.random.randint(0, 3)
-        p2_drone_count = np.random.randint(3, 7)
-        nearby_count = np.random.randint(0, p2_drone_count+1)
+        p1_drone_count = rng.randint(0, 3)
+        p2_drone_count = rng.randint(3, 7)
+        nearby_count = rng.randint(0, p2_drone_count+1)
         xm, ym = randpos()
-        engines = np.random.randint(0, 2)
+        engines = rng.randint(0, 2)
         player1_drones.append(drone_dict(xm, ym, missile_batteries=2, shield_generators=2-engines, engines=engines))
         for i in range(p1_drone_count):
             x, y = randpos()
@@ -435,13 +478,13 @@ def map_mp(randomize: bool, hardness: int, require_default_mothership: bool):
             if i < nearby_count:
                 x, y = randpos()
             else:
-                x = int(np.clip(xm + np.random.randint(-350, 350), -map_width//2, map_width//2))
-                y = int(np.clip(ym + np.random.randint(-350, 350), -map_height//2, map_height//2))
+                x = int(np.clip(xm + rng.randint(-350, 350), -map_width//2, map_width//2))
+                y = int(np.clip(ym + rng.randint(-350, 350), -map_height//2, map_height//2))
             player2_drones.append(drone_dict(x, y, missile_batteries=1))
     elif scenario == 3:
-        total = np.random.randint(4, 12)
-        p1_large = np.random.randint(0, total//2)
-        p2_large = np.random.randint(0, total//2)
+        total = rng.randint(4, 12)
+        p1_large = rng.randint(0, total//2)
+        p2_large = rng.randint(0, total//2)
         for i in range(total - 2 * p1_large):
             x, y = randpos()
             player1_drones.append(drone_dict(x, y, missile_batteries=1))
@@ -450,11 +493,11 @@ def map_mp(randomize: bool, hardness: int, require_default_mothership: bool):
             player2_drones.append(drone_dict(x, y, missile_batteries=1))
         for i in range(p1_large):
             x, y = randpos()
-            shields = np.random.randint(0, 2)
+            shields = rng.randint(0, 2)
             player1_drones.append(drone_dict(x, y, missile_batteries=2-shields, shield_generators=shields))
         for i in range(p2_large):
             x, y = randpos()
-            shields = np.random.randint(0, 2)
+            shields = rng.randint(0, 2)
             player2_drones.append(drone_dict(x, y, missile_batteries=2-shields, shield_generators=shields))
     return {
         'mapWidth': map_width,
@@ -465,22 +508,299 @@ def map_mp(randomize: bool, hardness: int, require_default_mothership: bool):
     }
 
 
-def map_scout(randomize: bool, hardness: int, require_default_mothership: bool):
+def map_mp_batch(n: int, randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random) -> List[dict]:
+    """Generates `n` maps distributed like `map_mp`, drawing the random numbers of all maps at once."""
+    map_widths = rng.randint(2, 7, n) * 500
+    map_heights = rng.randint(2, 7, n) * 500
+    scenarios = rng.randint(0, 4, n)
+    # Every map places at most 22 drones at random positions and 10 drones close to the mothership
+    low = np.stack([-map_widths // 3, -map_heights // 3], axis=1)[:, None, :]
+    high = np.stack([map_widths // 3, map_heights // 3], axis=1)[:, None, :]
+    positions = (low + (rng.rand(n, 22, 2) * (high - low)).astype(np.int64)).tolist()
+    nearby_offsets = rng.randint(-350, 350, (n, 10, 2)).tolist()
+    # Uniform numbers that determine the drone counts and modules of each map
+    draws = rng.rand(n, 5)
+    shields = rng.randint(0, 2, (n, 2, 5)).tolist()
+
+    maps = []
+    for i in range(n):
+        map_width = int(map_widths[i])
+        map_height = int(map_heights[i])
+        randpos = iter(positions[i]).__next__
+        u = draws[i]
+        player1_drones = []
+        player2_drones = []
+        scenario = scenarios[i]
+        if scenario == 0:
+            for _ in range(_uniform_int(u[0], 2, 11)):
+                x1, y1 = randpos()
+                player1_drones.append(drone_dict(x1, y1, missile_batteries=1))
+                x2, y2 = randpos()
+                player2_drones.append(drone_dict(x2, y2, missile_batteries=1))
+        elif scenario == 1 or scenario == 2:
+            p1_drone_count = _uniform_int(u[0], 0, 3)
+            xm, ym = randpos()
+            engines = _uniform_int(u[1], 0, 2)
+            if scenario == 1:
+                p2_drone_count = _uniform_int(u[2], 5, 11)
+                player1_drones.append(drone_dict(xm, ym, constructors=3, missile_batteries=3, storage_modules=3, shield_generators=1))
+                if u[3] < 1 / 3:
+                    x, y = randpos()
+                    player2_drones.append(drone_dict(x, y, missile_batteries=2, shield_generators=2-engines, engines=engines))
+                    p2_drone_count -= 4
+            else:
+                p2_drone_count = _uniform_int(u[2], 3, 7)
+                player1_drones.append(drone_dict(xm, ym, missile_batteries=2, shield_generators=2-engines, engines=engines))
+            nearby_count = _uniform_int(u[4], 0, p2_drone_count + 1)
+            for _ in range(p1_drone_count):
+                x, y = randpos()
+                player1_drones.append(drone_dict(x, y, missile_batteries=1))
+            for j in range(p2_drone_count):
+                if j < nearby_count:
+                    x, y = randpos()
+                else:
+                    dx, dy = nearby_offsets[i][j]
+                    x = int(np.clip(xm + dx, -map_width//2, map_width//2))
+                    y = int(np.clip(ym + dy, -map_height//2, map_height//2))
+                player2_drones.append(drone_dict(x, y, missile_batteries=1))
+        else:
+            total = _uniform_int(u[0], 4, 12)
+            p1_large = _uniform_int(u[1], 0, total//2)
+            p2_large = _uniform_int(u[2], 0, total//2)
+            for _ in range(total - 2 * p1_large):
+                x, y = randpos()
+                player1_drones.append(drone_dict(x, y, missile_batteries=1))
+            for _ in range(total - 2 * p2_large):
+                x, y = randpos()
+                player2_drones.append(drone_dict(x, y, missile_batteries=1))
+            for j in range(p1_large):
+                x, y = randpos()
+                player1_drones.append(drone_dict(x, y, missile_batteries=2-shields[i][0][j], shield_generators=shields[i][0][j]))
+            for j in range(p2_large):
+                x, y = randpos()
+                player2_drones.append(drone_dict(x, y, missile_batteries=2-shields[i][1][j], shield_generators=shields[i][1][j]))
+        maps.append({
+            'mapWidth': map_width,
+            'mapHeight': map_height,
+            'minerals': 2 * [(1, 50)],
+            'player1Drones': player1_drones,
+            'player2Drones': player2_drones,
+        })
+    return maps
+
+
+def _uniform_int(u: float, low: int, high: int) -> int:
+    """Maps `u` drawn uniformly from [0, 1) to an integer drawn uniformly from [low, high)."""
+    return low + min(int(u * (high - low)), high - low - 1)
+
+
+# Batched variants of map generators that can be used with a `MapPool`
+MAP_BATCH_GENERATORS = {
+    map_standard: map_standard_batch,
+    map_mp: map_mp_batch,
+}
+
+
+def map_scout(randomize: bool, hardness: int, require_default_mothership: bool, rng=np.random):
     return {
         'mapWidth': 5000,
         'mapHeight': 5000,
         'minerals': [],
         'player1Drones': [
-            drone_dict(np.random.randint(-2500, 2500), np.random.randint(-2500, 2500), missile_batteries=1)
+            drone_dict(rng.randint(-2500, 2500), rng.randint(-2500, 2500), missile_batteries=1)
             for _ in range(5)
         ],
         'player2Drones': [
-            drone_dict(np.random.randint(-2500, 2500), np.random.randint(-2500, 2500), storage_modules=1)
+            drone_dict(rng.randint(-2500, 2500), rng.randint(-2500, 2500), storage_modules=1)
             for _ in range(20)
         ],
     }
 
 
+def build_name(build: List[int]) -> str:
+    storage, missile, constructor, engine, shield = build
+    name = ''
+    if storage > 0:
+        name += f'{storage}s'
+    if missile > 0:
+        name += f'{missile}m'
+    if constructor > 0:
+        name += f'{constructor}c'
+    if engine > 0:
+        name += f'{engine}e'
+    if shield > 0:
+        name += f'{shield}p'
+    return name
+
+
+class BufferRing:
+    """
+    Small ring of preallocated float32 buffers that are handed out in turn.
+
+    An array returned by `next` is reused after `size` further calls, so it stays valid while the following
+    `size - 1` buffers are being filled.
+    """
+
+    def __init__(self, size: int):
+        self.buffers: List[Optional[np.ndarray]] = [None] * size
+        self.index = 0
+
+    def next(self, nfloats: int) -> np.ndarray:
+        buffer = self.buffers[self.index]
+        if buffer is None or len(buffer) != nfloats:
+            buffer = np.empty(nfloats, dtype=np.float32)
+            self.buffers[self.index] = buffer
+        self.index = (self.index + 1) % len(self.buffers)
+        return buffer
+
+
+class GamePool:
+    """
+    Games created ahead of time for each kind of replacement game, kept topped up by a background thread.
+
+    A kind is added to the pool by the first `take` that asks for it, after which the pool holds up to `size`
+    ready games of that kind. `create_args(kind, rng)` returns the arguments of a new game of the given kind and is
+    called on the background thread with the pool's own `rng`, so that it never draws from the global `np.random`
+    that the env uses on the calling thread.
+
+    `settings()` returns the settings of the env that the arguments depend on, such as the hardness. Games created
+    before the settings last changed are discarded, and `take` returns their ids so that the caller can abandon them.
+    """
+
+    def __init__(self,
+                 client: codecraft.CodeCraftClient,
+                 create_args: Callable[[Hashable, np.random.RandomState], dict],
+                 settings: Callable[[], tuple],
+                 size: int):
+        self.client = client
+        self.create_args = create_args
+        self.settings = settings
+        self.size = size
+        self.rng = np.random.RandomState(np.random.randint(2 ** 31))
+        self.ready: Dict[Hashable, deque] = {}
+        self.game_settings = settings()
+        self.stale: List[int] = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def take(self, kinds: List[Hashable]) -> Tuple[List[Optional[int]], List[int]]:
+        """
+        Removes a ready game of each kind from the pool, with `None` for kinds with no ready game, and returns them
+        together with the ids of the games that were discarded since the last call.
+        """
+        with self.cond:
+            settings = self.settings()
+            if settings != self.game_settings:
+                # Games created with the previous settings are discarded
+                self.game_settings = settings
+                self.stale.extend(game_id for ready in self.ready.values() for game_id in ready)
+                self.ready = {}
+            game_ids = []
+            for kind in kinds:
+                ready = self.ready.setdefault(kind, deque())
+                game_ids.append(ready.popleft() if ready else None)
+            stale, self.stale = self.stale, []
+            self.cond.notify()
+        return game_ids, stale
+
+    def close(self) -> List[int]:
+        """Stops the background thread and returns the ids of the games that were never taken."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        return [game_id for ready in self.ready.values() for game_id in ready] + self.stale
+
+    def _missing(self) -> List[Hashable]:
+        return [kind for kind, ready in self.ready.items() for _ in range(self.size - len(ready))]
+
+    def _fill(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closed or len(self._missing()) > 0)
+                if self.closed:
+                    return
+                kinds = self._missing()
+                settings = self.game_settings
+            try:
+                game_ids = self.client.create_games([self.create_args(kind, self.rng) for kind in kinds])
+            except Exception:
+                logging.exception('Failed to create games for the game pool')
+                time.sleep(1.0)
+                continue
+            with self.cond:
+                if settings != self.game_settings:
+                    # The settings changed while the games were created
+                    self.stale.extend(game_ids)
+                    continue
+                for kind, game_id in zip(kinds, game_ids):
+                    self.ready[kind].append(game_id)
+
+
+class MapPool:
+    """
+    Maps generated ahead of time in batches by a background thread.
+
+    `generate(n, randomize, hardness, require_default_mothership, rng)` returns `n` new maps, e.g. one of the
+    `MAP_BATCH_GENERATORS`. The pool holds up to `size` ready maps for each combination of arguments that `take`
+    was called with since the hardness last changed.
+    """
+
+    def __init__(self, generate: Callable[..., List[dict]], size: int):
+        self.generate = generate
+        self.size = size
+        self.rng = np.random.RandomState(np.random.randint(2 ** 31))
+        self.ready: Dict[Tuple[bool, Union[int, float], bool], deque] = {}
+        self.hardness = None
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def take(self,
+             randomize: bool,
+             hardness: Union[int, float],
+             require_default_mothership: bool,
+             rng=np.random) -> dict:
+        """Removes a ready map from the pool, generates the map on the calling thread from `rng` if there is none."""
+        key = (randomize, hardness, require_default_mothership)
+        with self.cond:
+            if hardness != self.hardness:
+                # Maps generated for the previous hardness are discarded
+                self.hardness = hardness
+                self.ready = {}
+            ready = self.ready.setdefault(key, deque())
+            map = ready.popleft() if ready else None
+            self.cond.notify()
+        if map is None:
+            map = self.generate(1, *key, rng=rng)[0]
+        return map
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+    def _missing(self) -> Dict[Tuple[bool, Union[int, float], bool], int]:
+        return {key: self.size - len(ready) for key, ready in self.ready.items() if len(ready) < self.size}
+
+    def _fill(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closed or len(self._missing()) > 0)
+                if self.closed:
+                    return
+                missing = self._missing()
+            generated = {key: self.generate(n, *key, rng=self.rng) for key, n in missing.items()}
+            with self.cond:
+                for key, maps in generated.items():
+                    if key in self.ready:
+                        self.ready[key].extend(maps)
+
+
 class CodeCraftVecEnv(object):
     def __init__(self,
                  num_envs,
@@ -509,8 +829,19 @@ class CodeCraftVecEnv(object):
                  stagger_offset: float = 0.0,
                  mothership_damage_scale: float = 3.0,
                  loss_penalty: float = 0.0,
-                 partial_score: float = 1.0):
+                 partial_score: float = 1.0,
+                 client: Optional[codecraft.CodeCraftClient] = None,
+                 obs_ring_size: int = 2,
+                 endpoints: Optional[List[str]] = None,
+                 game_pool_size: int = 0,
+                 map_pool_size: int = 0):
         assert(num_envs >= 2 * num_self_play)
+        assert not (fair and game_pool_size > 0), 'fair maps are generated in pairs and cannot be pooled'
+        # Games are spread across all servers in `endpoints`
+        self.client = client or codecraft.connect(endpoints)
+        # Observations are read into a ring of reused buffers for each env subset. Arrays returned by
+        # `observe` are only valid until `obs_ring_size - 1` further observations of the same subset.
+        self.obs_rings = defaultdict(lambda: BufferRing(obs_ring_size))
         self.num_envs = num_envs
         self.objective = objective
         self.action_delay = action_delay
@@ -519,7 +850,7 @@ class CodeCraftVecEnv(object):
         self.stagger_offset = stagger_offset
         self.fair = fair
         self.game_length = 3 * 60 * 60
-        self.custom_map = lambda _1, _2, _3: None
+        self.custom_map = lambda _1, _2, _3, rng=None: None
         self.last_map = None
         self.randomize = randomize
         self.use_action_masks = use_action_masks
@@ -544,15 +875,8 @@ class CodeCraftVecEnv(object):
         self.randomize_idle = objective != Objective.ALLIED_WEALTH
         self.mothership_damage_scale = mothership_damage_scale
 
-        remaining_scripted = num_envs - 2 * num_self_play
-        self.scripted_opponents = []
-        if scripted_opponents is not None:
-            for opponent, count in scripted_opponents:
-                remaining_scripted -= count
-                for _ in range(count):
-                    self.scripted_opponents.append(opponent)
-        for _ in range(remaining_scripted):
-            self.scripted_opponents.append('idle')
+        self.scripted_opponent_counts = scripted_opponents or []
+        self.scripted_opponents = self._opponent_rotation()
         self.next_opponent_index = 0
 
         if objective == Objective.ARENA_TINY:
@@ -616,20 +940,44 @@ class CodeCraftVecEnv(object):
             self.game_length = max_game_length
         self.build_costs = [sum(modules) for modules in self.builds]
         self.base_naction = 8 + len(self.builds)
+        # Builds that can be referenced by packed actions, the last entry is the default build of action 6
+        self.build_table = self.builds + [[0, 1, 0, 0, 0]]
+        # Distinct names of builds and the index of the name of each entry in the build table
+        self.build_names = []
+        for build in self.build_table:
+            if build_name(build) not in self.build_names:
+                self.build_names.append(build_name(build))
+        self.build_ids = np.array([self.build_names.index(build_name(build)) for build in self.build_table])
+        self.action_table = self._action_table()
 
         self.mix_mp = mix_mp
         self.game_count = 0
         self.mp_game_count = 0
 
         self.games = []
-        self.eplen = []
-        self.eprew = []
-        self.score = []
-        self.performed_builds = []
-
-    def rules(self) -> Rules:
-        if np.random.uniform(0, 1) < self.rule_rng_fraction:
-            return random_rules(2 ** self.mothership_damage_scale, self.rule_cost_rng, self.rng_ruleset)
+        # Length, return and last shaped score of the current episode of each env, score is NaN until first observed
+        self.eplen = np.ones(num_envs, dtype=np.int64)
+        self.eprew = np.zeros(num_envs, dtype=np.float32)
+        self.score = np.full(num_envs, np.nan, dtype=np.float32)
+        # Number of times each env has performed each build (indexed by `build_ids`) during the current episode
+        self.build_counts = np.zeros((num_envs, len(self.build_names)), dtype=np.int64)
+        # Replacement games are taken from the pool when available and their first observation is returned in
+        # place of the final observation of the finished game
+        self.game_pool = GamePool(self.client, self._replacement_args, self._game_settings, game_pool_size) \
+            if game_pool_size > 0 else None
+        self.play_out_thread: Optional[threading.Thread] = None
+        # Maps of objectives with a batched map generator are generated ahead of time on a background thread
+        self.map_pool = None
+        self.mp_map_pool = None
+        if map_pool_size > 0:
+            if self.custom_map in MAP_BATCH_GENERATORS:
+                self.map_pool = MapPool(MAP_BATCH_GENERATORS[self.custom_map], map_pool_size)
+            if mix_mp > 0:
+                self.mp_map_pool = MapPool(map_mp_batch, map_pool_size)
+
+    def rules(self, rng=np.random) -> Rules:
+        if rng.uniform(0, 1) < self.rule_rng_fraction:
+            return random_rules(2 ** self.mothership_damage_scale, self.rule_cost_rng, self.rng_ruleset, rng=rng)
         else:
             return Rules()
 
@@ -646,47 +994,86 @@ class CodeCraftVecEnv(object):
             self.next_opponent_index = 0
         return opp
 
+    def reassign(self, num_self_play: Optional[int] = None, scripted_opponents: Optional[List[Tuple[str, int]]] = None):
+        """
+        Changes the number of self-play games and the number of games against each scripted opponent in place.
+
+        Running games are kept and the new assignment applies to the games that replace them when they end.
+        An env pair that turns into a self-play game switches over when the game of its first env ends. The game
+        of the second env is then abandoned and its env reported as done without an episode info.
+        """
+        if num_self_play is not None:
+            assert self.num_envs >= 2 * num_self_play
+            self.num_self_play = num_self_play
+        if scripted_opponents is not None:
+            self.scripted_opponent_counts = scripted_opponents
+        self.scripted_opponents = self._opponent_rotation()
+        self.next_opponent_index = 0
+
+    def _opponent_rotation(self) -> List[str]:
+        opponents = []
+        for opponent, count in self.scripted_opponent_counts:
+            opponents.extend([opponent] * count)
+        opponents.extend(['idle'] * (self.num_envs - 2 * self.num_self_play - len(opponents)))
+        return opponents
+
     def _reset(self, partitioned_obs_config=None):
+        self._clear_games()
+        initial_games = self._initial_games()
+        game_ids = self.client.create_games([args for _, _, args in initial_games])
+        for game_id, (self_play, opponent, _) in zip(game_ids, initial_games):
+            self._add_game(game_id, self_play, opponent)
+
+        if partitioned_obs_config:
+            for obs, _, _, _, action_masks, privileged_obs in self.observe_partitioned(partitioned_obs_config):
+                yield obs, action_masks, privileged_obs
+        else:
+            obs, _, _, _, action_masks, privileged_obs = self.observe()
+            yield obs, action_masks, privileged_obs
+
+    def _clear_games(self):
         self.games: List[Tuple[int, int, str]] = []
-        self.eplen = []
-        self.score = []
-        self.performed_builds = []
+        self.eplen[:] = 1
+        self.eprew[:] = 0
+        self.score[:] = np.nan
+        self.build_counts[:] = 0
+
+    def _initial_games(self) -> List[Tuple[bool, str, dict]]:
+        games = []
         for i in range(self.num_envs - self.num_self_play):
             # spread out initial game lengths to stagger start times
             self_play = i < self.num_self_play
             game_length = int(self.game_length * (i + 1 - self.stagger_offset) // (self.num_envs - self.num_self_play)) if self.stagger else self.game_length
             opponent = 'none' if self_play else self.next_opponent()
-            game_id = codecraft.create_game(
-                game_length,
-                self.action_delay,
-                self_play,
-                self.next_map(require_default_mothership=opponent not in ['none', 'idle']),
-                opponent,
-                self.rules(),
-                self.allow_harvesting,
-                self.force_harvesting,
-                self.randomize_idle)
+            args = self._game_args(game_length,
+                                   self_play,
+                                   self.next_map(require_default_mothership=opponent not in ['none', 'idle']),
+                                   opponent)
             self.game_count += 1
-
-            self.games.append((game_id, 0, opponent))
-            self.eplen.append(1)
-            self.eprew.append(0)
-            self.score.append(None)
-            self.performed_builds.append(defaultdict(lambda: 0))
-            if self_play:
-                self.games.append((game_id, 1, opponent))
-                self.eplen.append(1)
-                self.eprew.append(0)
-                self.score.append(None)
-                self.performed_builds.append(defaultdict(lambda: 0))
-
-        if partitioned_obs_config:
-            for envs, obs_config in partitioned_obs_config:
-                obs, _, _, _, action_masks, privileged_obs = self.observe(envs, obs_config)
-                yield obs, action_masks, privileged_obs
-        else:
-            obs, _, _, _, action_masks, privileged_obs = self.observe()
-            yield obs, action_masks, privileged_obs
+            games.append((self_play, opponent, args))
+        return games
+
+    def _game_args(self, game_length, self_play, custom_map, opponent, rng=np.random) -> dict:
+        return dict(game_length=game_length,
+                    action_delay=self.action_delay,
+                    self_play=self_play,
+                    custom_map=custom_map,
+                    scripted_opponent=opponent,
+                    rules=self.rules(rng),
+                    allowHarvesting=self.allow_harvesting,
+                    forceHarvesting=self.force_harvesting,
+                    randomizeIdle=self.randomize_idle)
+
+    def _add_game(self, game_id, self_play, opponent):
+        for player_id in [0, 1] if self_play else [0]:
+            self._reset_episode(len(self.games))
+            self.games.append((game_id, player_id, opponent))
+
+    def _reset_episode(self, game):
+        self.eplen[game] = 1
+        self.eprew[game] = 0
+        self.score[game] = np.nan
+        self.build_counts[game] = 0
 
     def step(self, actions, env_subset=None, obs_config=None, action_masks=None):
         """
@@ -698,268 +1085,371 @@ class CodeCraftVecEnv(object):
         return self.observe(env_subset, obs_config)
 
     def step_async(self, actions, env_subset=None, action_masks=None):
-        game_actions = []
+        game_ids, packed_actions = self._packed_actions(actions, env_subset, action_masks)
+        self.client.act_batch_packed(game_ids, packed_actions, self.build_table)
+
+    def step_partitioned(self, partitions, action_masks=None):
+        """
+        Steps disjoint `(env_subset, obs_config, actions)` partitions of the envs with a single act and a single
+        observe request and returns the result of `observe` for each partition.
+
+        The players of a self-play game that are in different partitions must be in the same order as in `games`.
+        """
+        self.step_async_partitioned([(envs, actions) for envs, _, actions in partitions], action_masks)
+        return self.observe_partitioned([(envs, obs_config) for envs, obs_config, _ in partitions])
+
+    def step_async_partitioned(self, partitions, action_masks=None):
+        """
+        Sends the actions of each `(env_subset, actions)` partition in one request. `action_masks` is an optional
+        list with the action masks of each partition.
+        """
+        game_ids = []
+        packed = []
+        for (envs, actions), masks in zip(partitions, action_masks or [None] * len(partitions)):
+            partition_game_ids, packed_actions = self._packed_actions(actions, envs, masks)
+            game_ids.extend(partition_game_ids)
+            packed.append(packed_actions)
+        # Partitions may control different numbers of drones, the drones missing from a partition do nothing
+        drones = max(packed_actions.shape[1] for packed_actions in packed)
+        packed_actions = np.tile(self.action_table[4], (len(game_ids), drones, 1))
+        offset = 0
+        for partition_actions in packed:
+            packed_actions[offset:offset + len(partition_actions), :partition_actions.shape[1]] = partition_actions
+            offset += len(partition_actions)
+        self.client.act_batch_packed(game_ids, packed_actions, self.build_table)
+
+    def _packed_actions(self, actions, env_subset=None, action_masks=None):
+        """
+        Translates actions of shape (envs, drones) into the packed format of `codecraft.act_batch_binary_payload`.
+        """
         games = [self.games[env] for env in env_subset] if env_subset else self.games
-        for (i, ((game_id, player_id, opponent), player_actions)) in enumerate(zip(games, actions)):
-            if action_masks is not None:
-                action_masks_i = action_masks[i]
-            player_actions2 = []
-            for (drone_index, action) in enumerate(player_actions):
-                if action_masks is not None:
-                    action_masks_drone = action_masks_i[drone_index]
-                # 0-5: turn/movement (4 is no turn, no movement)
-                # 6: build [0,1,0,0,0] drone (if minerals > 5)
-                # 7: harvest
-                move = False
-                harvest = False
-                turn = 0
-                build = []
-                lockBuildAction = False
-                unlockBuildAction = False
-                if action == 0 or action == 1 or action == 2:
-                    move = True
-                if action == 0 or action == 3:
-                    turn = -1
-                if action == 2 or action == 5:
-                    turn = 1
-                if action == 6:
-                    build = [[0, 1, 0, 0, 0]]
-                if action == 7:
-                    harvest = True
-                if action >= 8 + len(self.builds) and self.obs_config.lock_build_action:
-                    if action == 8 + len(self.builds):
-                        lockBuildAction = True
-                    elif action == 8 + len(self.builds) + 1:
-                        unlockBuildAction = True
-                elif action >= 8:
-                    b = action - 8
-                    if b < len(self.builds):
-                        build = [self.builds[b]]
-                    else:
-                        build = [[0, 1, 0, 0, 0]]
-                if len(build) > 0 and action_masks is not None and action_masks_drone[action] == 1.0:
-                    repr = ''
-                    [storage, missile, constructor, engine, shield] = build[0]
-                    if storage > 0:
-                        repr += f'{storage}s'
-                    if missile > 0:
-                        repr += f'{missile}m'
-                    if constructor > 0:
-                        repr += f'{constructor}c'
-                    if engine > 0:
-                        repr += f'{engine}e'
-                    if shield > 0:
-                        repr += f'{shield}p'
-                    self.performed_builds[i][repr] += 1
-                player_actions2.append((move, turn, build, harvest, lockBuildAction, unlockBuildAction))
-            game_actions.append((game_id, player_id, player_actions2))
-
-        codecraft.act_batch(game_actions)
+        actions = np.asarray(actions)[:len(games)]
+        packed_actions = self.action_table[actions]
+        if action_masks is not None:
+            builds = packed_actions[:, :, 2]
+            allowed = np.take_along_axis(np.asarray(action_masks)[:len(actions), :actions.shape[1]],
+                                         actions[:, :, np.newaxis], axis=2)[:, :, 0] == 1.0
+            envs, drones = np.nonzero((builds >= 0) & allowed)
+            np.add.at(self.build_counts, (envs, self.build_ids[builds[envs, drones]]), 1)
+        return [(game_id, player_id) for game_id, player_id, _ in games[:len(actions)]], packed_actions
+
+    def _performed_builds(self, game) -> Dict[str, int]:
+        builds = defaultdict(lambda: 0)
+        for name, count in zip(self.build_names, self.build_counts[game]):
+            if count > 0:
+                builds[name] = int(count)
+        return builds
+
+    def _action_table(self) -> np.ndarray:
+        # 0-5: turn/movement (4 is no turn, no movement)
+        # 6: build [0,1,0,0,0] drone (if minerals > 5)
+        # 7: harvest
+        # 8-: build self.builds, followed by lock/unlock build action if enabled
+        default_build = len(self.builds)
+        table = np.zeros((self.base_naction + 2, 4), dtype=np.int8)
+        table[:, 2] = -1
+        table[[0, 1, 2], 0] = 1
+        table[[0, 3], 1] = -1
+        table[[2, 5], 1] = 1
+        table[6, 2] = default_build
+        table[7, 3] = codecraft.HARVEST
+        table[8:8 + len(self.builds), 2] = np.arange(len(self.builds))
+        if self.obs_config.lock_build_action:
+            table[self.base_naction, 3] = codecraft.LOCK_BUILD_ACTION
+            table[self.base_naction + 1, 3] = codecraft.UNLOCK_BUILD_ACTION
+        else:
+            table[self.base_naction:, 2] = default_build
+        return table
 
     def observe(self, env_subset=None, obs_config=None):
         obs_config = obs_config or self.obs_config
         games = [self.games[env] for env in env_subset] if env_subset else self.games
-        num_envs = len(games)
 
-        rews = []
-        dones = []
+        obs = self.client.observe_batch_raw(obs_config,
+                                            [(gid, pid) for (gid, pid, _) in games],
+                                            extra_build_actions=self.builds,
+                                            out=self._obs_buffer(env_subset, len(games), obs_config))
+        return self._observed(obs, games, env_subset, obs_config)
+
+    def observe_partitioned(self, partitions):
+        """
+        Observes each `(env_subset, obs_config)` partition with a single request and returns the result of `observe`
+        for each partition. The observations of all partitions are read into one buffer without copies.
+        """
+        games = [[self.games[env] for env in envs] for envs, _ in partitions]
+        nfloats = sum(self._obs_size(len(partition_games), obs_config)
+                      for partition_games, (_, obs_config) in zip(games, partitions))
+        buffer = self.obs_rings[tuple(tuple(envs) for envs, _ in partitions)].next(nfloats)
+        all_obs = self.client.observe_batch_raw_partitioned(
+            [(obs_config, [(gid, pid) for (gid, pid, _) in partition_games])
+             for partition_games, (_, obs_config) in zip(games, partitions)],
+            extra_build_actions=self.builds,
+            out=buffer)
+        return [self._observed(obs, partition_games, envs, obs_config)
+                for obs, partition_games, (envs, obs_config) in zip(all_obs, games, partitions)]
+
+    def _observed(self, obs, games, env_subset, obs_config):
+        obs, rews, dones, infos, finished, abandoned = self._process_observations(obs, games, env_subset, obs_config)
+        self._abandon(abandoned)
+        new_game_ids = iter(self._create_replacements([kind for _, _, _, kind in finished if kind is not None]))
+        for game, pid, _, kind in finished:
+            if kind is None:
+                game_id, _, opponent = self.games[game - 1]
+            else:
+                game_id = next(new_game_ids)
+                _, opponent, _ = kind
+            self.games[game] = (game_id, pid, opponent)
+        if self.game_pool is not None and len(finished) > 0:
+            self._observe_replacements(obs, [game for game, _, _, _ in finished], env_subset, len(games), obs_config)
+        return self._observe_result(obs, rews, dones, infos, len(games), obs_config)
+
+    def _abandon(self, games):
+        if len(games) > 0 and not self.client.abandon_games(sorted({game_id for game_id, _ in games})):
+            threading.Thread(target=play_out, args=(self.client, games, False), daemon=True).start()
+
+    def _create_replacements(self, kinds) -> List[int]:
+        # Skipped without finished games, so that request metrics only count calls that send a request
+        if len(kinds) == 0:
+            return []
+        if self.game_pool is None:
+            return self.client.create_games([self._replacement_args(kind) for kind in kinds])
+        pooled, stale = self.game_pool.take(kinds)
+        self._abandon([(game_id, 0) for game_id in stale])
+        missing = [kind for kind, game_id in zip(kinds, pooled) if game_id is None]
+        if len(missing) == 0:
+            return pooled
+        created = iter(self.client.create_games([self._replacement_args(kind) for kind in missing]))
+        return [next(created) if game_id is None else game_id for game_id in pooled]
+
+    def _game_settings(self) -> tuple:
+        """Settings that pooled games were created with, the game pool discards its games when they change."""
+        return self.hardness, self.mothership_damage_scale, self.rng_ruleset, self.symmetric
+
+    def _observe_replacements(self, obs, envs, env_subset, num_envs, obs_config):
+        """
+        Overwrites the observations and action masks of `envs` with the first observation of their new games.
+
+        Whether a game finished is only known from the batch observation, so this is a second `observe_batch_raw`
+        request for all replacement games together, made on every observe in which an env finished. Without a game
+        pool, the envs of finished games keep the last observation of the finished game instead.
+        """
+        positions = [env_subset.index(env) for env in envs] if env_subset else envs
+        new_obs = self.client.observe_batch_raw(obs_config,
+                                                [self.games[env][:2] for env in envs],
+                                                extra_build_actions=self.builds)
+        layout = self._layout(obs_config)
+        batch = layout.split(obs, num_envs)
+        new_batch = layout.split(new_obs, len(envs))
+        batch.obs[positions] = new_batch.obs
+        batch.action_masks[positions] = new_batch.action_masks
+
+    def _obs_buffer(self, env_subset, num_envs, obs_config) -> np.ndarray:
+        return self.obs_rings[tuple(env_subset) if env_subset else None].next(self._obs_size(num_envs, obs_config))
+
+    def _obs_size(self, num_envs, obs_config) -> int:
+        return self._layout(obs_config).size(num_envs)
+
+    def _layout(self, obs_config) -> codecraft.ObsLayout:
+        return obs_config.layout(self.base_naction + obs_config.extra_actions())
+
+    def _process_observations(self, obs, games, env_subset, obs_config):
+        """
+        Computes rewards and episode statistics from a raw batch observation and records finished episodes.
+
+        Returns the observation (copied if it was read-only and had to be modified), rewards, dones, infos,
+        a list of `(env, player_id, finished_game_id, kind)` for every env that needs a new game and a list of
+        the `(game_id, player_id)` of games that were cut short by `reassign` and have to be abandoned.
+        `kind` is the `(self_play, opponent, mp)` of the replacement game (see `_replacement_args`) and `player_id`
+        the player of the env in it. `kind` is `None` for player 1 of self-play games, which takes over the
+        replacement game created for player 0 when its game `finished_game_id` ended.
+        """
+        num_envs = len(games)
+        envs = np.array(env_subset) if env_subset else np.arange(num_envs)
+        layout = self._layout(obs_config)
+        batch = layout.split(obs, num_envs)
+        nonobs = batch.nonobs
+
+        score = self._scores(batch.obs, nonobs, obs_config)
+        if len(self.builds) > 0:
+            max_entropy = math.log(len(self.builds) + 1)
+            bonus = self.build_variety_bonus * self._build_entropy(num_envs) / max_entropy
+            score += bonus.astype(np.float32)
+
+        last_score = self.score[envs]
+        rews = score - np.where(np.isnan(last_score), score, last_score)
+        self.score[envs] = score
+        self.eprew[envs] += rews
+
+        done = nonobs[:, 0] > 0
+        self.eplen[envs[~done]] += 1
         infos = []
-        obs = codecraft.observe_batch_raw(obs_config,
-                                          [(gid, pid) for (gid, pid, _) in games],
-                                          allies=obs_config.allies,
-                                          drones=obs_config.drones,
-                                          minerals=obs_config.minerals,
-                                          tiles=obs_config.tiles,
-                                          global_drones=obs_config.global_drones,
-                                          relative_positions=obs_config.relative_positions,
-                                          v2=True,
-                                          extra_build_actions=self.builds,
-                                          map_size=obs_config.feat_map_size,
-                                          last_seen=obs_config.feat_last_seen,
-                                          is_visible=obs_config.feat_is_visible,
-                                          abstime=obs_config.feat_abstime,
-                                          rule_msdm=obs_config.feat_rule_msdm,
-                                          rule_costs=obs_config.feat_rule_costs)
-        stride = obs_config.stride()
-        for i in range(num_envs):
-            game = env_subset[i] if env_subset else i
-            winner = obs[stride * num_envs + i * obs_config.nonobs_features()]
-            outcome = 0
-            elimination_win = 0
-            if self.objective.vs():
-                allied_score = obs[stride * num_envs + i * obs_config.nonobs_features() + 1]
-                allied_score = min(allied_score, self.max_army_size_score)
-                enemy_score = obs[stride * num_envs + i * obs_config.nonobs_features() + 2]
-                enemy_score = min(enemy_score, self.max_enemy_army_size_score)
-                min_allied_ms_health = obs[stride * num_envs + i * obs_config.nonobs_features() + 3]
-                min_enemy_ms_health = obs[stride * num_envs + i * obs_config.nonobs_features() + 4]
-                score = self.partial_score * 2 * allied_score / (allied_score + enemy_score + 1e-8) - 1
-                if winner > 0:
-                    if enemy_score == 0:
-                        score += self.win_bonus
-                    else:
-                        score -= self.loss_penalty
-                if winner > 0:
-                    if enemy_score == 0 or allied_score == 0:
-                        elimination_win = 1
-                    if enemy_score + allied_score == 0:
-                        outcome = 0
-                    else:
-                        outcome = (allied_score - enemy_score) / (enemy_score + allied_score)
-                if self.attac > 0:
-                    score -= self.attac * min_enemy_ms_health
-                if self.protec > 0:
-                    score += self.protec * min_allied_ms_health
-            elif self.objective == Objective.SCOUT:
-                enemy_score = obs[stride * num_envs + i * obs_config.nonobs_features() + 2]
-                score = -enemy_score
-            elif self.objective == Objective.ALLIED_WEALTH:
-                score = obs[stride * num_envs + i * obs_config.nonobs_features() + 1] * 0.1
-            elif self.objective == Objective.DISTANCE_TO_ORIGIN:
-                start = stride * i + obs_config.endglobals()
-                x = obs[start]
-                y = obs[start + 1]
-                score = -math.sqrt(x ** 2 + y ** 2) / 1000.0
-            elif self.objective == Objective.DISTANCE_TO_CRYSTAL:
-                dstart = stride * i + obs_config.endglobals()
-                xd = obs[dstart]
-                yd = obs[dstart + 1]
-                allmstart = stride * i + obs_config.endenemies()
-                score = 0.0
-                for m in range(obs_config.minerals):
-                    mstart = allmstart + obs_config.mstride() * m
-                    x = obs[mstart] - xd
-                    y = obs[mstart + 1] - yd
-                    size = obs[mstart + 2]
-                    nearness = 0.5 - math.sqrt(x ** 2 + y ** 2) / 1000.0
-                    score = max(score, 0.2 * nearness * size)
-            elif self.objective in [Objective.DISTANCE_TO_1000_500]:
-
-                raise Exception(f"Deprecated objective {self.objective}")
+        finished = []
+        abandoned = []
+        if done.any():
+            if not obs.flags['WRITEABLE']:
+                obs = obs.copy()
+            layout.split(obs, num_envs).obs[done] = 0.0  # codecraft.observation_to_np(observation)
+        positions = {int(env): i for i, env in enumerate(envs)}
+        # Maps second env of a pair that becomes a self-play game to the id of the game its first env finished
+        joining = {}
+        finished_positions = np.flatnonzero(done)
+        for i in finished_positions[np.argsort(envs[finished_positions], kind='stable')]:
+            game = int(envs[i])
+            (game_id, pid, opponent_was) = games[i]
+            self_play = game // 2 < self.num_self_play
+            if game in joining:
+                finished.append((game, 1, joining[game], None))
+            elif pid == 1 and self_play:
+                finished.append((game, 1, game_id, None))
             else:
-                raise Exception(f"Unknown objective {self.objective}")
-
-            if len(self.builds) > 0:
-                max_entropy = math.log(len(self.builds) + 1)
-                build_entropy = 0
-                s = sum(self.performed_builds[i].values())
-                for count in self.performed_builds[i].values():
-                    if count > 0:
-                        p = count / s
-                        build_entropy -= p * math.log(p)
-                score += self.build_variety_bonus * build_entropy / max_entropy
-
-            if self.score[game] is None:
-                self.score[game] = score
-            reward = score - self.score[game]
-            self.score[game] = score
-            self.eprew[game] += reward
-
-            if winner > 0:
-                (game_id, pid, opponent_was) = games[i]
-                if pid == 0:
-                    self_play = game // 2 < self.num_self_play
-                    opponent = 'none' if self_play else self.next_opponent()
-                    if self.mp_game_count < self.game_count * self.mix_mp:
-                        m = map_mp(self.randomize, self.hardness)
-                        m['symmetric'] = np.random.rand() <= self.symmetric
-                        game_id = codecraft.create_game(20 * 60,
-                                                        self.action_delay,
-                                                        self_play,
-                                                        m,
-                                                        opponent,
-                                                        self.rules(),
-                                                        self.allow_harvesting,
-                                                        self.force_harvesting,
-                                                        self.randomize_idle)
-                        self.mp_game_count += 1
+                partner = game + 1
+                cut_short = None
+                if self_play and game % 2 == 0 and self.games[partner][0] != game_id:
+                    # The pair switches to self-play, which requires its second env to be in this batch
+                    if partner in positions:
+                        joining[partner] = game_id
+                        if not done[positions[partner]]:
+                            cut_short = positions[partner]
                     else:
-                        game_id = codecraft.create_game(self.game_length,
-                                                        self.action_delay,
-                                                        self_play,
-                                                        self.next_map(require_default_mothership=opponent not in ['none', 'idle']),
-                                                        opponent,
-                                                        self.rules(),
-                                                        self.allow_harvesting,
-                                                        self.force_harvesting,
-                                                        self.randomize_idle)
-                    self.game_count += 1
+                        self_play = False
                 else:
-                    game_id, _, opponent = self.games[game - 1]
-                # print(f"COMPLETED {i} {game} {games[i]} == {self.games[game]} new={game_id}")
-                self.games[game] = (game_id, pid, opponent)
-                observation = codecraft.observe(game_id, pid)
-                # TODO: use actual observation
-                if not obs.flags['WRITEABLE']:
-                    obs = obs.copy()
-                obs[stride * i:stride * (i + 1)] = 0.0  # codecraft.observation_to_np(observation)
-
-                dones.append(1.0)
-                infos.append({'episode': {
-                    'r': self.eprew[game],
-                    'l': self.eplen[game],
-                    'index': game,
-                    'score': self.score[game],
-                    'elimination': elimination_win,
-                    'builds': self.performed_builds[game],
-                    'outcome': outcome,
-                    'opponent': opponent_was,
-                }})
-                self.eplen[game] = 1
-                self.eprew[game] = 0
-                self.score[game] = None
-                self.performed_builds[game] = defaultdict(lambda: 0)
+                    self_play = self_play and game % 2 == 0
+                opponent = 'none' if self_play else self.next_opponent()
+                mp = self.mp_game_count < self.game_count * self.mix_mp
+                if mp:
+                    self.mp_game_count += 1
+                self.game_count += 1
+                kind = (self_play, opponent, mp)
+                finished.append((game, 0, game_id, kind))
+                if cut_short is not None:
+                    abandoned.append(games[cut_short][:2])
+                    finished.append((partner, 1, game_id, None))
+                    done[cut_short] = True
+                    layout.split(obs, num_envs).obs[cut_short] = 0.0
+                    self._reset_episode(partner)
+
+            outcome, elimination_win = self._outcome(nonobs[i])
+            infos.append({'episode': {
+                'r': self.eprew[game],
+                'l': int(self.eplen[game]),
+                'index': game,
+                'score': self.score[game],
+                'elimination': elimination_win,
+                'builds': self._performed_builds(game),
+                'outcome': outcome,
+                'opponent': opponent_was,
+            }})
+            self._reset_episode(game)
+
+        return obs, rews, done.astype(np.float64), infos, finished, abandoned
+
+    def _replacement_args(self, kind, rng=np.random) -> dict:
+        self_play, opponent, mp = kind
+        if mp:
+            if self.mp_map_pool is not None:
+                m = self.mp_map_pool.take(self.randomize, self.hardness, False, rng)
             else:
-                self.eplen[game] += 1
-                dones.append(0.0)
-
-            rews.append(reward)
-
-        naction = self.base_naction + obs_config.extra_actions()
-        action_mask_elems = naction * obs_config.allies * num_envs
-        action_masks = obs[-action_mask_elems:].reshape(-1, obs_config.allies, naction)
+                m = map_mp(self.randomize, self.hardness, False, rng)
+            m['symmetric'] = rng.rand() <= self.symmetric
+            return self._game_args(20 * 60, self_play, m, opponent, rng)
+        return self._game_args(self.game_length,
+                               self_play,
+                               self.next_map(require_default_mothership=opponent not in ['none', 'idle'], rng=rng),
+                               opponent,
+                               rng)
+
+    def _scores(self, obs, nonobs, obs_config) -> np.ndarray:
+        """Computes the shaped score of every env from its observation and non-observation features."""
+        if self.objective.vs():
+            allied_score = np.minimum(nonobs[:, 1], self.max_army_size_score)
+            enemy_score = np.minimum(nonobs[:, 2], self.max_enemy_army_size_score)
+            score = self.partial_score * 2 * allied_score / (allied_score + enemy_score + 1e-8) - 1
+            won = nonobs[:, 0] > 0
+            score[won & (enemy_score == 0)] += self.win_bonus
+            score[won & (enemy_score != 0)] -= self.loss_penalty
+            if self.attac > 0:
+                score -= self.attac * nonobs[:, 4]
+            if self.protec > 0:
+                score += self.protec * nonobs[:, 3]
+            return score
+        elif self.objective == Objective.SCOUT:
+            return -nonobs[:, 2]
+        elif self.objective == Objective.ALLIED_WEALTH:
+            return nonobs[:, 1] * 0.1
+        elif self.objective == Objective.DISTANCE_TO_ORIGIN:
+            position = self._layout(obs_config).items(obs, 'allies')[:, 0, :2]
+            return -np.sqrt((position ** 2).sum(axis=1)) / 1000.0
+        elif self.objective == Objective.DISTANCE_TO_CRYSTAL:
+            position = self._layout(obs_config).items(obs, 'allies')[:, 0, :2]
+            minerals = self._layout(obs_config).items(obs, 'minerals')
+            offset = minerals[:, :, :2] - position[:, None, :]
+            nearness = 0.5 - np.sqrt((offset ** 2).sum(axis=2)) / 1000.0
+            return np.maximum(0.2 * nearness * minerals[:, :, 2], 0.0).max(axis=1, initial=0.0)
+        elif self.objective in [Objective.DISTANCE_TO_1000_500]:
+            raise Exception(f"Deprecated objective {self.objective}")
+        else:
+            raise Exception(f"Unknown objective {self.objective}")
+
+    def _build_entropy(self, num_envs) -> np.ndarray:
+        counts = self.build_counts[:num_envs]
+        p = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+        return -np.where(counts > 0, p * np.log(np.where(counts > 0, p, 1)), 0).sum(axis=1)
+
+    def _outcome(self, nonobs) -> Tuple[float, int]:
+        """Returns the outcome and whether the game was won by elimination from the final non-observation features."""
+        if not self.objective.vs():
+            return 0, 0
+        allied_score = min(nonobs[1], self.max_army_size_score)
+        enemy_score = min(nonobs[2], self.max_enemy_army_size_score)
+        elimination_win = 1 if enemy_score == 0 or allied_score == 0 else 0
+        if enemy_score + allied_score == 0:
+            return 0, elimination_win
+        return (allied_score - enemy_score) / (enemy_score + allied_score), elimination_win
+
+    def _observe_result(self, obs, rews, dones, infos, num_envs, obs_config):
+        batch = self._layout(obs_config).split(obs, num_envs)
 
         # TODO: merged with other obs, remove completely
         privileged_obs = np.zeros([num_envs, 1])
 
-        return obs[:stride * num_envs].reshape(num_envs, -1), \
+        return batch.obs, \
                np.array(rews), \
                np.array(dones), \
                infos, \
-               action_masks if self.use_action_masks \
-                   else np.ones([num_envs, obs_config.allies, naction], dtype=np.float32), \
+               batch.action_masks if self.use_action_masks else np.ones_like(batch.action_masks), \
                privileged_obs
 
     def close(self):
-        # Run all games to completion
-        done = defaultdict(lambda: False)
-        running = len(self.games)
-        while running > 0:
-            game_actions = []
-            active_games = []
-            for (game_id, player_id, _) in self.games:
-                if not done[game_id]:
-                    active_games.append((game_id, player_id))
-                    game_actions.append((game_id, player_id, [(False, 0, [], False, False, False)]))
-            codecraft.act_batch(game_actions)
-            obs = codecraft.observe_batch(active_games)
-            for o, (game_id, _) in zip(obs, active_games):
-                if o['winner']:
-                    done[game_id] = True
-                    running -= 1
+        """
+        Abandons all games and closes the client.
+
+        Servers that cannot abandon games need them to be played to completion, which can take thousands of round
+        trips and is done on the background thread `play_out_thread` that closes the client when it finishes.
+        """
+        for map_pool in [self.map_pool, self.mp_map_pool]:
+            if map_pool is not None:
+                map_pool.close()
+        games = [(game_id, player_id) for game_id, player_id, _ in self.games]
+        if self.game_pool is not None:
+            games.extend((game_id, 0) for game_id in self.game_pool.close())
+        if self.client.abandon_games(sorted({game_id for game_id, _ in games})):
+            self.client.close()
+        else:
+            self.play_out_thread = threading.Thread(target=play_out, args=(self.client, games), daemon=True)
+            self.play_out_thread.start()
 
-    def next_map(self, require_default_mothership=False):
+    def next_map(self, require_default_mothership=False, rng=np.random):
         if self.fair:
-            map = self.fair_map(require_default_mothership)
+            map = self.fair_map(require_default_mothership, rng)
         else:
-            map = self.custom_map(self.randomize, self.hardness, require_default_mothership)
+            map = self._generate_map(require_default_mothership, rng)
         if map:
-            map['symmetric'] = np.random.rand() < self.symmetric
+            map['symmetric'] = rng.rand() < self.symmetric
         return map
 
-    def fair_map(self, require_default_mothership=False):
+    def fair_map(self, require_default_mothership=False, rng=np.random):
         if self.last_map is None:
-            self.last_map = self.custom_map(self.randomize, self.hardness, require_default_mothership)
+            self.last_map = self._generate_map(require_default_mothership, rng)
             return self.last_map
         else:
             result = self.last_map
@@ -969,6 +1459,138 @@ class CodeCraftVecEnv(object):
             result['player2Drones'] = p1
             return result
 
+    def _generate_map(self, require_default_mothership, rng=np.random):
+        if self.map_pool is not None:
+            return self.map_pool.take(self.randomize, self.hardness, require_default_mothership, rng)
+        return self.custom_map(self.randomize, self.hardness, require_default_mothership, rng=rng)
+
+
+def play_out(client: codecraft.CodeCraftClient, games: List[Tuple[int, int]], close: bool = True):
+    """Sends no-op actions to the `(game_id, player_id)` games until all of them have ended and closes `client`."""
+    while len(games) > 0:
+        client.act_batch([(game_id, player_id, [(False, 0, [], False, False, False)]) for game_id, player_id in games])
+        obs = client.observe_batch(games)
+        finished = {game_id for o, (game_id, _) in zip(obs, games) if o['winner']}
+        games = [(game_id, player_id) for game_id, player_id in games if game_id not in finished]
+    if close:
+        client.close()
+
+
+class AsyncCodeCraftVecEnv(CodeCraftVecEnv):
+    """
+    Variant of `CodeCraftVecEnv` where `reset`, `step`, `step_async`, `observe` and `close` are coroutines.
+
+    Calls for disjoint sets of envs can be awaited concurrently, which overlaps their round trips to the server
+    and the creation of replacement games, e.g.
+
+        await asyncio.gather(env.step_async(actions, policy_envs), env.step_async(actions_opp, opp_envs))
+        (obs, ...), (obs_opp, ...) = await asyncio.gather(env.observe(policy_envs), env.observe(opp_envs, opp_obs_config))
+
+    If the two players of self-play games are split across partitions, the partition containing player 0
+    must be observed before or concurrently with the partition containing player 1.
+    """
+
+    def __init__(self,
+                 *args,
+                 client: Optional[codecraft.AsyncCodeCraftClient] = None,
+                 endpoints: Optional[List[str]] = None,
+                 **kwargs):
+        if client is None:
+            assert endpoints is None or len(endpoints) <= 1, 'AsyncCodeCraftVecEnv does not support multiple servers'
+            client = codecraft.AsyncCodeCraftClient(endpoints[0] if endpoints else codecraft.DEFAULT_ENDPOINT)
+        assert kwargs.get('game_pool_size', 0) == 0, 'AsyncCodeCraftVecEnv does not support a game pool'
+        super().__init__(*args, client=client, **kwargs)
+        # Maps id of finished self-play game to future that resolves to `(game_id, opponent)` of its replacement
+        self.replacements = {}
+
+    async def reset(self, partitioned_obs_config=None):
+        self._clear_games()
+        initial_games = self._initial_games()
+        game_ids = await self.client.create_games([args for _, _, args in initial_games])
+        for game_id, (self_play, opponent, _) in zip(game_ids, initial_games):
+            self._add_game(game_id, self_play, opponent)
+
+        if partitioned_obs_config:
+            results = await asyncio.gather(*[self.observe(envs, obs_config)
+                                             for envs, obs_config in partitioned_obs_config])
+            return [(obs, action_masks, privileged_obs) for obs, _, _, _, action_masks, privileged_obs in results]
+        else:
+            obs, _, _, _, action_masks, privileged_obs = await self.observe()
+            return obs, action_masks, privileged_obs
+
+    async def step(self, actions, env_subset=None, obs_config=None, action_masks=None):
+        await self.step_async(actions, env_subset, action_masks)
+        return await self.observe(env_subset, obs_config)
+
+    async def step_async(self, actions, env_subset=None, action_masks=None):
+        game_ids, packed_actions = self._packed_actions(actions, env_subset, action_masks)
+        await self.client.act_batch_packed(game_ids, packed_actions, self.build_table)
+
+    async def step_partitioned(self, partitions, action_masks=None):
+        await self.step_async_partitioned([(envs, actions) for envs, _, actions in partitions], action_masks)
+        return await self.observe_partitioned([(envs, obs_config) for envs, obs_config, _ in partitions])
+
+    async def step_async_partitioned(self, partitions, action_masks=None):
+        await asyncio.gather(*[self.step_async(actions, envs, masks) for (envs, actions), masks
+                               in zip(partitions, action_masks or [None] * len(partitions))])
+
+    async def observe_partitioned(self, partitions):
+        return list(await asyncio.gather(*[self.observe(envs, obs_config) for envs, obs_config in partitions]))
+
+    async def observe(self, env_subset=None, obs_config=None):
+        obs_config = obs_config or self.obs_config
+        games = [self.games[env] for env in env_subset] if env_subset else self.games
+
+        obs = await self.client.observe_batch_raw(obs_config,
+                                                  [(gid, pid) for (gid, pid, _) in games],
+                                                  extra_build_actions=self.builds)
+        obs, rews, dones, infos, finished, abandoned = self._process_observations(obs, games, env_subset, obs_config)
+        if len(abandoned) > 0 and not await self.client.abandon_games(sorted({game_id for game_id, _ in abandoned})):
+            asyncio.ensure_future(self._play_out(abandoned))
+        await asyncio.gather(*[self._replace_game(game, pid, game_id, kind) for game, pid, game_id, kind in finished])
+        return self._observe_result(obs, rews, dones, infos, len(games), obs_config)
+
+    async def _replace_game(self, game, pid, finished_game_id, kind):
+        if kind is None:
+            game_id, opponent = await self._replacement(finished_game_id)
+            del self.replacements[finished_game_id]
+        else:
+            game_id = await self.client.create_game(**self._replacement_args(kind))
+            self_play, opponent, _ = kind
+            if self_play:
+                self._replacement(finished_game_id).set_result((game_id, opponent))
+        self.games[game] = (game_id, pid, opponent)
+        # TODO: use actual observation
+        await self.client.observe(game_id, pid)
+
+    def _replacement(self, finished_game_id) -> asyncio.Future:
+        if finished_game_id not in self.replacements:
+            self.replacements[finished_game_id] = asyncio.get_event_loop().create_future()
+        return self.replacements[finished_game_id]
+
+    async def close(self):
+        if not await self.client.abandon_games(sorted({game_id for game_id, _, _ in self.games})):
+            # Run all games to completion
+            await self._play_out([(game_id, player_id) for game_id, player_id, _ in self.games])
+        await self.client.close()
+
+    async def _play_out(self, games):
+        done = defaultdict(lambda: False)
+        running = len(games)
+        while running > 0:
+            game_actions = []
+            active_games = []
+            for (game_id, player_id) in games:
+                if not done[game_id]:
+                    active_games.append((game_id, player_id))
+                    game_actions.append((game_id, player_id, [(False, 0, [], False, False, False)]))
+            await self.client.act_batch(game_actions)
+            obs = await self.client.observe_batch(active_games)
+            for o, (game_id, _) in zip(obs, active_games):
+                if o['winner']:
+                    done[game_id] = True
+                    running -= 1
+
 
 class Objective(Enum):
     ALLIED_WEALTH = 'ALLIED_WEALTH'
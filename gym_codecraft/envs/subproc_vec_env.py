@@ -0,0 +1,257 @@
+from collections import defaultdict
+import multiprocessing
+import traceback
+
+import numpy as np
+
+import codecraft
+from gym_codecraft.envs.codecraft_vec_env import CodeCraftVecEnv, DEFAULT_OBS_CONFIG
+
+
+class SubprocCodeCraftVecEnv:
+    """
+    Runs the envs of a `CodeCraftVecEnv` in `num_workers` processes that each own a slice of the games and
+    their own connection to the server.
+
+    Workers write observations, action masks, rewards and dones into a shared memory array and the arrays
+    returned by `reset`, `step` and `observe` are views of it, which are overwritten by the next observation.
+    Envs are laid out like in `CodeCraftVecEnv`, with the two players of self-play games in the first
+    `2 * num_self_play` envs. Observing or stepping subsets of the envs is not supported.
+    After `reassign`, the self-play games of each worker are within its own envs and no longer laid out first.
+
+    Games against scripted opponents are dealt out to the workers by their number of envs that are not in self-play
+    games, so that all workers together play the same opponents as a single `CodeCraftVecEnv`.
+
+    Assigning `hardness`, `rng_ruleset`, `symmetric` or `mothership_damage_scale` updates the envs of all workers.
+
+    If `codecraft.request_metrics` is enabled when the env is constructed, the workers record their requests as well
+    and `observe` adds them to the `codecraft.request_metrics` of this process.
+    """
+
+    FORWARDED_ATTRIBUTES = {'hardness', 'rng_ruleset', 'symmetric', 'mothership_damage_scale'}
+
+    def __init__(self,
+                 num_workers: int,
+                 num_envs: int,
+                 num_self_play: int,
+                 *args,
+                 obs_config=DEFAULT_OBS_CONFIG,
+                 start_method: str = 'spawn',
+                 **kwargs):
+        worker_self_play = [_split(num_self_play, num_workers, worker) for worker in range(num_workers)]
+        worker_others = [_split(num_envs - 2 * num_self_play, num_workers, worker) for worker in range(num_workers)]
+        assert all(2 * self_play + others > 0 for self_play, others in zip(worker_self_play, worker_others)), \
+            'every worker needs at least one env'
+        self.num_envs = num_envs
+        self.num_self_play = num_self_play
+        self.obs_config = obs_config
+        self.scripted_opponents = kwargs.get('scripted_opponents') or []
+        worker_opponents = _deal_opponents(self.scripted_opponents, worker_others)
+        kwargs = dict(kwargs, obs_config=obs_config)
+        # The number of actions depends on the objective, so it is taken from an env that never connects
+        template = CodeCraftVecEnv(num_envs, num_self_play, *args, **dict(kwargs, game_pool_size=0, map_pool_size=0))
+        naction = template.base_naction + obs_config.extra_actions()
+        template.client.close()
+        # Forwarded attributes start out with the values of the envs, they are only sent to workers once assigned
+        for name in self.FORWARDED_ATTRIBUTES:
+            super().__setattr__(name, getattr(template, name))
+        self.mask_shape = (obs_config.allies, naction)
+
+        # Layout of the shared array: observations, action masks, rewards, dones
+        stride = obs_config.stride()
+        sizes = [num_envs * stride, num_envs * obs_config.allies * naction, num_envs, num_envs]
+        offsets = np.cumsum([0] + sizes)
+        ctx = multiprocessing.get_context(start_method)
+        shared = ctx.RawArray('f', int(offsets[-1]))
+        shared_actions = ctx.RawArray('i', num_envs * obs_config.allies)
+        buffer = np.frombuffer(shared, dtype=np.float32)
+        self.obs = buffer[offsets[0]:offsets[1]].reshape(num_envs, stride)
+        self.action_masks = buffer[offsets[1]:offsets[2]].reshape(num_envs, *self.mask_shape)
+        self.rews = buffer[offsets[2]:offsets[3]]
+        self.dones = buffer[offsets[3]:offsets[4]]
+        self.actions = np.frombuffer(shared_actions, dtype=np.int32).reshape(num_envs, obs_config.allies)
+
+        self.pipes = []
+        self.workers = []
+        self.worker_sizes = []
+        self_play_offset = 0
+        other_offset = 2 * num_self_play
+        for worker in range(num_workers):
+            envs = list(range(self_play_offset, self_play_offset + 2 * worker_self_play[worker])) + \
+                list(range(other_offset, other_offset + worker_others[worker]))
+            self_play_offset += 2 * worker_self_play[worker]
+            other_offset += worker_others[worker]
+
+            pipe, worker_pipe = ctx.Pipe()
+            process = ctx.Process(target=_worker,
+                                  args=(worker_pipe, shared, shared_actions, offsets, envs, num_envs,
+                                        np.random.randint(2 ** 31),
+                                        (len(envs), worker_self_play[worker]) + args,
+                                        dict(kwargs, scripted_opponents=worker_opponents[worker]),
+                                        codecraft.request_metrics.enabled),
+                                  daemon=True)
+            process.start()
+            worker_pipe.close()
+            self.pipes.append(pipe)
+            self.workers.append(process)
+            self.worker_sizes.append(len(envs))
+        self.worker_self_play = worker_self_play
+        self._recv_all()
+
+    def __setattr__(self, name, value):
+        if name in self.FORWARDED_ATTRIBUTES:
+            self._send_all('setattr', (name, value))
+            self._recv_all()
+        super().__setattr__(name, value)
+
+    def reset(self):
+        self._send_all('reset')
+        self._recv_all()
+        return self.obs, self.action_masks, self._privileged_obs()
+
+    def step(self, actions, env_subset=None, obs_config=None, action_masks=None):
+        self.step_async(actions, env_subset, action_masks)
+        return self.observe(env_subset, obs_config)
+
+    def step_async(self, actions, env_subset=None, action_masks=None):
+        assert env_subset is None, 'SubprocCodeCraftVecEnv does not support env subsets'
+        actions = np.asarray(actions)
+        self.actions[:, :actions.shape[1]] = actions
+        if action_masks is not None and not np.shares_memory(action_masks, self.action_masks):
+            self.action_masks[:] = action_masks
+        self._send_all('step_async', (actions.shape[1], action_masks is not None))
+
+    def observe(self, env_subset=None, obs_config=None):
+        assert env_subset is None, 'SubprocCodeCraftVecEnv does not support env subsets'
+        assert obs_config is None or obs_config == self.obs_config, \
+            'SubprocCodeCraftVecEnv does not support multiple observation configs'
+        self._send_all('observe')
+        infos = []
+        for worker_infos, request_metrics in self._recv_all():
+            if request_metrics is not None:
+                codecraft.request_metrics.merge(request_metrics)
+            for info in worker_infos:
+                info['episode']['builds'] = defaultdict(lambda: 0, info['episode']['builds'])
+                infos.append(info)
+        return self.obs, self.rews, self.dones.astype(np.float64), infos, self.action_masks, self._privileged_obs()
+
+    def reassign(self, num_self_play=None, scripted_opponents=None):
+        if num_self_play is None:
+            worker_self_play = self.worker_self_play
+        else:
+            assert sum(size // 2 for size in self.worker_sizes) >= num_self_play, 'workers have too few envs'
+            self.num_self_play = num_self_play
+            # Deal out the self-play games one at a time to the workers that still have room for another
+            worker_self_play = [0] * len(self.pipes)
+            while num_self_play > 0:
+                for worker, size in enumerate(self.worker_sizes):
+                    if num_self_play > 0 and 2 * (worker_self_play[worker] + 1) <= size:
+                        worker_self_play[worker] += 1
+                        num_self_play -= 1
+            self.worker_self_play = worker_self_play
+        if scripted_opponents is not None:
+            self.scripted_opponents = scripted_opponents
+        # The envs outside of self-play games change with the self-play games, so opponents are always dealt anew
+        worker_opponents = _deal_opponents(self.scripted_opponents,
+                                           [size - 2 * count for size, count in zip(self.worker_sizes, worker_self_play)])
+        for pipe, count, opponents in zip(self.pipes, worker_self_play, worker_opponents):
+            pipe.send(('reassign', (count, opponents)))
+        self._recv_all()
+
+    def close(self):
+        # Workers that have to play out their games exit once they are done, without blocking the caller
+        self._send_all('close')
+        self._recv_all()
+
+    def _privileged_obs(self):
+        # TODO: merged with other obs, remove completely
+        return np.zeros([self.num_envs, 1])
+
+    def _send_all(self, command, data=None):
+        for pipe in self.pipes:
+            pipe.send((command, data))
+
+    def _recv_all(self) -> list:
+        results = []
+        for pipe in self.pipes:
+            status, result = pipe.recv()
+            if status == 'error':
+                raise RuntimeError(f'Env worker failed:\n{result}')
+            results.append(result)
+        return results
+
+
+def _split(n: int, parts: int, part: int) -> int:
+    return n // parts + (1 if part < n % parts else 0)
+
+
+def _deal_opponents(scripted_opponents, worker_others):
+    """
+    Deals out the games against each scripted opponent one at a time to the workers that still have an env outside of
+    self-play games left, and round robin to all workers once none has.
+    """
+    worker_opponents = [{} for _ in worker_others]
+    remaining = list(worker_others)
+    worker = 0
+    for opponent, count in scripted_opponents:
+        for _ in range(count):
+            if any(remaining):
+                while remaining[worker] == 0:
+                    worker = (worker + 1) % len(remaining)
+                remaining[worker] -= 1
+            counts = worker_opponents[worker]
+            counts[opponent] = counts.get(opponent, 0) + 1
+            worker = (worker + 1) % len(remaining)
+    return [list(counts.items()) for counts in worker_opponents]
+
+
+def _worker(pipe, shared, shared_actions, offsets, envs, num_envs, seed, args, kwargs, request_metrics):
+    np.random.seed(seed)
+    codecraft.request_metrics.enabled = request_metrics
+    buffer = np.frombuffer(shared, dtype=np.float32)
+    obs = buffer[offsets[0]:offsets[1]].reshape(num_envs, -1)
+    action_masks = buffer[offsets[1]:offsets[2]].reshape(num_envs, -1)
+    rews = buffer[offsets[2]:offsets[3]]
+    dones = buffer[offsets[3]:offsets[4]]
+    actions = np.frombuffer(shared_actions, dtype=np.int32).reshape(num_envs, -1)
+    envs = np.array(envs)
+
+    try:
+        env = CodeCraftVecEnv(*args, **kwargs)
+        pipe.send(('ok', None))
+        while True:
+            command, data = pipe.recv()
+            if command == 'reset':
+                env_obs, env_action_masks, _ = env.reset()
+                obs[envs] = env_obs
+                action_masks[envs] = env_action_masks.reshape(len(envs), -1)
+                pipe.send(('ok', None))
+            elif command == 'step_async':
+                drones, use_action_masks = data
+                env_action_masks = action_masks[envs].reshape(len(envs), env.obs_config.allies, -1) \
+                    if use_action_masks else None
+                env.step_async(actions[envs, :drones], action_masks=env_action_masks)
+            elif command == 'observe':
+                env_obs, env_rews, env_dones, infos, env_action_masks, _ = env.observe()
+                obs[envs] = env_obs
+                action_masks[envs] = env_action_masks.reshape(len(envs), -1)
+                rews[envs] = env_rews
+                dones[envs] = env_dones
+                for info in infos:
+                    info['episode']['index'] = int(envs[info['episode']['index']])
+                    info['episode']['builds'] = dict(info['episode']['builds'])
+                pipe.send(('ok', (infos, codecraft.request_metrics.collect() if request_metrics else None)))
+            elif command == 'reassign':
+                env.reassign(*data)
+                pipe.send(('ok', None))
+            elif command == 'setattr':
+                setattr(env, *data)
+                pipe.send(('ok', None))
+            elif command == 'close':
+                env.close()
+                pipe.send(('ok', None))
+                if env.play_out_thread is not None:
+                    env.play_out_thread.join()
+                break
+    except Exception:
+        pipe.send(('error', traceback.format_exc()))
@@ -75,6 +75,7 @@ class HyperParams:
         self.harvest_action = False     # Harvest action that will freeze drone until one resource has been harvested
         self.lock_build_action = False  # Pair of actions to disable/enable all build actions
         self.feat_dist_to_wall = False  # Five features giving distance to closest wall in movement direction, and in movement direction offset by +-pi/2 and +-pi/4
+        self.obs_encoding = 'float32'   # Wire format of observations sent by the server ("float32", "float16" or "int8")
 
         # Eval
         self.eval_envs = 256
@@ -94,6 +95,8 @@ class HyperParams:
         self.num_vs_destroyer = 0   # Number of environments played vs scripted destroyer AI
         self.num_self_play_schedule = ''
         self.seq_rosteps = 256      # Number of sequential steps per rollout
+        self.double_buffered_rollout = False  # Compute actions for half of the envs while the server simulates the other half
+        self.async_rollout = False  # Collect the next rollout with a snapshot of the policy while optimizing on the current one
         self.gamma = 0.99           # Discount factor
         self.gamma_schedule = ''
         self.lamb = 0.95            # Generalized advantage estimation parameter lambda
@@ -115,6 +118,14 @@ class HyperParams:
         self.max_army_size_score = 9999999
         self.max_enemy_army_size_score = 9999999
 
+        # Env
+        self.endpoints = ''            # Comma separated CodeCraft server endpoints to spread games across (default http://localhost:9000)
+        self.request_metrics = True    # Log latency percentiles, payload sizes and retries of requests to the CodeCraft server
+        self.histogram_samples = 100000  # Max number of values sampled from each array that metrics histograms are built from (0 for all)
+        self.env_workers = 0           # Number of processes that run the envs and write observations to shared memory (0 to run envs on the training process)
+        self.game_pool_size = 0        # Number of replacement games of each kind created ahead of time in the background (0 to create on episode end)
+        self.map_pool_size = 0         # Number of maps generated ahead of time in batches in the background (0 to generate on episode end)
+
         # Task/Curriculum
         self.objective = envs.Objective.ARENA_TINY_2V2
         self.action_delay = 0
@@ -618,3 +629,10 @@ def parse_float_schedule(schedule) -> List[Tuple[float, float]]:
             [k, v] = kv.split(":")
             items.append((float(k), float(v)))
         return list(reversed(items))
+
+
+def parse_endpoints(endpoints: str) -> Optional[List[str]]:
+    if endpoints == '':
+        return None
+    else:
+        return [endpoint.strip() for endpoint in endpoints.split(",")]
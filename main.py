@@ -3,9 +3,12 @@ import subprocess
 import time
 import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import dataclasses
+import functools
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, NamedTuple, Optional
 
 import torch.distributed as dist
 import torch
@@ -15,10 +18,12 @@ import numpy as np
 
 import wandb
 
+import codecraft
 from adr import ADR, normalize
+from gae import gae_returns
 from gym_codecraft import envs
 from gym_codecraft.envs.codecraft_vec_env import ObsConfig, Rules
-from hyper_params import HyperParams, parse_schedule
+from hyper_params import HyperParams, parse_schedule, parse_endpoints
 from policy_t2 import TransformerPolicy2, InputNorm
 from policy_t3 import TransformerPolicy3, InputNorm
 from policy_t4 import TransformerPolicy4, InputNorm
@@ -26,6 +31,7 @@ from policy_t5 import TransformerPolicy5, InputNorm
 from policy_t6 import TransformerPolicy6, InputNorm
 from policy_t7 import TransformerPolicy7, InputNorm
 from policy_t8 import TransformerPolicy8, InputNorm
+from rollout import RolloutBuffer
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +60,94 @@ def run_codecraft():
         frames += nenv
 
 
+def rollout_groups(num_envs: int, double_buffered: bool) -> List[Optional[List[int]]]:
+    """
+    Returns the env subsets that are stepped in turn during a rollout.
+
+    Groups are contiguous, so rollout storage stays ordered by step and env, and split at an even env so that
+    both players of a self-play game are in the same group.
+    """
+    if not double_buffered:
+        return [None]
+    split = 2 * (num_envs // 4)
+    return [list(range(split)), list(range(split, num_envs))]
+
+
+class CollectedRollout(NamedTuple):
+    rollout: RolloutBuffer
+    # Observations after the last step, which the next rollout starts from
+    obs: np.ndarray
+    action_masks: np.ndarray
+    privileged_obs: np.ndarray
+    final_values: np.ndarray
+    entropies: List[float]
+    infos: List[dict]
+    # Iteration at which the policy that collected the rollout was current
+    policy_iteration: int
+    duration: float
+
+
+def collect_rollout(policy, env, rollout: RolloutBuffer, obs, action_masks, privileged_obs,
+                    hps: HyperParams, device, policy_iteration: int) -> CollectedRollout:
+    """
+    Steps the envs for `hps.seq_rosteps` steps with the actions of `policy`, starting from the given observations,
+    and stores the samples in `rollout`. Only touches `env`, `policy` and `rollout`, so it can run on an actor thread.
+    """
+    start = time.time()
+    entropies = []
+    all_infos = []
+    with torch.no_grad():
+        # With a double buffered rollout, the policy computes actions for one group of envs while the
+        # server simulates the other group. Each group is observed right before its next actions are needed.
+        groups = rollout_groups(hps.num_envs, hps.double_buffered_rollout)
+        group_obs = [(obs, action_masks, privileged_obs) if group_envs is None
+                     else (obs[group_envs], action_masks[group_envs], privileged_obs[group_envs])
+                     for group_envs in groups]
+        for step in range(hps.seq_rosteps + 1):
+            for group, group_envs in enumerate(groups):
+                if step > 0:
+                    obs, rews, dones, infos, action_masks, privileged_obs = env.observe(group_envs)
+                    group_obs[group] = (obs, action_masks, privileged_obs)
+
+                    rews -= hps.liveness_penalty
+                    rollout.add_rewards(step - 1, group_envs, rews, dones)
+                    all_infos.extend(infos)
+
+                if step == hps.seq_rosteps:
+                    continue
+                obs, action_masks, privileged_obs = group_obs[group]
+                obs_tensor = torch.tensor(obs).to(device)
+                privileged_obs_tensor = torch.tensor(privileged_obs).to(device)
+                action_masks_tensor = torch.tensor(action_masks).to(device)
+                actions, logprobs, entropy, values, probs =\
+                    policy.evaluate(obs_tensor, action_masks_tensor, privileged_obs_tensor)
+                actions = actions.cpu().numpy()
+
+                entropies.extend(entropy.detach().cpu().numpy())
+
+                rollout.add(step, group_envs, obs, privileged_obs, action_masks, actions,
+                            logprobs.detach().cpu().numpy(), values, probs)
+
+                env.step_async(actions, group_envs, action_masks=action_masks)
+        obs, action_masks, privileged_obs = [np.concatenate(arrays) for arrays in zip(*group_obs)]
+
+        obs_tensor = torch.tensor(obs).to(device)
+        action_masks_tensor = torch.tensor(action_masks).to(device)
+        privileged_obs_tensor = torch.tensor(privileged_obs).to(device)
+        _, _, _, final_values, _ = policy.evaluate(obs_tensor, action_masks_tensor, privileged_obs_tensor)
+    return CollectedRollout(rollout, obs, action_masks, privileged_obs, final_values, entropies, all_infos,
+                            policy_iteration, time.time() - start)
+
+
+def configure_rollout_env(env, hps: HyperParams, adr: ADR, total_steps: int) -> None:
+    if hps.adr:
+        env.rng_ruleset = adr.ruleset
+    if hps.adr or hps.linear_hardness:
+        env.hardness = adr.hardness
+    if hps.symmetry_increase > 0:
+        env.symmetric = min(total_steps * hps.symmetry_increase, 1.0)
+
+
 def warmup_lr_schedule(warmup_steps: int):
     def lr(step):
         return (step + 1) / warmup_steps if step < warmup_steps else 1.0
@@ -69,6 +163,11 @@ def train(hps: HyperParams, out_dir: str) -> None:
         hps.resume_from = 'verify/model-0.pt'
 
     next_model_save = hps.model_save_frequency
+    codecraft.request_metrics.enabled = hps.request_metrics
+    assert not (hps.double_buffered_rollout and hps.env_workers > 0), \
+        'SubprocCodeCraftVecEnv does not support the env subsets used by double buffered rollouts'
+    assert not (hps.async_rollout and (hps.verify or hps.verify_create_golden)), \
+        'verification mode requires synchronous rollouts'
 
     obs_config = obs_config_from(hps)
     if torch.cuda.is_available():
@@ -130,6 +229,8 @@ def train(hps: HyperParams, out_dir: str) -> None:
     if hps.parallelism > 1:
         sync_parameters(policy)
 
+    # Copied before wandb.watch adds its hooks, the snapshot of the policy that collects rollouts in async mode
+    actor_policy = copy.deepcopy(policy).eval() if hps.async_rollout else None
     if hps.rank == 0:
         wandb.watch(policy)
 
@@ -145,6 +246,16 @@ def train(hps: HyperParams, out_dir: str) -> None:
     buildmean = defaultdict(lambda: 0)
     completed_episodes = 0
     env = None
+    # In async mode, the actor fills one buffer while the learner optimizes on the other
+    rollouts = [RolloutBuffer(hps.seq_rosteps, hps.num_envs, obs_config, hps.agents,
+                              hps.objective.naction() + obs_config.extra_actions())
+                for _ in range(2 if hps.async_rollout else 1)]
+    actor = ThreadPoolExecutor(max_workers=1) if hps.async_rollout else None
+    pending_rollout = None
+    collected = None
+    metrics_logger = ThreadPoolExecutor(max_workers=1) if hps.rank == 0 else None
+    pending_metrics = None
+    metrics_rng = np.random.RandomState(0)
     num_self_play_schedule = hps.get_num_self_play_schedule()
     batches_per_update_schedule = hps.get_batches_per_update_schedule()
     entropy_bonus_schedule = parse_schedule(hps.entropy_bonus_schedule, hps.entropy_bonus, hps.steps)
@@ -159,12 +270,18 @@ def train(hps: HyperParams, out_dir: str) -> None:
     rewstd = 1.0
     average_cost_modifier = 1.0
     while total_steps < hps.steps + resume_steps:
+        # The env is only reconfigured while no rollout is in progress
+        rollout_wait = 0.0
+        if pending_rollout is not None:
+            wait_start = time.time()
+            collected = pending_rollout.result()
+            pending_rollout = None
+            rollout_wait = time.time() - wait_start
         if len(num_self_play_schedule) > 0 and num_self_play_schedule[-1][0] <= total_steps:
             _, num_self_play = num_self_play_schedule.pop()
             hps.num_self_play = num_self_play
             if env is not None:
-                env.close()
-                env = None
+                env.reassign(num_self_play=num_self_play)
         if len(batches_per_update_schedule) > 0 and batches_per_update_schedule[-1][0] <= total_steps:
             _, batches_per_update = batches_per_update_schedule.pop()
             hps.batches_per_update = batches_per_update
@@ -181,40 +298,48 @@ def train(hps: HyperParams, out_dir: str) -> None:
         adr.target_modifier = adr_avg_cost_schedule.value_at(total_steps)
 
         if env is None and not hps.verify:
-            env = envs.CodeCraftVecEnv(hps.num_envs,
-                                       hps.num_self_play,
-                                       hps.objective,
-                                       hps.action_delay,
-                                       randomize=hps.task_randomize,
-                                       use_action_masks=hps.use_action_masks,
-                                       obs_config=obs_config,
-                                       symmetric=hps.symmetric_map,
-                                       hardness=hps.task_hardness,
-                                       mix_mp=hps.mix_mp,
-                                       build_variety_bonus=hps.build_variety_bonus,
-                                       win_bonus=hps.win_bonus,
-                                       attac=hps.attac,
-                                       protec=hps.protec,
-                                       max_army_size_score=hps.max_army_size_score,
-                                       max_enemy_army_size_score=hps.max_enemy_army_size_score,
-                                       rule_rng_fraction=hps.rule_rng_fraction,
-                                       rule_rng_amount=hps.rule_rng_amount,
-                                       rule_cost_rng=hps.rule_cost_rng,
-                                       scripted_opponents=[
-                                           ("destroyer", hps.num_vs_destroyer),
-                                           ("replicator", hps.num_vs_replicator),
-                                           ("aggressive_replicator", hps.num_vs_aggro_replicator),
-                                       ],
-                                       max_game_length=None if hps.max_game_length == 0 else hps.max_game_length,
-                                       stagger_offset=hps.rank / hps.parallelism,
-                                       mothership_damage_scale=hps.mothership_damage_scale,
-                                       loss_penalty=hps.loss_penalty,
-                                       partial_score=hps.partial_score)
+            make_env = functools.partial(envs.SubprocCodeCraftVecEnv, hps.env_workers) if hps.env_workers > 0 \
+                else envs.CodeCraftVecEnv
+            env = make_env(hps.num_envs,
+                           hps.num_self_play,
+                           hps.objective,
+                           hps.action_delay,
+                           randomize=hps.task_randomize,
+                           use_action_masks=hps.use_action_masks,
+                           obs_config=obs_config,
+                           symmetric=hps.symmetric_map,
+                           hardness=hps.task_hardness,
+                           mix_mp=hps.mix_mp,
+                           build_variety_bonus=hps.build_variety_bonus,
+                           win_bonus=hps.win_bonus,
+                           attac=hps.attac,
+                           protec=hps.protec,
+                           max_army_size_score=hps.max_army_size_score,
+                           max_enemy_army_size_score=hps.max_enemy_army_size_score,
+                           rule_rng_fraction=hps.rule_rng_fraction,
+                           rule_rng_amount=hps.rule_rng_amount,
+                           rule_cost_rng=hps.rule_cost_rng,
+                           scripted_opponents=[
+                               ("destroyer", hps.num_vs_destroyer),
+                               ("replicator", hps.num_vs_replicator),
+                               ("aggressive_replicator", hps.num_vs_aggro_replicator),
+                           ],
+                           max_game_length=None if hps.max_game_length == 0 else hps.max_game_length,
+                           stagger_offset=hps.rank / hps.parallelism,
+                           mothership_damage_scale=hps.mothership_damage_scale,
+                           loss_penalty=hps.loss_penalty,
+                           partial_score=hps.partial_score,
+                           endpoints=parse_endpoints(hps.endpoints),
+                           game_pool_size=hps.game_pool_size,
+                           map_pool_size=hps.map_pool_size)
             env.rng_ruleset = adr.ruleset
             env.hardness = adr.hardness
             obs, action_masks, privileged_obs = env.reset()
 
         if total_steps >= next_eval and not hps.verify:
+            # Eval logs to wandb as well, which has to happen after the metrics of earlier steps
+            if pending_metrics is not None:
+                pending_metrics.result()
             if hps.eval_envs > 0:
                 eval(policy=policy,
                      num_envs=hps.eval_envs // hps.parallelism,
@@ -224,7 +349,8 @@ def train(hps: HyperParams, out_dir: str) -> None:
                      curr_step=total_steps,
                      symmetric=hps.eval_symmetric,
                      rank=hps.rank,
-                     parallelism=hps.parallelism)
+                     parallelism=hps.parallelism,
+                     endpoints=parse_endpoints(hps.endpoints))
             next_eval += hps.eval_frequency
             next_model_save -= 1
             if next_model_save == 0 and hps.rank == 0:
@@ -235,115 +361,79 @@ def train(hps: HyperParams, out_dir: str) -> None:
             save_policy(policy, out_dir, total_steps, optimizer, adr, lr_scheduler)
 
         episode_start = time.time()
-        entropies = []
-        all_obs = []
-        all_actions = []
-        all_probs = []
-        all_logprobs = []
-        all_values = []
-        all_rewards = []
-        all_dones = []
-        all_action_masks = []
-        all_privileged_obs = []
 
         policy.eval()
         buildtotal = defaultdict(lambda: 0)
         eliminations = []
         if not hps.verify:
-            if hps.adr:
-                env.rng_ruleset = adr.ruleset
-            if hps.adr or hps.linear_hardness:
-                env.hardness = adr.hardness
-            if hps.symmetry_increase > 0:
-                env.symmetric = min(total_steps * hps.symmetry_increase, 1.0)
-            with torch.no_grad():
-                # Rollout
-                for step in range(hps.seq_rosteps):
-                    obs_tensor = torch.tensor(obs).to(device)
-                    privileged_obs_tensor = torch.tensor(privileged_obs).to(device)
-                    action_masks_tensor = torch.tensor(action_masks).to(device)
-                    actions, logprobs, entropy, values, probs =\
-                        policy.evaluate(obs_tensor, action_masks_tensor, privileged_obs_tensor)
-                    actions = actions.cpu().numpy()
-
-                    entropies.extend(entropy.detach().cpu().numpy())
-
-                    all_action_masks.extend(action_masks)
-                    all_obs.extend(obs)
-                    all_privileged_obs.extend(privileged_obs)
-                    all_actions.extend(actions)
-                    all_logprobs.extend(logprobs.detach().cpu().numpy())
-                    all_values.extend(values)
-                    all_probs.extend(probs)
-
-                    obs, rews, dones, infos, action_masks, privileged_obs = env.step(actions, action_masks=action_masks)
-
-                    rews -= hps.liveness_penalty
-                    all_rewards.extend(rews)
-                    all_dones.extend(dones)
-
-                    for info in infos:
-                        ema = 0.95 * (1 - 1 / (completed_episodes + 1))
-
-                        decided_by_elimination = info['episode']['elimination']
-                        eliminations.append(decided_by_elimination)
-                        eliminationmean = eliminationmean * ema + (1 - ema) * decided_by_elimination
-
-                        eprewmean = eprewmean * ema + (1 - ema) * info['episode']['r']
-                        eplenmean = eplenmean * ema + (1 - ema) * info['episode']['l']
-
-                        builds = info['episode']['builds']
-                        for build in set().union(builds.keys(), buildmean.keys()):
-                            count = builds[build]
-                            buildmean[build] = buildmean[build] * ema + (1 - ema) * count
-                            buildtotal[build] += count
-                        completed_episodes += 1
+            if collected is None:
+                configure_rollout_env(env, hps, adr, total_steps)
+                collected = collect_rollout(policy, env, rollouts[iteration % len(rollouts)],
+                                            obs, action_masks, privileged_obs, hps, device, iteration)
+            rollout = collected.rollout
+            obs, action_masks, privileged_obs = collected.obs, collected.action_masks, collected.privileged_obs
+            final_values = collected.final_values
+            entropies = collected.entropies
+            policy_lag = iteration - collected.policy_iteration
+            rollout_duration = collected.duration
+            for info in collected.infos:
+                ema = 0.95 * (1 - 1 / (completed_episodes + 1))
+
+                decided_by_elimination = info['episode']['elimination']
+                eliminations.append(decided_by_elimination)
+                eliminationmean = eliminationmean * ema + (1 - ema) * decided_by_elimination
+
+                eprewmean = eprewmean * ema + (1 - ema) * info['episode']['r']
+                eplenmean = eplenmean * ema + (1 - ema) * info['episode']['l']
+
+                builds = info['episode']['builds']
+                for build in set().union(builds.keys(), buildmean.keys()):
+                    count = builds[build]
+                    buildmean[build] = buildmean[build] * ema + (1 - ema) * count
+                    buildtotal[build] += count
+                completed_episodes += 1
+            collected = None
 
             elimination_rate = np.array(eliminations).mean() if len(eliminations) > 0 else None
             if hps.adr:
                 average_cost_modifier = adr.adjust(buildtotal, elimination_rate, eplenmean, total_steps)
 
-            obs_tensor = torch.tensor(obs).to(device)
-            action_masks_tensor = torch.tensor(action_masks).to(device)
-            privileged_obs_tensor = torch.tensor(privileged_obs).to(device)
-            _, _, _, final_values, final_probs =\
-                policy.evaluate(obs_tensor, action_masks_tensor, privileged_obs_tensor)
+            if hps.async_rollout:
+                # The actor collects the next rollout with a snapshot of the current policy while the learner
+                # optimizes on this one, so rollouts are at most one update behind the policy they train.
+                configure_rollout_env(env, hps, adr, total_steps)
+                actor_policy.load_state_dict(policy.state_dict())
+                pending_rollout = actor.submit(collect_rollout, actor_policy, env,
+                                               rollouts[(iteration + 1) % len(rollouts)],
+                                               obs, action_masks, privileged_obs, hps, device, iteration)
 
-            all_rewards = np.array(all_rewards) * hps.rewscale
+            all_rewards = rollout.flat('rewards') * hps.rewscale
             w = hps.rewnorm_emaw * (1 - 1 / (total_steps + 1))
             rewmean = all_rewards.mean() * (1 - w) + rewmean * w
             rewstd = all_rewards.std() * (1 - w) + rewstd * w
             if hps.rewnorm:
                 all_rewards = all_rewards / rewstd - rewmean
 
-            all_returns = np.zeros(len(all_rewards), dtype=np.float32)
-            all_values = np.array(all_values)
-            last_gae = np.zeros(hps.num_envs)
-            gamma = gamma_schedule.value_at(total_steps)
-            for t in reversed(range(hps.seq_rosteps)):
-                for i in range(hps.num_envs):
-                    ti = t * hps.num_envs + i
-                    tnext_i = (t + 1) * hps.num_envs + i
-                    nextnonterminal = 1.0 - all_dones[ti]
-                    if t == hps.seq_rosteps - 1:
-                        next_value = final_values[i]
-                    else:
-                        next_value = all_values[tnext_i]
-                    td_error = all_rewards[ti] + gamma * next_value * nextnonterminal - all_values[ti]
-                    last_gae[i] = td_error + gamma * hps.lamb * last_gae[i] * nextnonterminal
-                    all_returns[ti] = last_gae[i] + all_values[ti]
+            all_values = rollout.flat('values')
+            rollout_shape = (hps.seq_rosteps, hps.num_envs)
+            all_returns = gae_returns(all_rewards.reshape(rollout_shape),
+                                      all_values.reshape(rollout_shape),
+                                      rollout.dones,
+                                      final_values,
+                                      gamma_schedule.value_at(total_steps),
+                                      hps.lamb).reshape(-1)
 
             advantages = all_returns - all_values
             if hps.norm_advs:
                 advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
             explained_var = explained_variance(all_values, all_returns)
 
-            all_actions = np.array(all_actions)
-            all_logprobs = np.array(all_logprobs)
-            all_obs = np.array(all_obs)
-            all_privileged_obs = np.array(all_privileged_obs)
-            all_action_masks = np.array(all_action_masks)[:, :hps.agents, :]
-            all_probs = np.array(all_probs)
+            all_actions = rollout.flat('actions')
+            all_logprobs = rollout.flat('logprobs')
+            all_obs = rollout.flat('obs')
+            all_privileged_obs = rollout.flat('privileged_obs')
+            all_action_masks = rollout.flat('action_masks')
+            all_probs = rollout.flat('probs')
 
         if hps.verify_create_golden and total_steps == 0:
             write_samples_to_disk(
@@ -356,18 +446,16 @@ def train(hps: HyperParams, out_dir: str) -> None:
                 all_values, advantages, all_action_masks, all_probs = load_samples_from_disk()
             print("Loaded samples for first rollout from disk")
 
+        # The rollout is converted to tensors once, which share memory with the rollout buffer on the CPU.
+        # Minibatches are gathered with index_select, so the policy is free to modify its inputs.
+        samples = [torch.from_numpy(array).to(device) for array in [
+            all_obs, all_privileged_obs, all_actions, all_logprobs, all_returns,
+            advantages, all_values, all_action_masks, all_probs]]
         for epoch in range(hps.epochs):
             if hps.shuffle:
-                perm = np.random.permutation(len(all_obs))
-                all_obs = all_obs[perm]
-                all_privileged_obs = all_privileged_obs[perm]
-                all_returns = all_returns[perm]
-                all_actions = all_actions[perm]
-                all_logprobs = all_logprobs[perm]
-                all_values = all_values[perm]
-                advantages = advantages[perm]
-                all_action_masks = all_action_masks[perm]
-                all_probs = all_probs[perm]
+                indices = torch.randperm(len(all_obs), device=device)
+            else:
+                indices = torch.arange(len(all_obs), device=device)
 
             # Policy Update
             policy_loss_sum = 0
@@ -386,15 +474,8 @@ def train(hps: HyperParams, out_dir: str) -> None:
                 start = hps.bs * batch
                 end = hps.bs * (batch + 1)
 
-                o = torch.tensor(all_obs[start:end]).to(device)
-                op = torch.tensor(all_privileged_obs[start:end]).to(device)
-                actions = torch.tensor(all_actions[start:end]).to(device)
-                probs = torch.tensor(all_logprobs[start:end]).to(device)
-                returns = torch.tensor(all_returns[start:end]).to(device)
-                advs = torch.tensor(advantages[start:end]).to(device)
-                vals = torch.tensor(all_values[start:end]).to(device)
-                amasks = torch.tensor(all_action_masks[start:end]).to(device)
-                actual_probs = torch.tensor(all_probs[start:end]).to(device)
+                o, op, actions, probs, returns, advs, vals, amasks, actual_probs = \
+                    [sample.index_select(0, indices[start:end]) for sample in samples]
 
                 policy_loss, value_loss, entropy_loss, aproxkl, clipfrac =\
                     policy.backprop(hps, o, actions, probs, returns, hps.vf_coef,
@@ -417,6 +498,7 @@ def train(hps: HyperParams, out_dir: str) -> None:
                     optimizer.step()
                     if lr_scheduler:
                         lr_scheduler.step()
+        del samples
         torch.cuda.empty_cache()
 
         if hps.verify or hps.verify_create_golden:
@@ -425,10 +507,11 @@ def train(hps: HyperParams, out_dir: str) -> None:
         epoch += 1
         total_steps += hps.rosteps * hps.parallelism
         iteration += 1
-        throughput = int(hps.rosteps / (time.time() - episode_start)) * hps.parallelism
+        throughput = int(hps.rosteps / (time.time() - episode_start + rollout_wait)) * hps.parallelism
 
-        all_agent_masks = all_action_masks.sum(2) > 1
         if hps.rank == 0 and hps.epochs > 0:
+            metrics_start = time.time()
+            all_agent_masks = all_action_masks.sum(2) > 1
             metrics = {
                 'policy_loss': policy_loss_sum / num_minibatches,
                 'value_loss': value_loss_sum / num_minibatches,
@@ -436,6 +519,9 @@ def train(hps: HyperParams, out_dir: str) -> None:
                 'clipfrac': clipfrac_sum / num_minibatches,
                 'aproxkl': aproxkl_sum / num_minibatches,
                 'throughput': throughput,
+                'rollout_throughput': int(hps.rosteps / rollout_duration) * hps.parallelism,
+                'rollout_wait': rollout_wait,
+                'policy_lag': policy_lag,
                 'eprewmean': eprewmean,
                 'eplenmean': eplenmean,
                 'target_eplenmean': adr.target_eplenmean(),
@@ -443,17 +529,11 @@ def train(hps: HyperParams, out_dir: str) -> None:
                 'entropy': sum(entropies) / len(entropies) / np.log(2),
                 'explained variance': explained_var,
                 'gradnorm': gradnorm * hps.bs / hps.rosteps,
-                'advantages': wandb.Histogram(advantages),
-                'values': wandb.Histogram(all_values),
                 'meanval': all_values.mean(),
-                'returns': wandb.Histogram(all_returns),
                 'meanret': all_returns.mean(),
-                'actions': wandb.Histogram(np.array(all_actions[all_agent_masks])),
                 'active_agents': all_agent_masks.sum() / all_agent_masks.size,
-                'observations': wandb.Histogram(np.array(all_obs)),
                 'obs_max': all_obs.max(),
                 'obs_min': all_obs.min(),
-                'rewards': wandb.Histogram(np.array(all_rewards)),
                 'masked_actions': 1 - all_action_masks.mean(),
                 'rewmean': rewmean,
                 'rewstd': rewstd,
@@ -471,19 +551,37 @@ def train(hps: HyperParams, out_dir: str) -> None:
                 metrics[f'frac_{action}'] = fraction
 
             metrics.update(adr.metrics())
-            total_norm = 0.0
-            count = 0
-            for name, param in policy.named_parameters():
-                norm = param.data.norm()
+            norms = parameter_norms(policy)
+            for name, norm in norms.items():
                 metrics[f'weight_norm[{name}]'] = norm
-                count += 1
-                total_norm += norm
-            metrics['mean_weight_norm'] = total_norm / count
-
-            wandb.log(metrics, step=total_steps)
+            metrics['mean_weight_norm'] = sum(norms.values()) / len(norms)
+            metrics.update(codecraft.request_metrics.summary())
+
+            # The rollout buffers are reused, so histograms are built on the metrics thread from sampled copies
+            histograms = {
+                'advantages': advantages,
+                'values': all_values,
+                'returns': all_returns,
+                'actions': all_actions[all_agent_masks],
+                'observations': all_obs,
+                'rewards': all_rewards,
+            }
+            histograms = {name: sample_values(values, hps.histogram_samples, metrics_rng)
+                          for name, values in histograms.items()}
+            metrics['metrics_time'] = time.time() - metrics_start
+            if pending_metrics is not None:
+                pending_metrics.result()
+            pending_metrics = metrics_logger.submit(log_metrics, metrics, histograms, total_steps)
+        codecraft.request_metrics.reset()
 
         print(f'{throughput} samples/s', flush=True)
 
+    if pending_rollout is not None:
+        pending_rollout.result()
+        actor.shutdown()
+    if pending_metrics is not None:
+        pending_metrics.result()
+        metrics_logger.shutdown()
     env.close()
 
     if hps.eval_envs > 0:
@@ -496,7 +594,8 @@ def train(hps: HyperParams, out_dir: str) -> None:
              symmetric=hps.eval_symmetric,
              printerval=hps.eval_timesteps,
              rank=hps.rank,
-             parallelism=hps.parallelism)
+             parallelism=hps.parallelism,
+             endpoints=parse_endpoints(hps.endpoints))
     if hps.rank == 0:
         save_policy(policy, out_dir, total_steps, optimizer, adr, lr_scheduler)
 
@@ -514,7 +613,8 @@ def eval(policy,
          symmetric=True,
          random_rules=0.0,
          rank=0,
-         parallelism=1):
+         parallelism=1,
+         endpoints=None):
     start_time = time.time()
 
     if printerval is None:
@@ -588,7 +688,8 @@ def eval(policy,
                                symmetric=1.0 if symmetric else 0.0,
                                scripted_opponents=[(o, num_envs // n_opponent) for o in scripted_opponents],
                                rule_rng_amount=random_rules,
-                               rule_rng_fraction=1.0 if random_rules > 0 else 0.0)
+                               rule_rng_fraction=1.0 if random_rules > 0 else 0.0,
+                               endpoints=endpoints)
 
     scores = []
     eliminations = []
@@ -625,7 +726,7 @@ def eval(policy,
         privileged_obs_tensor = torch.tensor(privileged_obs).to(device)
         action_masks_tensor = torch.tensor(action_masks).to(device)
         actionsp, _, _, _, _ = policy.evaluate(obs_tensor, action_masks_tensor, privileged_obs_tensor)
-        env.step_async(actionsp.cpu(), policy_envs)
+        step_partitions = [(policy_envs, policy.obs_config, actionsp.cpu())]
 
         for _, opp in opponents.items():
             i = opp['i']
@@ -635,13 +736,14 @@ def eval(policy,
             actions_opp, _, _, _, _ = opp['policy'].evaluate(obs_opp_tensor,
                                                              action_masks_opp_tensor,
                                                              privileged_obs_opp_tensor)
-            env.step_async(actions_opp.cpu(), opp['envs'])
+            step_partitions.append((opp['envs'], opp['obs_config'], actions_opp.cpu()))
 
-        obs, _, _, infos, action_masks, privileged_obs = env.observe(policy_envs)
+        # Acts and observes all partitions with a single request each
+        results = env.step_partitioned(step_partitions)
+        obs, _, _, infos, action_masks, privileged_obs = results[0]
         for _, opp in opponents.items():
             i = opp['i']
-            obs_opps[i], _, _, _, action_masks_opps[i], privileged_obs_opps[i] = \
-                env.observe(opp['envs'], opp['obs_config'])
+            obs_opps[i], _, _, _, action_masks_opps[i], privileged_obs_opps[i] = results[1 + i]
 
         for info in infos:
             index = info['episode']['index']
@@ -718,6 +820,7 @@ def obs_config_from(hps: HyperParams) -> ObsConfig:
             harvest_action=hps.harvest_action,
             lock_build_action=hps.lock_build_action,
             feat_dist_to_wall=hps.feat_dist_to_wall,
+            encoding=hps.obs_encoding,
         )
 
 
@@ -849,6 +952,34 @@ def explained_variance(ypred,y):
     return np.nan if vary == 0 else 1 - np.var(y-ypred)/vary
 
 
+def sample_values(array: np.ndarray, max_samples: int, rng: np.random.RandomState) -> np.ndarray:
+    """
+    Returns a flat copy of `array`, or `max_samples` of its values drawn uniformly with replacement if it has more.
+    `max_samples` 0 always copies all values.
+    """
+    values = array.reshape(-1)
+    if max_samples == 0 or values.size <= max_samples:
+        return values.copy()
+    return values[rng.randint(values.size, size=max_samples)]
+
+
+def parameter_norms(model) -> Dict[str, float]:
+    """Computes the norms of all parameters of `model` on the device and transfers them together."""
+    names, params = zip(*model.named_parameters())
+    with torch.no_grad():
+        norms = torch.stack([param.norm().float() for param in params])
+    return dict(zip(names, norms.tolist()))
+
+
+def log_metrics(metrics: Dict[str, float], histograms: Dict[str, np.ndarray], step: int) -> None:
+    """Builds the histograms and logs them together with `metrics`, on the thread that logs metrics in the background."""
+    start = time.time()
+    for name, values in histograms.items():
+        metrics[name] = wandb.Histogram(values)
+    metrics['metrics_background_time'] = time.time() - start
+    wandb.log(metrics, step=step)
+
+
 def load_samples_from_disk():
     return np.load('verify/obs.npy'), np.load('verify/privileged_obs.npy'), np.load('verify/returns.npy'),\
         np.load('verify/actions.npy'), np.load('verify/logprobs.npy'), np.load('verify/values.npy'),\
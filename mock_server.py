@@ -0,0 +1,316 @@
+import logging
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import click
+import numpy as np
+import orjson
+
+from codecraft import ObsConfig, OBS_ENCODING_HEADER, PARTITION_LENGTHS_HEADER, UNIX_SOCKET_PREFIX
+
+
+class MockCodeCraftServer:
+    """
+    Local stand-in for the CodeCraft server that can run in-process, for benchmarking and testing the client
+    without a JVM.
+
+    No games are actually simulated, the server only implements the HTTP API with correctly shaped responses.
+    Observations are random, every action advances a game by one tick, and games end after `episode_length`
+    ticks or, if that is not set, after the game length they were created with.
+    Endpoints that are newer than some server versions can be disabled to exercise the client's fallbacks.
+
+    If `socket_path` is set, the server listens on a Unix domain socket at that path instead of `host` and `port`.
+    """
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 9000,
+                 batch_start_game: bool = True,
+                 binary_actions: bool = True,
+                 obs_encodings: bool = True,
+                 partitioned_observations: bool = True,
+                 abandon_games: bool = True,
+                 create_latency: float = 0.0,
+                 episode_length: Optional[int] = None,
+                 seed: int = 0,
+                 socket_path: Optional[str] = None):
+        self.obs_encodings = obs_encodings
+        self.create_latency = create_latency
+        self.episode_length = episode_length
+        self.noise = np.random.RandomState(seed).uniform(-1, 1, 1 << 20).astype(np.float32)
+        self.lock = threading.Lock()
+        self.games = {}
+        self.next_game_id = 0
+        self.build_tables = []
+        self.routes = {
+            ('POST', '/start-game'): self.start_game,
+            ('POST', '/batch-act'): self.batch_act,
+            ('GET', '/observation'): self.observation,
+            ('GET', '/batch-observation'): self.batch_observation,
+        }
+        if batch_start_game:
+            self.routes[('POST', '/batch-start-game')] = self.batch_start_game
+        if binary_actions:
+            self.routes[('POST', '/build-table')] = self.build_table
+            self.routes[('POST', '/batch-act-binary')] = self.batch_act_binary
+        if partitioned_observations:
+            self.routes[('POST', '/batch-observation-multi')] = self.batch_observation_multi
+        if abandon_games:
+            self.routes[('POST', '/batch-abandon-game')] = self.batch_abandon_game
+        self.socket_path = socket_path
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.httpd = ThreadingUnixHTTPServer(socket_path, _handler(self, tcp=False))
+        else:
+            self.httpd = ThreadingHTTPServer((host, port), _handler(self, tcp=True))
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint(self) -> str:
+        if self.socket_path is not None:
+            return f'{UNIX_SOCKET_PREFIX}{self.socket_path}'
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockCodeCraftServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def start_game(self, params, body):
+        return orjson.dumps({'id': self._create_game(params, body)})
+
+    def batch_start_game(self, params, body):
+        return orjson.dumps([self._create_game(spec, spec['map']) for spec in body])
+
+    def batch_abandon_game(self, params, body):
+        with self.lock:
+            for game_id in body:
+                del self.games[game_id]
+        return b''
+
+    def batch_act(self, params, body):
+        with self.lock:
+            for key in body:
+                game_id, player_id = key.split('.')
+                self._tick(int(game_id), int(player_id))
+        return b''
+
+    def build_table(self, params, body):
+        with self.lock:
+            self.build_tables.append(body)
+            return orjson.dumps({'id': len(self.build_tables) - 1})
+
+    def batch_act_binary(self, params, body):
+        count = int(np.frombuffer(body, dtype='<i4', count=1)[0])
+        game_ids = np.frombuffer(body, dtype='<i4', count=2 * count, offset=4).reshape(count, 2)
+        actions = np.frombuffer(body, dtype=np.int8, offset=4 + 8 * count).reshape(count, int(params['drones']), 4)
+        assert actions[:, :, 2].max(initial=-1) < len(self.build_tables[int(params['buildTable'])])
+        with self.lock:
+            for game_id, player_id in game_ids:
+                self._tick(int(game_id), int(player_id))
+        return b''
+
+    def observation(self, params, body):
+        return orjson.dumps(self._observation(int(params['gameID']), int(params.get('playerID', 0))))
+
+    def batch_observation(self, params, body):
+        game_ids, extra_build_actions = body
+        if params.get('json') != 'false':
+            return orjson.dumps([self._observation(game_id, player_id) for game_id, player_id in game_ids])
+
+        obs_config = ObsConfig(**{field: parse(params[name])
+                                  for name, (field, parse) in OBS_CONFIG_PARAMS.items() if name in params})
+        num_games = len(game_ids)
+        naction = 8 + len(extra_build_actions) + obs_config.extra_actions()
+        nonobs = np.zeros((num_games, obs_config.nonobs_features()), dtype=np.float32)
+        with self.lock:
+            for i, (game_id, player_id) in enumerate(game_ids):
+                if self._finished(game_id):
+                    # Winner is 1 + index of winning player
+                    nonobs[i, 0] = 1 + player_id
+        nonobs[:, 1:3] = np.abs(self._noise(2 * num_games).reshape(num_games, 2)) * 10
+        nonobs[:, 3:5] = np.abs(self._noise(2 * num_games).reshape(num_games, 2))
+        obs = self._noise(num_games * obs_config.stride())
+        action_masks = np.ones(num_games * obs_config.allies * naction, dtype=np.float32)
+
+        encoding = params.get('encoding', 'float32') if self.obs_encodings else 'float32'
+        if encoding == 'float16':
+            content = np.concatenate([obs, nonobs.flatten(), action_masks]).astype('<f2').tobytes()
+        elif encoding == 'int8':
+            obs = obs.reshape(num_games, obs_config.stride())
+            scales = np.abs(obs).max(axis=0, initial=0) / 127
+            scales[scales == 0] = 1
+            content = b''.join([
+                scales.astype('<f4').tobytes(),
+                np.round(obs / scales).astype(np.int8).tobytes(),
+                nonobs.tobytes(),
+                action_masks.astype(np.int8).tobytes(),
+            ])
+        else:
+            return b''.join([obs.tobytes(), nonobs.tobytes(), action_masks.tobytes()])
+        return content, {OBS_ENCODING_HEADER: encoding}
+
+    def batch_observation_multi(self, params, body):
+        contents = []
+        encodings = []
+        for query, game_ids in body['partitions']:
+            content = self.batch_observation(dict(parse_qsl(query)), [game_ids, body['buildActions']])
+            content, headers = content if isinstance(content, tuple) else (content, {})
+            contents.append(content)
+            encodings.append(headers.get(OBS_ENCODING_HEADER, 'float32'))
+        return b''.join(contents), {
+            PARTITION_LENGTHS_HEADER: ','.join(str(len(content)) for content in contents),
+            OBS_ENCODING_HEADER: ','.join(encodings),
+        }
+
+    def _observation(self, game_id, player_id):
+        with self.lock:
+            return {
+                'timestep': self.games[game_id]['tick'],
+                'winner': 1 + player_id if self._finished(game_id) else None,
+            }
+
+    def _noise(self, size) -> np.ndarray:
+        return self.noise[:size] if size <= len(self.noise) else np.resize(self.noise, size)
+
+    def _finished(self, game_id) -> bool:
+        game = self.games[game_id]
+        length = self.episode_length or game['max_ticks']
+        return 0 < length <= game['tick']
+
+    def _tick(self, game_id, player_id):
+        if player_id == 0:
+            self.games[game_id]['tick'] += 1
+
+    def _create_game(self, settings, custom_map) -> int:
+        if self.create_latency > 0:
+            time.sleep(self.create_latency)
+        with self.lock:
+            self.next_game_id += 1
+            game_id = self.next_game_id
+            self.games[game_id] = {
+                'max_ticks': int(settings.get('maxTicks') or 0),
+                'tick': 0,
+                'map': custom_map,
+            }
+        return game_id
+
+
+def _scalabool(value: str) -> bool:
+    return value == 'true'
+
+
+# Maps query parameters of /batch-observation to ObsConfig fields
+OBS_CONFIG_PARAMS = {
+    'allies': ('allies', int),
+    'drones': ('drones', int),
+    'minerals': ('minerals', int),
+    'tiles': ('tiles', int),
+    'globalDrones': ('global_drones', int),
+    'relativePositions': ('relative_positions', _scalabool),
+    'lastSeen': ('feat_last_seen', _scalabool),
+    'mapSize': ('feat_map_size', _scalabool),
+    'isVisible': ('feat_is_visible', _scalabool),
+    'abstime': ('feat_abstime', _scalabool),
+    'v2': ('v2', _scalabool),
+    'ruleMsdm': ('feat_rule_msdm', _scalabool),
+    'ruleCosts': ('feat_rule_costs', _scalabool),
+    'mineralClaims': ('feat_mineral_claims', _scalabool),
+    'harvestAction': ('harvest_action', _scalabool),
+    'lockBuildAction': ('lock_build_action', _scalabool),
+    'distanceToWall': ('feat_dist_to_wall', _scalabool),
+}
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def _handler(server: MockCodeCraftServer, tcp: bool):
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps connections alive between requests
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately, which otherwise stalls on delayed ACKs
+        disable_nagle_algorithm = tcp
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def _dispatch(self, method):
+            url = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length) if length > 0 else b''
+            route = server.routes.get((method, url.path))
+            if route is None:
+                self._respond(404, b'')
+                return
+            if self.headers.get('Content-Type', '').startswith('application/octet-stream'):
+                payload = body
+            else:
+                payload = orjson.loads(body) if body else None
+            try:
+                content = route(dict(parse_qsl(url.query)), payload)
+            except Exception:
+                logging.exception(f'Error handling {method} {self.path}')
+                self._respond(500, b'')
+                return
+            # Routes return either the response body, or the body and additional headers
+            if isinstance(content, tuple):
+                self._respond(200, *content)
+            else:
+                self._respond(200, content)
+
+        def _respond(self, status, content, headers=None):
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(content)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=9000)
+@click.option('--batch-start-game/--no-batch-start-game', default=True)
+@click.option('--binary-actions/--no-binary-actions', default=True)
+@click.option('--obs-encodings/--no-obs-encodings', default=True)
+@click.option('--partitioned-observations/--no-partitioned-observations', default=True)
+@click.option('--abandon-games/--no-abandon-games', default=True)
+@click.option('--create-latency', default=0.0, help='Seconds spent creating each game')
+@click.option('--episode-length', type=int, help='Number of ticks after which games end, defaults to game length')
+@click.option('--socket-path', help='Listen on this Unix domain socket instead of host and port')
+def mock_server(host, port, batch_start_game, binary_actions, obs_encodings, partitioned_observations, abandon_games,
+                create_latency, episode_length, socket_path):
+    server = MockCodeCraftServer(host, port, batch_start_game, binary_actions, obs_encodings,
+                                 partitioned_observations, abandon_games, create_latency, episode_length,
+                                 socket_path=socket_path)
+    logging.info(f'Serving mock CodeCraft server on {server.endpoint}')
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    mock_server()
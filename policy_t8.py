@@ -56,12 +56,7 @@ class TransformerPolicy8(nn.Module):
         else:
             raise Exception(f'Unexpected normalization layer {hps.norm}')
 
-        endglobals = self.obs_config.endglobals()
-        endallies = self.obs_config.endallies()
-        endenemies = self.obs_config.endenemies()
-        endmins = self.obs_config.endmins()
-        endtiles = self.obs_config.endtiles()
-        endallenemies = self.obs_config.endallenemies()
+        layout = obs_config.layout()
 
         if hasattr(hps, 'rotational_invariance'):
             rotational_invariance = hps.rotational_invariance
@@ -82,9 +77,8 @@ class TransformerPolicy8(nn.Module):
                 obs_config.dstride(),
                 hps.d_item // 2, hps.d_item // 2 * hps.dff_ratio, norm_fn, hps.item_ff,
                 mask_feature=7,  # Feature 7 is hitpoints
-                count=obs_config.drones,
-                start=endglobals,
-                end=endenemies,
+                layout=layout,
+                section='drones',
                 rotate=rotational_invariance,
             ))
         else:
@@ -92,38 +86,33 @@ class TransformerPolicy8(nn.Module):
                 self.item_nets.append(PosItemBlock(
                     obs_config.dstride(), hps.d_item // 2, hps.d_item // 2 * hps.dff_ratio, norm_fn, hps.item_ff,
                     mask_feature=7,  # Feature 7 is hitpoints
-                    count=obs_config.allies,
-                    start=endglobals,
-                    end=endallies,
+                    layout=layout,
+                    section='allies',
                     rotate=rotational_invariance,
                 ))
             if self.nenemy > 0:
                 self.item_nets.append(PosItemBlock(
                     obs_config.dstride(), hps.d_item // 2, hps.d_item // 2 * hps.dff_ratio, norm_fn, hps.item_ff,
                     mask_feature=7,  # Feature 7 is hitpoints
-                    count=obs_config.drones - self.obs_config.allies,
-                    start=endallies,
-                    end=endenemies,
-                    start_privileged=endtiles if hps.use_privileged else None,
-                    end_privileged=endallenemies if hps.use_privileged else None,
+                    layout=layout,
+                    section='enemies',
+                    privileged_section='privileged_enemies' if hps.use_privileged else None,
                     rotate=rotational_invariance,
                 ))
         if hps.nmineral > 0:
             self.item_nets.append(PosItemBlock(
                 obs_config.mstride(), hps.d_item // 2, hps.d_item // 2 * hps.dff_ratio, norm_fn, hps.item_ff,
                 mask_feature=2,  # Feature 2 is size
-                count=obs_config.minerals,
-                start=endenemies,
-                end=endmins,
+                layout=layout,
+                section='minerals',
                 rotate=rotational_invariance,
             ))
         if hps.ntile > 0:
             self.item_nets.append(PosItemBlock(
                 obs_config.tstride(), hps.d_item // 2, hps.d_item // 2 * hps.dff_ratio, norm_fn, hps.item_ff,
                 mask_feature=2,  # Feature is elapsed since last visited time
-                count=obs_config.tiles,
-                start=endmins,
-                end=endtiles,
+                layout=layout,
+                section='tiles',
                 rotate=rotational_invariance,
             ))
         if hps.nconstant > 0:
@@ -281,14 +270,11 @@ class TransformerPolicy8(nn.Module):
     def latents(self, x, action_masks):
         batch_size = x.size()[0]
 
-        endglobals = self.obs_config.endglobals()
-        endallies = self.obs_config.endallies()
-
-        globals = x[:, :endglobals]
+        layout = self.obs_config.layout()
+        globals = layout.items(x, 'globals')
 
         # properties of the drone controlled by this network
-        xagent = x[:, endglobals:endallies]\
-            .view(batch_size, self.obs_config.allies, self.obs_config.dstride())[:, :self.agents, :]
+        xagent = layout.items(x, 'allies')[:, :self.agents, :]
         globals = globals.view(batch_size, 1, self.obs_config.global_features()) \
             .expand(batch_size, self.agents, self.obs_config.global_features())
         xagent = torch.cat([xagent, globals], dim=2)
@@ -322,7 +308,7 @@ class TransformerPolicy8(nn.Module):
             sparse_relpos_list.append(sparse_relpos)
             relpos_sparsity_list.append(relpos_sparsity)
 
-            if item_net.start_privileged is not None:
+            if item_net.privileged_section is not None:
                 pemb, pmask = item_net(x, privileged=True)
                 pemb_list.append(pemb)
                 pmask_list.append(pmask)
@@ -438,6 +424,10 @@ class InputNorm(nn.Module):
         self.float()
         self.fp16 = True
 
+    def _load_from_state_dict(self, *args, **kwargs):
+        super(InputNorm, self)._load_from_state_dict(*args, **kwargs)
+        self._dirty = True
+
     def stddev(self):
         if self._dirty:
             sd = torch.sqrt(self.squares_sum / (self.count - 1))
@@ -487,11 +477,9 @@ class PosItemBlock(nn.Module):
                  norm_fn,
                  resblock,
                  mask_feature,
-                 count,
-                 start,
-                 end,
-                 start_privileged=None,
-                 end_privileged=None,
+                 layout,
+                 section,
+                 privileged_section=None,
                  rotate=True):
         super(PosItemBlock, self).__init__()
 
@@ -501,18 +489,14 @@ class PosItemBlock(nn.Module):
         self.mask_feature = mask_feature
         if resblock:
             self.resblock = FFResblock(d_model, d_ff, norm_fn)
-        self.count = count
-        self.start = start
-        self.end = end
-        self.start_privileged = start_privileged
-        self.end_privileged = end_privileged
+        # Zero-copy views of the items of `section` and `privileged_section` in the flat observations
+        self.layout = layout
+        self.section = section
+        self.privileged_section = privileged_section
         self.rotate = rotate
 
     def forward(self, x, privileged=False):
-        if privileged:
-            x = x[:, self.start_privileged:self.end_privileged].view(-1, self.count, self.d_in)
-        else:
-            x = x[:, self.start:self.end].view(-1, self.count, self.d_in)
+        x = self.layout.items(x, self.privileged_section if privileged else self.section)
 
         select = x[:, :, self.mask_feature] != 0
 
@@ -532,7 +516,7 @@ class PosItemBlock(nn.Module):
 
     def relpos(self, x, indices, origin, direction):
         batch_agents, _ = origin.size()
-        x = x[:, self.start:self.end].view(-1, self.count, self.d_in)
+        x = self.layout.items(x, self.section)
         mask = (x[:, :, self.mask_feature] != 0)[indices]
         pos = x[indices, :, 0:2]
         relpos = spatial.unbatched_relative_positions(origin, direction, pos, self.rotate)
@@ -0,0 +1,57 @@
+from typing import List, Optional
+
+import numpy as np
+
+from codecraft import ObsConfig
+
+
+class RolloutBuffer:
+    """
+    Preallocated storage for the samples of one rollout, laid out as `[seq_rosteps, num_envs, ...]`.
+
+    `add` and `add_rewards` copy the rows of the envs that were stepped into the buffer in place, so the same
+    arrays are reused by every rollout. `flat` returns `[seq_rosteps * num_envs, ...]` views ordered by step and
+    env, the layout that the policy update takes minibatches from.
+    """
+
+    def __init__(self, seq_rosteps: int, num_envs: int, obs_config: ObsConfig, agents: int, naction: int):
+        self.seq_rosteps = seq_rosteps
+        self.num_envs = num_envs
+        shape = (seq_rosteps, num_envs)
+        self.obs = np.zeros(shape + (obs_config.stride(),), dtype=np.float32)
+        self.privileged_obs = np.zeros(shape + (1,), dtype=np.float32)
+        self.action_masks = np.zeros(shape + (agents, naction), dtype=np.float32)
+        self.actions = np.zeros(shape + (agents,), dtype=np.int64)
+        self.logprobs = np.zeros(shape + (agents,), dtype=np.float32)
+        self.probs = np.zeros(shape + (agents, naction), dtype=np.float32)
+        self.values = np.zeros(shape, dtype=np.float32)
+        self.rewards = np.zeros(shape, dtype=np.float32)
+        self.dones = np.zeros(shape, dtype=np.float64)
+
+    def add(self, step: int, envs: Optional[List[int]], obs, privileged_obs, action_masks, actions, logprobs,
+            values, probs):
+        """Stores the observations of `envs` at `step` and the actions that were sampled for them."""
+        envs = _env_slice(envs)
+        agents = self.actions.shape[2]
+        self.obs[step, envs] = obs
+        self.privileged_obs[step, envs] = privileged_obs
+        self.action_masks[step, envs] = action_masks[:, :agents]
+        self.actions[step, envs] = actions
+        self.logprobs[step, envs] = logprobs
+        self.values[step, envs] = values
+        self.probs[step, envs] = probs
+
+    def add_rewards(self, step: int, envs: Optional[List[int]], rewards, dones):
+        """Stores the rewards and dones that `envs` received for their actions at `step`."""
+        envs = _env_slice(envs)
+        self.rewards[step, envs] = rewards
+        self.dones[step, envs] = dones
+
+    def flat(self, name: str) -> np.ndarray:
+        array = getattr(self, name)
+        return array.reshape(self.seq_rosteps * self.num_envs, *array.shape[2:])
+
+
+def _env_slice(envs: Optional[List[int]]) -> slice:
+    # Rollout groups are contiguous, so basic indexing copies rows without gathering them
+    return slice(None) if envs is None else slice(envs[0], envs[-1] + 1)
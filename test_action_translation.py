@@ -0,0 +1,89 @@
+from collections import defaultdict
+
+import numpy as np
+
+import codecraft
+from gym_codecraft.envs.codecraft_vec_env import CodeCraftVecEnv, Objective
+
+
+# Per drone implementation of the action translation that step_async used before the lookup table
+def reference_game_actions(env, actions, action_masks):
+    game_actions = []
+    performed_builds = [defaultdict(lambda: 0) for _ in env.games]
+    for (i, ((game_id, player_id, opponent), player_actions)) in enumerate(zip(env.games, actions)):
+        player_actions2 = []
+        for (drone_index, action) in enumerate(player_actions):
+            move = False
+            harvest = False
+            turn = 0
+            build = []
+            lockBuildAction = False
+            unlockBuildAction = False
+            if action == 0 or action == 1 or action == 2:
+                move = True
+            if action == 0 or action == 3:
+                turn = -1
+            if action == 2 or action == 5:
+                turn = 1
+            if action == 6:
+                build = [[0, 1, 0, 0, 0]]
+            if action == 7:
+                harvest = True
+            if action >= 8 + len(env.builds) and env.obs_config.lock_build_action:
+                if action == 8 + len(env.builds):
+                    lockBuildAction = True
+                elif action == 8 + len(env.builds) + 1:
+                    unlockBuildAction = True
+            elif action >= 8:
+                b = action - 8
+                if b < len(env.builds):
+                    build = [env.builds[b]]
+                else:
+                    build = [[0, 1, 0, 0, 0]]
+            if len(build) > 0 and action_masks[i][drone_index][action] == 1.0:
+                performed_builds[i][reference_build_name(build[0])] += 1
+            player_actions2.append((move, turn, build, harvest, lockBuildAction, unlockBuildAction))
+        game_actions.append((game_id, player_id, player_actions2))
+    return game_actions, performed_builds
+
+
+def reference_build_name(build):
+    [storage, missile, constructor, engine, shield] = build
+    repr = ''
+    if storage > 0:
+        repr += f'{storage}s'
+    if missile > 0:
+        repr += f'{missile}m'
+    if constructor > 0:
+        repr += f'{constructor}c'
+    if engine > 0:
+        repr += f'{engine}e'
+    if shield > 0:
+        repr += f'{shield}p'
+    return repr
+
+
+rng = np.random.RandomState(0)
+for objective in [Objective.ARENA_TINY_2V2, Objective.ARENA, Objective.STANDARD]:
+    for lock_build_action in [False, True]:
+        obs_config = codecraft.ObsConfig(allies=4, drones=8, minerals=2, tiles=0, global_drones=4,
+                                         lock_build_action=lock_build_action)
+        env = CodeCraftVecEnv(16, 4, objective, 0, obs_config=obs_config)
+        for game_id in range(12):
+            env._add_game(game_id, self_play=game_id < 4, opponent='none')
+        naction = env.base_naction + obs_config.extra_actions()
+
+        for step in range(10):
+            actions = rng.randint(0, naction, size=(16, obs_config.allies))
+            action_masks = (rng.uniform(size=(16, obs_config.allies, naction)) < 0.7).astype(np.float32)
+            expected_actions, expected_builds = reference_game_actions(env, actions, action_masks)
+
+            env.build_counts[:] = 0
+            game_ids, packed_actions = env._packed_actions(actions, action_masks=action_masks)
+            assert codecraft.unpack_actions(game_ids, packed_actions, env.build_table) == expected_actions
+            for i, builds in enumerate(expected_builds):
+                assert env._performed_builds(i) == builds, (objective, i, env._performed_builds(i), builds)
+
+        env.client.close()
+
+print('OK')
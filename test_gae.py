@@ -0,0 +1,48 @@
+import numpy as np
+import torch
+
+from gae import gae_returns
+
+
+# Per env and step implementation of the returns computation that main.train used before gae_returns
+def reference_returns(all_rewards, all_values, all_dones, final_values, gamma, lamb, seq_rosteps, num_envs):
+    all_returns = np.zeros(len(all_rewards), dtype=np.float32)
+    last_gae = np.zeros(num_envs)
+    for t in reversed(range(seq_rosteps)):
+        for i in range(num_envs):
+            ti = t * num_envs + i
+            tnext_i = (t + 1) * num_envs + i
+            nextnonterminal = 1.0 - all_dones[ti]
+            if t == seq_rosteps - 1:
+                next_value = final_values[i]
+            else:
+                next_value = all_values[tnext_i]
+            td_error = all_rewards[ti] + gamma * next_value * nextnonterminal - all_values[ti]
+            last_gae[i] = td_error + gamma * lamb * last_gae[i] * nextnonterminal
+            all_returns[ti] = last_gae[i] + all_values[ti]
+    return all_returns
+
+
+rng = np.random.RandomState(0)
+for seq_rosteps, num_envs in [(1, 1), (1, 7), (16, 1), (64, 32), (128, 128)]:
+    for gamma, lamb in [(0.99, 0.95), (0.999, 1.0), (1.0, 0.0)]:
+        rewards = rng.normal(size=seq_rosteps * num_envs).astype(np.float32)
+        values = rng.normal(size=seq_rosteps * num_envs).astype(np.float32)
+        dones = (rng.uniform(size=seq_rosteps * num_envs) < 0.05).astype(np.float64)
+        final_values = rng.normal(size=num_envs).astype(np.float32)
+        expected = reference_returns(rewards, values, dones, final_values, gamma, lamb, seq_rosteps, num_envs)
+
+        shape = (seq_rosteps, num_envs)
+        returns = gae_returns(rewards.reshape(shape), values.reshape(shape), dones.reshape(shape), final_values,
+                              gamma, lamb)
+        assert returns.dtype == np.float32
+        assert np.allclose(returns.reshape(-1), expected, rtol=1e-6, atol=1e-6), (seq_rosteps, num_envs, gamma, lamb)
+
+        returns = gae_returns(torch.tensor(rewards.reshape(shape), dtype=torch.float64),
+                              torch.tensor(values.reshape(shape), dtype=torch.float64),
+                              torch.tensor(dones.reshape(shape)),
+                              torch.tensor(final_values, dtype=torch.float64),
+                              gamma, lamb)
+        assert np.allclose(returns.numpy().reshape(-1), expected, rtol=1e-6, atol=1e-6), (seq_rosteps, num_envs)
+
+print('OK')
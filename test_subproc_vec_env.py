@@ -0,0 +1,39 @@
+import numpy as np
+
+import codecraft
+from gym_codecraft.envs.codecraft_vec_env import CodeCraftVecEnv, Objective
+from gym_codecraft.envs.subproc_vec_env import SubprocCodeCraftVecEnv
+from mock_server import MockCodeCraftServer
+
+
+if __name__ == '__main__':
+    server = MockCodeCraftServer(port=9263, episode_length=5).start()
+    endpoints = ['http://127.0.0.1:9263']
+
+    # Forwarded attributes can be read back before they are assigned, with the same defaults as CodeCraftVecEnv
+    env = SubprocCodeCraftVecEnv(2, 6, 1, Objective.ARENA_TINY_2V2, 0, endpoints=endpoints)
+    single = CodeCraftVecEnv(6, 1, Objective.ARENA_TINY_2V2, 0, endpoints=endpoints)
+    for name in SubprocCodeCraftVecEnv.FORWARDED_ATTRIBUTES:
+        assert getattr(env, name) == getattr(single, name), (name, getattr(env, name), getattr(single, name))
+    single.client.close()
+    env.close()
+
+    env = SubprocCodeCraftVecEnv(2, 6, 1, Objective.ARENA_TINY_2V2, 0, endpoints=endpoints,
+                                 hardness=3, symmetric=0.5, mothership_damage_scale=2.0)
+    assert (env.hardness, env.symmetric, env.mothership_damage_scale, env.rng_ruleset) == (3, 0.5, 2.0, None)
+    env.mothership_damage_scale = 1.0
+    assert env.mothership_damage_scale == 1.0
+    env.close()
+
+    # Requests of the workers are recorded in the request metrics of this process
+    codecraft.request_metrics.enabled = True
+    env = SubprocCodeCraftVecEnv(2, 6, 1, Objective.ARENA_TINY_2V2, 0, endpoints=endpoints)
+    env.reset()
+    for _ in range(3):
+        env.step(np.zeros((6, 2), dtype=np.int64))
+    metrics = codecraft.request_metrics.summary()
+    assert metrics['requests/create_games_calls'] == 2, metrics
+    assert metrics['requests/observe_batch_raw_calls'] == 8, metrics
+    env.close()
+
+    print('OK')